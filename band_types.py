@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Per-band data types for the multiband outputs.
+
+A GeoTIFF has a single data type for all of its bands, so forcing every
+band to Float32 (what 'create_multiband' used to do) inflates integer
+layers 2-4x. Here each band gets its own target type: the raw integer
+values are kept (scale/offset stay as band metadata, never applied), and
+'auto' picks the smallest integer type that holds the band's range, e.g.
+uint8 for the kg* Köppen class layers. Bands are then grouped by type and
+nodata (a GeoTIFF stores a single nodata value) and each group is written
+as its own band-separate multiband file.
+
+Example::
+
+    paths = create_typed_multibands("crops/CHELSA", crops, band_types="auto")
+    # {"Byte": "crops/CHELSA_Byte.tif", "Int16": "crops/CHELSA_Int16.tif"}
+    # or, if two Int16 groups differ in nodata:
+    # {..., "Int16_nodata-32768": ..., "Int16_nodata-9999": ...}
+"""
+
+from pathlib import Path
+
+import numpy as np
+from osgeo import gdal, gdal_array
+
+from instrumentation import stage
+from tiled_warp import BLOCK_SIZE, chunk_windows
+from try_try import select_bands
+
+# Integer candidates for 'auto', smallest first
+_INTEGER_TYPES = [gdal.GDT_Byte, gdal.GDT_Int16, gdal.GDT_UInt16, gdal.GDT_Int32, gdal.GDT_UInt32]
+
+
+def _numpy_type(data_type: int) -> np.dtype:
+    return np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(data_type))
+
+
+def smallest_data_type(tif) -> tuple[int, float | None]:
+    """
+    Smallest integer type holding every valid raw value of an integer band,
+    with a nodata value that fits that type.
+
+    The nodata value is kept if it fits; otherwise the type's maximum is
+    used, provided no valid pixel takes it. Float bands keep their type.
+
+    :param tif: Single-band raster
+    :return: (GDAL data type, nodata value or None)
+    """
+    ds = gdal.Open(str(tif))
+    band = ds.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    if not np.issubdtype(_numpy_type(band.DataType), np.integer):
+        return band.DataType, nodata
+    try:
+        stats = band.ComputeRasterMinMax(False)  # exact, nodata excluded
+    except RuntimeError:
+        stats = None  # raised with gdal.UseExceptions() when no pixel is valid
+    if stats is None:
+        return band.DataType, nodata  # all nodata
+    vmin, vmax = stats
+    for data_type in _INTEGER_TYPES:
+        info = np.iinfo(_numpy_type(data_type))
+        if vmin < info.min or vmax > info.max:
+            continue
+        if nodata is None or info.min <= nodata <= info.max:
+            return data_type, nodata
+        if vmax < info.max:
+            return data_type, float(info.max)
+    return band.DataType, nodata
+
+
+def _fit_nodata(tif, band, data_type: int, nodata: float | None) -> float | None:
+    """
+    Nodata value for 'band' written as 'data_type': kept if the type holds
+    it, otherwise the type's maximum, as in 'smallest_data_type'.
+
+    :raises ValueError: If the nodata does not fit and a valid pixel takes the maximum
+    """
+    np_type = _numpy_type(data_type)
+    if nodata is None or not np.issubdtype(np_type, np.integer):
+        return nodata
+    info = np.iinfo(np_type)
+    if not np.isnan(nodata) and nodata == int(nodata) and info.min <= nodata <= info.max:
+        return nodata
+    try:
+        stats = band.ComputeRasterMinMax(False)  # exact, nodata excluded
+    except RuntimeError:
+        stats = None  # no valid pixel
+    if stats is None or stats[1] < info.max:
+        return float(info.max)
+    raise ValueError(f"{tif}: nodata {nodata} does not fit {gdal.GetDataTypeName(data_type)} "
+                     f"and valid pixels use its maximum {info.max}")
+
+
+def plan_band_types(list_of_tifs: list[str], band_types=None) -> dict:
+    """
+    Target (data type, nodata) of every band.
+
+    :param list_of_tifs: Single-band rasters
+    :param band_types: None (keep each source type), "auto" (see
+                       'smallest_data_type') or {band name: GDAL type or "auto"};
+                       bands missing from the dict keep their type. A nodata
+                       value the chosen type cannot hold becomes its maximum
+    :return: {tif: (GDAL data type, nodata)}
+    :raises ValueError: If a band's nodata cannot be fitted to its type
+    """
+    plan = {}
+    for tif in list_of_tifs:
+        tif = str(tif)
+        wanted = band_types if not isinstance(band_types, dict) \
+            else band_types.get(Path(tif).stem)
+        if wanted == "auto":
+            plan[tif] = smallest_data_type(tif)
+            continue
+        ds = gdal.Open(tif)
+        band = ds.GetRasterBand(1)
+        data_type = wanted if wanted is not None else band.DataType
+        plan[tif] = (data_type, _fit_nodata(tif, band, data_type, band.GetNoDataValue()))
+        ds = None
+    return plan
+
+
+def write_typed_multiband(output_tif, list_of_tifs: list[str], data_type: int,
+                          nodata: dict) -> None:
+    """
+    Write single-band rasters as the bands of one multiband GeoTIFF of
+    'data_type', block by block, remapping each band's nodata pixels.
+
+    :param output_tif: Output path
+    :param list_of_tifs: Single-band rasters on the same grid
+    :param data_type: GDAL data type of the output
+    :param nodata: {tif: nodata value in the output, or None}; one value for
+                   all bands, since the GeoTIFF keeps a single nodata tag
+    :raises ValueError: If a valid value does not fit 'data_type'
+    """
+    np_type = _numpy_type(data_type)
+    integer = np.issubdtype(np_type, np.integer)
+    first = gdal.Open(str(list_of_tifs[0]))
+    driver = gdal.GetDriverByName("GTiff")
+    out_ds = driver.Create(
+        str(output_tif), first.RasterXSize, first.RasterYSize, len(list_of_tifs), data_type,
+        options=[
+            "COMPRESS=DEFLATE",
+            f"PREDICTOR={2 if integer else 3}",
+            "TILED=YES",
+            f"BLOCKXSIZE={BLOCK_SIZE}",
+            f"BLOCKYSIZE={BLOCK_SIZE}",
+            "INTERLEAVE=BAND",
+            "SPARSE_OK=TRUE",
+            "BIGTIFF=YES",
+        ],
+    )
+    out_ds.SetGeoTransform(first.GetGeoTransform())
+    out_ds.SetProjection(first.GetProjection())
+    windows = chunk_windows(first.RasterXSize, first.RasterYSize, BLOCK_SIZE)
+    first = None
+
+    for i, tif in enumerate(list_of_tifs):
+        src_ds = gdal.Open(str(tif))
+        src_band = src_ds.GetRasterBand(1)
+        out_band = out_ds.GetRasterBand(i + 1)
+        out_band.SetDescription(Path(tif).stem)
+        src_nodata = src_band.GetNoDataValue()
+        dst_nodata = nodata.get(str(tif))
+        if dst_nodata is not None:
+            out_band.SetNoDataValue(dst_nodata)
+        # Raw values are kept: scale/offset stay metadata
+        if src_band.GetScale() is not None:
+            out_band.SetScale(src_band.GetScale())
+        if src_band.GetOffset() is not None:
+            out_band.SetOffset(src_band.GetOffset())
+
+        for col, row, cols, rows in windows:
+            data = src_band.ReadAsArray(col, row, cols, rows)
+            mask = None
+            if src_nodata is not None:
+                mask = np.isnan(data) if np.isnan(src_nodata) else data == src_nodata
+                if mask.all():
+                    continue  # leave the block sparse
+            valid = data if mask is None else data[~mask]
+            if integer and valid.size:
+                info = np.iinfo(np_type)
+                if valid.min() < info.min or valid.max() > info.max:
+                    raise ValueError(f"{tif}: values outside {np_type} range")
+            out = data.astype(np_type)
+            if mask is not None and dst_nodata is not None:
+                out[mask] = dst_nodata
+            out_band.WriteArray(out, col, row)
+        src_ds = None
+    out_ds = None
+
+
+def create_typed_multibands(output_stem, list_of_tifs: list[str], bands=None,
+                            band_types=None) -> dict:
+    """
+    Build one multiband GeoTIFF per target (data type, nodata) pair.
+
+    :param output_stem: Output path without extension; each file is
+                        '<output_stem>_<type name>.tif', or
+                        '<output_stem>_<type name>_nodata<value>.tif' when
+                        bands of one type have different nodata values
+    :param list_of_tifs: Single-band rasters on the same grid
+    :param bands: Band names to include, in order (default: all files)
+    :param band_types: See 'plan_band_types'
+    :return: {group name (file suffix): output path}
+    """
+    list_of_tifs = select_bands(list_of_tifs, bands)
+    plan = plan_band_types(list_of_tifs, band_types)
+    groups = {}
+    for tif in list_of_tifs:
+        data_type, nodata = plan[str(tif)]
+        # str() so NaN nodata values fall in the same group
+        groups.setdefault((data_type, str(nodata)), []).append(str(tif))
+    types = [data_type for data_type, _ in groups]
+
+    outputs = {}
+    for (data_type, _), tifs in groups.items():
+        nodata = plan[tifs[0]][1]
+        name = gdal.GetDataTypeName(data_type)
+        if types.count(data_type) > 1:
+            name += "_nodata" + ("none" if nodata is None else f"{nodata:g}")
+        output_tif = f"{output_stem}_{name}.tif"
+        with stage("merge_typed", inputs=tifs, outputs=[output_tif], bands=len(tifs),
+                   data_type=gdal.GetDataTypeName(data_type)):
+            write_typed_multiband(output_tif, tifs, data_type, {tif: nodata for tif in tifs})
+        outputs[name] = output_tif
+        print(f"[create_typed_multibands] {name}: {len(tifs)} bands -> {output_tif}")
+    return outputs
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Crop every layer to many reference grids in one pass over the source.
+
+Running 'crop_to_grid' once per study site re-reads the global layer once
+per site. Here the nearest-neighbour geometry of all the sites is computed
+up front, vectorised and separable (one source column per destination
+column, one source row per destination row, as north-up grids allow).
+That gives the union of source blocks needed by any site; the source is
+then swept block row by block row, each needed block is read once and
+scattered into every site that overlaps it. Source I/O scales with the
+union of the site footprints, not with the number of sites.
+
+Each site is written as soon as the sweep passes its last row, so only
+the sites crossing the current block row are held in memory. Sites in a
+different CRS than the source fall back to 'warp_exact_grid'.
+"""
+
+from pathlib import Path
+
+import numpy as np
+from osgeo import gdal, gdal_array
+
+from grid_align import same_crs
+from instrumentation import stage
+from tiled_warp import CREATION_OPTIONS
+from try_try import get_raster_info, warp_exact_grid
+
+
+def load_references(ref_tifs) -> dict:
+    """Map each reference raster's stem (the site name) to its 'get_raster_info'."""
+    return {Path(tif).stem: get_raster_info(str(tif)) for tif in ref_tifs}
+
+
+def nearest_indices(src_info: dict, ref_info: dict) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Source column of every destination column and source row of every
+    destination row, sampling at destination pixel centres (what a
+    nearest-neighbour warp does). Indices outside the source are -1.
+
+    :return: (cols, rows) int64 arrays of length ref width and ref height
+    """
+    src_xmin, _, _, src_ymax = src_info["bbox"]
+    ref_xmin, _, _, ref_ymax = ref_info["bbox"]
+    x = ref_xmin + (np.arange(ref_info["width"]) + 0.5) * ref_info["xres"]
+    y = ref_ymax + (np.arange(ref_info["height"]) + 0.5) * ref_info["yres"]
+    cols = np.floor((x - src_xmin) / src_info["xres"]).astype(np.int64)
+    rows = np.floor((y - src_ymax) / src_info["yres"]).astype(np.int64)
+    cols[(cols < 0) | (cols >= src_info["width"])] = -1
+    rows[(rows < 0) | (rows >= src_info["height"])] = -1
+    return cols, rows
+
+
+def _write_site(output_tif: str, ref_info: dict, data: np.ndarray, src_band) -> None:
+    driver = gdal.GetDriverByName("GTiff")
+    out_ds = driver.Create(output_tif, ref_info["width"], ref_info["height"], 1,
+                           src_band.DataType, options=CREATION_OPTIONS)
+    xmin, _, _, ymax = ref_info["bbox"]
+    out_ds.SetGeoTransform((xmin, ref_info["xres"], 0.0, ymax, 0.0, ref_info["yres"]))
+    out_ds.SetProjection(ref_info["projection"])
+    out_band = out_ds.GetRasterBand(1)
+    nodata = src_band.GetNoDataValue()
+    if nodata is not None:
+        out_band.SetNoDataValue(nodata)
+    if src_band.GetScale() is not None:
+        out_band.SetScale(src_band.GetScale())
+    if src_band.GetOffset() is not None:
+        out_band.SetOffset(src_band.GetOffset())
+    out_band.WriteArray(data)
+    out_ds = None
+
+
+def batch_crop(input_tif: str, references: dict, out_dir) -> dict:
+    """
+    Crop one source layer to every reference grid.
+
+    Output for site 'name' is out_dir/name/<input file name>.
+
+    :param input_tif: Source raster (single band)
+    :param references: {site name: reference info from 'get_raster_info'}
+    :param out_dir: Root directory of the per-site outputs
+    :return: Dict with "outputs" ({site: path}), "warped" (sites that fell
+             back to a warp), "blocks_read" and "blocks_total"
+    :raises FileNotFoundError: If the input cannot be opened
+    """
+    input_tif = str(input_tif)
+    src_info = get_raster_info(input_tif)
+    out_dir = Path(out_dir)
+
+    outputs, warped, sites = {}, [], {}
+    for name, ref_info in references.items():
+        site_dir = out_dir / name
+        site_dir.mkdir(parents=True, exist_ok=True)
+        outputs[name] = str(site_dir / Path(input_tif).name)
+        if not same_crs(src_info["projection"], ref_info["projection"]):
+            warped.append(name)
+            continue
+        cols, rows = nearest_indices(src_info, ref_info)
+        if (rows >= 0).any() and (cols >= 0).any():
+            sites[name] = (cols, rows)
+        else:
+            sites[name] = None  # no overlap: all nodata
+
+    src_ds = gdal.Open(input_tif)
+    src_band = src_ds.GetRasterBand(1)
+    bw, bh = src_band.GetBlockSize()
+    nodata = src_band.GetNoDataValue()
+    fill = nodata if nodata is not None else 0
+    dtype = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(src_band.DataType))
+    blocks_across = -(-src_info["width"] // bw)
+    blocks_down = -(-src_info["height"] // bh)
+
+    # Per site and per source block row / block column, the destination
+    # rows / columns that sample from it
+    plans = {}
+    needed = {}  # block row -> set of block columns needed by any site
+    last_row = {}  # site -> last source block row it needs
+    for name, geom in sites.items():
+        if geom is None:
+            continue
+        cols, rows = geom
+        valid_c = np.flatnonzero(cols >= 0)
+        valid_r = np.flatnonzero(rows >= 0)
+        col_groups = {int(bx): valid_c[cols[valid_c] // bw == bx]
+                      for bx in np.unique(cols[valid_c] // bw)}
+        row_groups = {int(by): valid_r[rows[valid_r] // bh == by]
+                      for by in np.unique(rows[valid_r] // bh)}
+        plans[name] = (col_groups, row_groups)
+        for by in row_groups:
+            needed.setdefault(by, set()).update(col_groups)
+        last_row[name] = max(row_groups)
+
+    with stage("batch_crop", inputs=[input_tif], outputs=list(outputs.values()),
+               sites=len(references)):
+        for name, geom in sites.items():
+            if geom is None:
+                ref_info = references[name]
+                _write_site(outputs[name], ref_info,
+                            np.full((ref_info["height"], ref_info["width"]), fill, dtype),
+                            src_band)
+
+        active = {}
+        blocks_read = 0
+        for by in sorted(needed):
+            y0 = by * bh
+            ysize = min(bh, src_info["height"] - y0)
+            for bx in sorted(needed[by]):
+                x0 = bx * bw
+                block = src_band.ReadAsArray(x0, y0, min(bw, src_info["width"] - x0), ysize)
+                blocks_read += 1
+                for name, (col_groups, row_groups) in plans.items():
+                    if by not in row_groups or bx not in col_groups:
+                        continue
+                    if name not in active:
+                        ref_info = references[name]
+                        active[name] = np.full((ref_info["height"], ref_info["width"]),
+                                               fill, dtype)
+                    cols, rows = sites[name]
+                    dst_r = row_groups[by]
+                    dst_c = col_groups[bx]
+                    active[name][np.ix_(dst_r, dst_c)] = \
+                        block[np.ix_(rows[dst_r] - y0, cols[dst_c] - x0)]
+
+            # Sites whose footprint ends in this block row are complete
+            for name in [n for n in active if last_row[n] == by]:
+                _write_site(outputs[name], references[name], active.pop(name), src_band)
+
+    src_ds = None
+    for name in warped:
+        warp_exact_grid(input_tif, outputs[name], references[name])
+
+    print(f"[batch_crop] {input_tif}: {len(references)} sites, "
+          f"{blocks_read} of {blocks_across * blocks_down} source blocks read")
+    return {
+        "outputs": outputs,
+        "warped": warped,
+        "blocks_read": blocks_read,
+        "blocks_total": blocks_across * blocks_down,
+    }
+
+
+def batch_crop_stack(input_tifs, references: dict, out_dir) -> dict:
+    """
+    Crop every source layer to every reference grid.
+
+    :param input_tifs: Source rasters
+    :param references: {site name: reference info from 'get_raster_info'}
+    :param out_dir: Root directory; site 'name' gets out_dir/name/<layer>.tif
+    :return: {site name: list of cropped layers, in input order}
+    """
+    per_site = {name: [] for name in references}
+    for input_tif in input_tifs:
+        result = batch_crop(input_tif, references, out_dir)
+        for name, path in result["outputs"].items():
+            per_site[name].append(path)
+    return per_site
@@ -0,0 +1,799 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmark for the crop/unscale/merge stages.
+
+Generates synthetic CHELSA-like rasters locally (global extent, int16 with
+scale/offset and an ocean nodata mask) plus a small 'elevation.tif'-like
+reference grid, then runs each pipeline stage under a fixed configuration
+and reports:
+
+- throughput in megapixels per second (output pixels)
+- peak RSS of the process that ran the stage
+- output size on disk
+
+Every measurement runs in a fresh process so the peak RSS belongs to that
+stage alone. Results can be stored as a baseline and later runs compared
+against it with regression thresholds:
+
+    python benchmark.py --sizes small --save-baseline
+    python benchmark.py --sizes small --compare
+
+The intra-layer parallel warp scaling cases (warp_tiled_<mode>_<workers>)
+are not run by default and also check the output for seams:
+
+    python benchmark.py --sizes medium --cases warp_exact_grid \
+        warp_tiled_threads_1 warp_tiled_threads_4 warp_tiled_processes_4
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+from osgeo import gdal, osr
+
+import band_types
+import batch_crop
+import cog_2
+import grid_align
+import incremental
+import instrumentation
+import mmap_reader
+import pipeline
+import tile_merge
+import tiled_warp
+import try_try
+import verify
+import zarr_cube
+
+gdal.UseExceptions()
+
+# Full CHELSA V2.1 grid is 43200 x 20880 pixels at 30 arc-seconds
+SIZES = {
+    "tiny": (1440, 696),
+    "small": (4320, 2088),
+    "medium": (14400, 6960),
+    "full": (43200, 20880),
+}
+
+CHELSA_XMIN = -180.0001388888
+CHELSA_YMAX = 83.9998611111
+CHELSA_SCALE = 0.1
+CHELSA_OFFSET = -273.15
+CHELSA_NODATA = -32768
+
+DEFAULT_BASELINE = Path(__file__).with_name("benchmark_baseline.json")
+DEFAULT_WORKDIR = Path(__file__).with_name("bench_data")
+
+
+# ----------------------------------------------------------------------
+#                       Synthetic input generation
+# ----------------------------------------------------------------------
+
+def _land_mask(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """Deterministic blobby land/ocean pattern covering roughly 30% land."""
+    field = (
+        np.sin(np.radians(lon) * 3.0)
+        + np.cos(np.radians(lat) * 5.0 + np.radians(lon))
+        + 0.5 * np.sin(np.radians(lon + lat) * 11.0)
+    )
+    return field > 0.6
+
+
+def make_chelsa_like(path: Path, width: int, height: int, seed: int = 0,
+                     block_rows: int = 512) -> None:
+    """
+    Write a global int16 raster with CHELSA-like scale/offset, nodata and
+    tiled DEFLATE layout. Values are a smooth temperature-like gradient
+    with noise, so compression ratios are realistic. Rows are generated in
+    strips to keep memory bounded for the full-size grid.
+
+    :param path: Output GeoTIFF path
+    :param width: Number of columns
+    :param height: Number of rows
+    :param seed: Seed for the noise, the same seed yields the same file
+    :param block_rows: Rows generated per strip
+    """
+    xres = 360.0 / width
+    yres = 174.0 / height
+    rng = np.random.default_rng(seed)
+
+    driver = gdal.GetDriverByName("GTiff")
+    ds = driver.Create(
+        str(path), width, height, 1, gdal.GDT_Int16,
+        options=["COMPRESS=DEFLATE", "TILED=YES", "BIGTIFF=YES"],
+    )
+    ds.SetGeoTransform((CHELSA_XMIN, xres, 0.0, CHELSA_YMAX, 0.0, -yres))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    ds.SetProjection(srs.ExportToWkt())
+    band = ds.GetRasterBand(1)
+    band.SetScale(CHELSA_SCALE)
+    band.SetOffset(CHELSA_OFFSET)
+    band.SetNoDataValue(CHELSA_NODATA)
+
+    lon = CHELSA_XMIN + (np.arange(width) + 0.5) * xres
+    for row in range(0, height, block_rows):
+        rows = min(block_rows, height - row)
+        lat = CHELSA_YMAX - (np.arange(row, row + rows) + 0.5) * yres
+        lon2d, lat2d = np.meshgrid(lon, lat)
+        kelvin = 300.0 - 0.6 * np.abs(lat2d) + 3.0 * np.sin(np.radians(lon2d) * 4.0 + seed)
+        kelvin += rng.normal(0.0, 0.5, size=kelvin.shape)
+        raw = np.round((kelvin - CHELSA_OFFSET) / CHELSA_SCALE).astype(np.int16)
+        raw[~_land_mask(lon2d, lat2d)] = CHELSA_NODATA
+        band.WriteArray(raw, 0, row)
+    ds = None
+
+
+def make_reference(path: Path, width: int, height: int) -> None:
+    """
+    Write an 'elevation.tif'-like reference: int16, same pixel size as the
+    synthetic layers, covering a 1/12 x 1/8 window over South America and
+    aligned on the source grid.
+    """
+    xres = 360.0 / width
+    yres = 174.0 / height
+    ref_w = width // 12
+    ref_h = height // 8
+    col0 = int(round((-80.0 - CHELSA_XMIN) / xres))
+    row0 = int(round((CHELSA_YMAX - 0.0) / yres))
+
+    driver = gdal.GetDriverByName("GTiff")
+    ds = driver.Create(str(path), ref_w, ref_h, 1, gdal.GDT_Int16,
+                       options=["COMPRESS=DEFLATE"])
+    ds.SetGeoTransform((CHELSA_XMIN + col0 * xres, xres, 0.0,
+                        CHELSA_YMAX - row0 * yres, 0.0, -yres))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    ds.SetProjection(srs.ExportToWkt())
+    yy, xx = np.mgrid[0:ref_h, 0:ref_w]
+    elev = (1500 + 1500 * np.sin(xx / ref_w * math.pi) * np.cos(yy / ref_h * math.pi)).astype(np.int16)
+    ds.GetRasterBand(1).WriteArray(elev)
+    ds = None
+
+
+def prepare_inputs(workdir: Path, size: str, layers: int) -> dict:
+    """
+    Generate (or reuse) the synthetic inputs for one size.
+
+    :return: {"sources": [...], "reference": path, "ref_info": dict, "workdir": path}
+    """
+    width, height = SIZES[size]
+    size_dir = workdir / size
+    size_dir.mkdir(parents=True, exist_ok=True)
+
+    sources = []
+    for i in range(layers):
+        src = size_dir / f"CHELSA_synth{i}_1981-2010_V.2.1.tif"
+        if not src.exists():
+            print(f"[benchmark] generating {src}")
+            make_chelsa_like(src, width, height, seed=i)
+        sources.append(str(src))
+
+    reference = size_dir / "elevation.tif"
+    if not reference.exists():
+        make_reference(reference, width, height)
+
+    return {
+        "sources": sources,
+        "reference": str(reference),
+        "ref_info": try_try.get_raster_info(str(reference)),
+        "workdir": str(size_dir),
+    }
+
+
+def _crops(inputs: dict) -> list[str]:
+    """Grid-aligned crops of every source, created once and shared by the merge cases."""
+    crop_dir = Path(inputs["workdir"]) / "crops"
+    crop_dir.mkdir(exist_ok=True)
+    crops = []
+    for src in inputs["sources"]:
+        out = crop_dir / Path(src).name
+        if not out.exists():
+            try_try.warp_exact_grid(src, str(out), inputs["ref_info"])
+        crops.append(str(out))
+    return crops
+
+
+def _ref_pixels(inputs: dict) -> int:
+    return inputs["ref_info"]["width"] * inputs["ref_info"]["height"]
+
+
+# ----------------------------------------------------------------------
+#                               Cases
+# ----------------------------------------------------------------------
+# Each case receives the prepared inputs and an output directory and
+# returns (output_path or None for read-only cases, pixels_processed). 'prepare' runs untimed before
+# the case and its result is passed as 'extra'. 'verify', when present,
+# runs untimed after the case and raises if the output is wrong.
+
+def _case_warp_exact_grid(inputs, out_dir, extra):
+    out = out_dir / "warp_exact_grid.tif"
+    try_try.warp_exact_grid(inputs["sources"][0], str(out), inputs["ref_info"])
+    return out, _ref_pixels(inputs)
+
+
+STAGE_CALLS = 100_000
+
+
+def _case_instrumentation_overhead(inputs, out_dir, extra):
+    """
+    Cost of the disabled 'stage' calls relative to a single-layer warp: the
+    calls a warp makes cost under 1% of the warp itself.
+    """
+    instrumentation.disable()
+    start = time.perf_counter()
+    out, pixels = _case_warp_exact_grid(inputs, out_dir, extra)
+    warp_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(STAGE_CALLS):
+        with instrumentation.stage("noop", inputs=[out], outputs=[out]):
+            pass
+    per_call_s = (time.perf_counter() - start) / STAGE_CALLS
+    # warp_exact_grid makes one stage call per layer; allow ten
+    if 10 * per_call_s > 0.01 * warp_s:
+        raise AssertionError(f"disabled stage() costs {per_call_s * 1e6:.2f} us per call, "
+                             f"over 1% of a {warp_s:.3f} s warp")
+    return out, pixels
+
+
+def _ref_extent(ref_info):
+    return list(ref_info["bbox"]), abs(ref_info["xres"]), abs(ref_info["yres"])
+
+
+def _case_warp_without_unscale(inputs, out_dir, extra):
+    out = out_dir / "warp_without_unscale.tif"
+    extent, x_res, y_res = _ref_extent(inputs["ref_info"])
+    cog_2.warp_without_unscale(inputs["sources"][0], out, extent, x_res, y_res,
+                               inputs["ref_info"]["projection"])
+    return out, _ref_pixels(inputs)
+
+
+def _case_apply_scale_offset(inputs, out_dir, extra):
+    out = out_dir / "apply_scale_offset.tif"
+    cog_2.apply_scale_offset(extra[0], out)
+    return out, _ref_pixels(inputs)
+
+
+def _case_partial_merge(inputs, out_dir, extra):
+    out = out_dir / "partial_merge.tif"
+    cog_2.partial_merge_bands_to_tiff(extra, out, block_size=1024)
+    return out, _ref_pixels(inputs) * len(extra)
+
+
+def _case_create_multiband(inputs, out_dir, extra):
+    out = out_dir / "create_multiband.tif"
+    # create_multiband writes its temporary VRT in the working directory
+    os.chdir(out_dir)
+    try_try.create_multiband(str(out), extra)
+    return out, _ref_pixels(inputs) * len(extra)
+
+
+def _case_create_multiband_float32(inputs, out_dir, extra):
+    out = out_dir / "create_multiband_float32.tif"
+    os.chdir(out_dir)
+    try_try.create_multiband(str(out), extra, output_type=gdal.GDT_Float32)
+    return out, _ref_pixels(inputs) * len(extra)
+
+
+def _case_typed_multibands(inputs, out_dir, extra):
+    outputs = band_types.create_typed_multibands(str(out_dir / "typed"), extra, band_types="auto")
+    if len(outputs) != 1:
+        raise AssertionError(f"expected one Int16 group, got {sorted(outputs)}")
+    return Path(next(iter(outputs.values()))), _ref_pixels(inputs) * len(extra)
+
+
+def _verify_smaller_than_float32(inputs, out, extra):
+    """Same values as the crops, in fewer bytes than the old Float32 output."""
+    _verify_bands_match_crops(inputs, out, extra)
+    float32 = Path(inputs["workdir"]) / "multiband_float32.tif"
+    if not float32.exists():
+        cwd = os.getcwd()
+        os.chdir(inputs["workdir"])
+        try_try.create_multiband(str(float32), extra, output_type=gdal.GDT_Float32)
+        os.chdir(cwd)
+    if os.path.getsize(out) >= os.path.getsize(float32):
+        raise AssertionError(f"{out} ({os.path.getsize(out)} bytes) is not smaller than "
+                             f"the Float32 output ({os.path.getsize(float32)} bytes)")
+
+
+def _reference_warp(inputs: dict) -> str:
+    """Single-call warp of the first source, used to check the other warp paths."""
+    out = Path(inputs["workdir"]) / "reference_warp.tif"
+    if not out.exists():
+        try_try.warp_exact_grid(inputs["sources"][0], str(out), inputs["ref_info"])
+    return str(out)
+
+
+def rasters_equal(path_a, path_b, block_rows: int = 1024) -> bool:
+    """Compare two rasters pixel by pixel (all bands), strip by strip."""
+    ds_a = gdal.Open(str(path_a))
+    ds_b = gdal.Open(str(path_b))
+    if (ds_a.RasterXSize, ds_a.RasterYSize, ds_a.RasterCount) != \
+            (ds_b.RasterXSize, ds_b.RasterYSize, ds_b.RasterCount):
+        return False
+    if ds_a.GetGeoTransform() != ds_b.GetGeoTransform():
+        return False
+    width, height = ds_a.RasterXSize, ds_a.RasterYSize
+    for row in range(0, height, block_rows):
+        rows = min(block_rows, height - row)
+        arr_a = ds_a.ReadAsArray(0, row, width, rows)
+        arr_b = ds_b.ReadAsArray(0, row, width, rows)
+        if not np.array_equal(arr_a, arr_b):
+            return False
+    return True
+
+
+def _verify_same_as_reference_warp(inputs, out, extra):
+    if not rasters_equal(out, extra):
+        raise AssertionError(f"{out} differs from the single-call warp {extra}")
+
+
+def _tiled_warp_case(mode: str, workers: int):
+    def case(inputs, out_dir, extra):
+        out = out_dir / f"warp_tiled_{mode}_{workers}.tif"
+        tiled_warp.warp_exact_grid_tiled(inputs["sources"][0], str(out), inputs["ref_info"],
+                                         workers=workers, mode=mode)
+        return out, _ref_pixels(inputs)
+    return case
+
+
+def _case_crop_to_grid(inputs, out_dir, extra):
+    out = out_dir / "crop_to_grid.tif"
+    grid_align.crop_to_grid(inputs["sources"][0], str(out), inputs["ref_info"])
+    return out, _ref_pixels(inputs)
+
+
+def _case_warp_identical(inputs, out_dir, extra):
+    # Same-grid input: what the fast path replaces
+    out = out_dir / "warp_identical.tif"
+    try_try.warp_exact_grid(extra, str(out), try_try.get_raster_info(extra))
+    return out, _ref_pixels(inputs)
+
+
+def _case_crop_to_grid_identical(inputs, out_dir, extra):
+    out = out_dir / "crop_to_grid_identical.tif"
+    grid_align.crop_to_grid(extra, str(out), try_try.get_raster_info(extra))
+    return out, _ref_pixels(inputs)
+
+
+def _case_merge_passthrough(inputs, out_dir, extra):
+    out = out_dir / "merge_passthrough.tif"
+    mode = tile_merge.merge_bands_passthrough(extra, str(out))
+    if mode != "raw_tiles":
+        raise AssertionError(f"expected tile passthrough, got {mode}")
+    return out, _ref_pixels(inputs) * len(extra)
+
+
+def _case_merge_decoded(inputs, out_dir, extra):
+    out = out_dir / "merge_decoded.tif"
+    tile_merge.merge_decoded(extra, str(out))
+    return out, _ref_pixels(inputs) * len(extra)
+
+
+def _verify_bands_match_crops(inputs, out, extra):
+    ds = gdal.Open(str(out))
+    for i, crop in enumerate(extra):
+        if not np.array_equal(ds.GetRasterBand(i + 1).ReadAsArray(),
+                              gdal.Open(crop).GetRasterBand(1).ReadAsArray()):
+            raise AssertionError(f"band {i + 1} of {out} differs from {crop}")
+
+
+def _incremental_build(interleave: str):
+    """
+    Prepare step running the incremental crop + multiband build once, so the
+    cases measure reruns. "band" merges band-separate (tile_merge), "pixel"
+    with 'try_try.create_multiband'.
+    """
+    def prepare(inputs: dict) -> dict:
+        build_dir = Path(inputs["workdir"]) / f"incremental_{interleave}"
+        build_dir.mkdir(exist_ok=True)
+        state = {"dir": str(build_dir), "multiband": str(build_dir / "multiband.tif"),
+                 "interleave": interleave}
+        _incremental_rerun(inputs, state)
+        return state
+    return prepare
+
+
+def _incremental_rerun(inputs: dict, state: dict):
+    ref_info = inputs["ref_info"]
+    crops, changed = incremental.build_crops(
+        inputs["sources"], state["dir"],
+        lambda src, dst: grid_align.crop_to_grid(src, dst, ref_info),
+        {"ref": ref_info, "creation_options": tiled_warp.CREATION_OPTIONS},
+    )
+    if state["interleave"] == "band":
+        def merge(out, tifs):
+            tile_merge.merge_bands_passthrough(tifs, out)
+    else:
+        merge = try_try.create_multiband
+    mode = incremental.update_multiband(state["multiband"], crops, merge)
+    return crops, changed, mode
+
+
+def _case_incremental_noop(inputs, out_dir, extra):
+    _, changed, mode = _incremental_rerun(inputs, extra)
+    if changed or mode != "up_to_date":
+        raise AssertionError(f"no-op rerun rebuilt {changed} ({mode})")
+    return extra["multiband"], 0
+
+
+def _case_incremental_one_layer(inputs, out_dir, extra):
+    # Simulate a re-download of the first layer
+    os.utime(inputs["sources"][0])
+    crops, changed, mode = _incremental_rerun(inputs, extra)
+    # Pixel-interleaved outputs are rebuilt: in place they would grow by every band
+    expected = "in_place" if extra["interleave"] == "band" else "rebuilt"
+    if changed != crops[:1] or mode != expected:
+        raise AssertionError(f"expected one crop and mode {expected}, got {changed} ({mode})")
+    return extra["multiband"], _ref_pixels(inputs)
+
+
+def _verify_incremental(inputs, out, extra):
+    _verify_bands_match_crops(inputs, out, [
+        str(Path(extra["dir"]) / Path(src).name) for src in inputs["sources"]])
+
+
+SITE_COUNT = 100
+SITE_SIZE = 192
+
+
+def _site_references(inputs: dict) -> dict:
+    """SITE_COUNT small reference grids at pixel-aligned random positions of the source grid."""
+    ref_info = inputs["ref_info"]
+    rng = np.random.default_rng(1)
+    xmin, _, _, ymax = ref_info["bbox"]
+    sites = {}
+    for i in range(SITE_COUNT):
+        col = int(rng.integers(0, ref_info["width"] - SITE_SIZE))
+        row = int(rng.integers(0, ref_info["height"] - SITE_SIZE))
+        x0 = xmin + col * ref_info["xres"]
+        y0 = ymax + row * ref_info["yres"]
+        sites[f"site{i:03d}"] = dict(
+            ref_info, width=SITE_SIZE, height=SITE_SIZE,
+            bbox=(x0, y0 + SITE_SIZE * ref_info["yres"], x0 + SITE_SIZE * ref_info["xres"], y0),
+        )
+    return sites
+
+
+def _case_batch_crop(inputs, out_dir, extra):
+    batch_crop.batch_crop(inputs["sources"][0], extra, out_dir / "batch")
+    return None, SITE_COUNT * SITE_SIZE * SITE_SIZE
+
+
+def _case_crop_per_site(inputs, out_dir, extra):
+    for name, ref_info in extra.items():
+        site_dir = out_dir / "per_site" / name
+        site_dir.mkdir(parents=True, exist_ok=True)
+        grid_align.crop_to_grid(inputs["sources"][0],
+                                str(site_dir / Path(inputs["sources"][0]).name), ref_info)
+    return None, SITE_COUNT * SITE_SIZE * SITE_SIZE
+
+
+def _verify_batch_crop(inputs, out, extra):
+    check_dir = Path(inputs["workdir"]) / "batch_check"
+    result = batch_crop.batch_crop(inputs["sources"][0], extra, check_dir / "batch")
+    for name, path in result["outputs"].items():
+        expected = check_dir / f"{name}.tif"
+        grid_align.crop_to_grid(inputs["sources"][0], str(expected), extra[name])
+        if not rasters_equal(path, expected):
+            raise AssertionError(f"batch crop of {name} differs from crop_to_grid")
+
+
+def _verify_case(full: bool):
+    def case(inputs, out_dir, extra):
+        for crop in extra:
+            result = verify.verify_tiff(crop, full=full)
+            if not result["ok"]:
+                raise AssertionError(f"{crop} reported corrupt: {result['errors'][:3]}")
+        return None, _ref_pixels(inputs) * len(extra)
+    return case
+
+
+def _verify_detects_truncation(inputs, out, extra):
+    truncated = Path(inputs["workdir"]) / "truncated.tif"
+    with open(extra[0], "rb") as fh:
+        data = fh.read()
+    truncated.write_bytes(data[:len(data) * 3 // 4])
+    if verify.verify_tiff(truncated)["ok"]:
+        raise AssertionError("truncated TIFF passed verification")
+
+
+def _case_pipeline(inputs, out_dir, extra):
+    items = [{"name": Path(src).stem, "source": src} for src in inputs["sources"]]
+    out = out_dir / "pipeline_multiband.tif"
+    stages = pipeline.chelsa_stages(inputs["reference"], out_dir / "pipeline_crops", out,
+                                    [item["name"] for item in items],
+                                    sources=inputs["sources"])
+    report = pipeline.run_stages(items, stages)
+    if report["errors"]:
+        raise AssertionError(f"pipeline errors: {report['errors']}")
+    return out, _ref_pixels(inputs) * len(items)
+
+
+def _verify_pipeline(inputs, out, extra):
+    _verify_bands_match_crops(inputs, out, [
+        str(Path(out).parent / "pipeline_crops" / Path(src).name) for src in inputs["sources"]])
+
+
+def _case_cli_help(inputs, out_dir, extra):
+    """Start-up cost of the CLI: '--help' must not import GDAL, NumPy or Earth Engine."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "download_20m", "--help"],
+        cwd=Path(__file__).resolve().parent, capture_output=True, text=True, check=True,
+    )
+    # "import time: self [us] | cumulative | <indented module name>"
+    modules = {line.rsplit("|", 1)[-1].strip() for line in out.stderr.splitlines()
+               if line.startswith("import time:") and "|" in line}
+    heavy = sorted(m for m in modules
+                   if m.split(".")[0] in {"osgeo", "numpy", "ee", "pandas", "cubexpress"})
+    if heavy:
+        raise AssertionError(f"--help imported heavy modules: {heavy}")
+    return None, 0
+
+
+PATCH_SIZE = 256
+PATCH_COUNT = 2000
+
+
+def _uncompressed_copies(inputs: dict) -> dict:
+    """Uncompressed striped and tiled copies of the reference warp, for patch sampling."""
+    src = _reference_warp(inputs)
+    copies = {}
+    for layout, options in (("striped", ["COMPRESS=NONE"]),
+                            ("tiled", ["COMPRESS=NONE", "TILED=YES",
+                                       "BLOCKXSIZE=1024", "BLOCKYSIZE=1024"])):
+        out = Path(inputs["workdir"]) / f"reference_warp_nocompress_{layout}.tif"
+        if not out.exists():
+            gdal.Translate(str(out), src, creationOptions=options + ["BIGTIFF=YES"])
+        copies[layout] = str(out)
+    return copies
+
+
+def _patch_origins(width: int, height: int):
+    size = min(PATCH_SIZE, width, height)
+    rng = np.random.default_rng(42)
+    cols = rng.integers(0, width - size + 1, PATCH_COUNT)
+    rows = rng.integers(0, height - size + 1, PATCH_COUNT)
+    return size, zip(cols.tolist(), rows.tolist())
+
+
+def _patches_case(reader: str, layout: str):
+    def case(inputs, out_dir, extra):
+        path = extra[layout]
+        info = inputs["ref_info"]
+        size, origins = _patch_origins(info["width"], info["height"])
+        checksum = 0
+        if reader == "mmap":
+            with mmap_reader.MappedRaster(path) as raster:
+                for col, row in origins:
+                    checksum += int(raster.read_window(col, row, size, size).max())
+        else:
+            band = gdal.Open(path).GetRasterBand(1)
+            for col, row in origins:
+                checksum += int(band.ReadAsArray(col, row, size, size).max())
+        return None, PATCH_COUNT * size * size
+    return case
+
+
+def _case_zarr_cube(inputs, out_dir, extra):
+    out = out_dir / "cube.zarr"
+    zarr_cube.write_zarr_cube(str(out), extra)
+    return out, _ref_pixels(inputs) * len(extra)
+
+
+def _verify_zarr_patches(inputs, out, extra):
+    """Patches read from the cube must equal the same windows of the crops."""
+    bands = [gdal.Open(crop).GetRasterBand(1) for crop in extra]
+    info = inputs["ref_info"]
+    size, origins = _patch_origins(info["width"], info["height"])
+    for col, row in list(origins)[:20]:
+        patch = zarr_cube.read_patch(str(out), row, col, size)
+        for i, band in enumerate(bands):
+            if not np.array_equal(patch[i], band.ReadAsArray(col, row, size, size)):
+                raise AssertionError(f"cube patch ({row}, {col}) band {i + 1} differs "
+                                     f"from {extra[i]}")
+
+
+CASES = {
+    "warp_exact_grid": (_case_warp_exact_grid, None, None),
+    "crop_to_grid": (_case_crop_to_grid, _reference_warp, _verify_same_as_reference_warp),
+    "warp_identical": (_case_warp_identical, _reference_warp, _verify_same_as_reference_warp),
+    "crop_to_grid_identical": (_case_crop_to_grid_identical, _reference_warp,
+                               _verify_same_as_reference_warp),
+    "warp_without_unscale": (_case_warp_without_unscale, None, None),
+    "apply_scale_offset": (_case_apply_scale_offset, _crops, None),
+    "partial_merge_bands_to_tiff": (_case_partial_merge, _crops, None),
+    "create_multiband": (_case_create_multiband, _crops, _verify_smaller_than_float32),
+    "create_multiband_float32": (_case_create_multiband_float32, _crops, None),
+    "typed_multibands": (_case_typed_multibands, _crops, _verify_smaller_than_float32),
+    "merge_passthrough": (_case_merge_passthrough, _crops, _verify_bands_match_crops),
+    "merge_decoded": (_case_merge_decoded, _crops, _verify_bands_match_crops),
+    "incremental_noop": (_case_incremental_noop, _incremental_build("band"),
+                         _verify_incremental),
+    "incremental_one_layer": (_case_incremental_one_layer, _incremental_build("band"),
+                              _verify_incremental),
+    "incremental_one_layer_pixel": (_case_incremental_one_layer, _incremental_build("pixel"),
+                                    _verify_incremental),
+    "batch_crop": (_case_batch_crop, _site_references, _verify_batch_crop),
+    "crop_per_site": (_case_crop_per_site, _site_references, None),
+    "verify_sample": (_verify_case(False), _crops, _verify_detects_truncation),
+    "verify_full": (_verify_case(True), _crops, _verify_detects_truncation),
+    "pipeline": (_case_pipeline, None, _verify_pipeline),
+    "cli_help": (_case_cli_help, None, None),
+    "zarr_cube": (_case_zarr_cube, _crops, _verify_zarr_patches),
+    "instrumentation_overhead": (_case_instrumentation_overhead, None, None),
+}
+
+# Scaling of the intra-layer parallel warp, checked for seams against a single warp
+for _mode in ("threads", "processes", "gdal"):
+    for _workers in (1, 2, 4, 8):
+        CASES[f"warp_tiled_{_mode}_{_workers}"] = (
+            _tiled_warp_case(_mode, _workers), _reference_warp, _verify_same_as_reference_warp,
+        )
+
+# Random 256x256 patch sampling from uncompressed outputs
+for _reader in ("readasarray", "mmap"):
+    for _layout in ("striped", "tiled"):
+        CASES[f"patches_{_reader}_{_layout}"] = (
+            _patches_case(_reader, _layout), _uncompressed_copies, None,
+        )
+
+# The full scaling sweep is opt-in; one tiled case keeps the seam check in the default run
+DEFAULT_CASES = [name for name in CASES
+                 if not name.startswith("warp_tiled_") or name == "warp_tiled_threads_4"]
+
+
+# ----------------------------------------------------------------------
+#                               Runner
+# ----------------------------------------------------------------------
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _output_bytes(out) -> int:
+    """Size of an output file, or of every file under an output directory (Zarr)."""
+    if out is None:
+        return 0
+    if os.path.isdir(out):
+        return sum(p.stat().st_size for p in Path(out).rglob("*") if p.is_file())
+    return os.path.getsize(out)
+
+
+def _run_case_in_child(case: str, inputs: dict, out_dir: str, extra) -> dict:
+    """Body of the child process: run one case and measure it."""
+    gdal.UseExceptions()
+    func, _, verify = CASES[case]
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    out, pixels = func(inputs, out_dir, extra)
+    seconds = time.perf_counter() - start
+    if verify is not None:
+        verify(inputs, out, extra)
+    return {
+        "seconds": seconds,
+        "pixels": pixels,
+        "mpix_s": pixels / seconds / 1e6 if seconds > 0 else float("inf"),
+        "peak_rss_mb": _peak_rss_mb(),
+        "output_bytes": _output_bytes(out),
+    }
+
+
+def run_case(case: str, inputs: dict, repeat: int = 3) -> dict:
+    """
+    Run a case 'repeat' times, each in a fresh process, and keep the median
+    time. Peak memory and output size are the largest seen across runs.
+    """
+    _, prepare, _ = CASES[case]
+    extra = prepare(inputs) if prepare else None
+    out_dir = str(Path(inputs["workdir"]) / "out" / case)
+
+    runs = []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            runs.append(pool.submit(_run_case_in_child, case, inputs, out_dir, extra).result())
+
+    seconds = statistics.median(r["seconds"] for r in runs)
+    pixels = runs[0]["pixels"]
+    return {
+        "seconds": seconds,
+        "mpix_s": pixels / seconds / 1e6 if seconds > 0 else float("inf"),
+        "peak_rss_mb": max(r["peak_rss_mb"] for r in runs),
+        "output_bytes": max(r["output_bytes"] for r in runs),
+    }
+
+
+def environment() -> dict:
+    return {
+        "gdal": gdal.__version__,
+        "numpy": np.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Compare results with a stored baseline.
+
+    A case regresses when its throughput drops, or its peak memory or output
+    size grows, by more than 'threshold' (a fraction, 0.15 = 15%).
+
+    :return: Human-readable regression messages (empty if none)
+    """
+    problems = []
+    for key, cur in results.items():
+        base = baseline.get("results", {}).get(key)
+        if base is None:
+            continue
+        if cur["mpix_s"] < base["mpix_s"] * (1 - threshold):
+            problems.append(f"{key}: throughput {cur['mpix_s']:.1f} MPix/s "
+                            f"< baseline {base['mpix_s']:.1f} MPix/s")
+        if cur["peak_rss_mb"] > base["peak_rss_mb"] * (1 + threshold):
+            problems.append(f"{key}: peak RSS {cur['peak_rss_mb']:.0f} MB "
+                            f"> baseline {base['peak_rss_mb']:.0f} MB")
+        if cur["output_bytes"] > base["output_bytes"] * (1 + threshold):
+            problems.append(f"{key}: output {cur['output_bytes']} B "
+                            f"> baseline {base['output_bytes']} B")
+    return problems
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["tiny", "small"], choices=list(SIZES))
+    parser.add_argument("--cases", nargs="+", default=DEFAULT_CASES, choices=list(CASES))
+    parser.add_argument("--layers", type=int, default=4, help="Layers generated for the merge cases")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", type=Path, default=DEFAULT_WORKDIR)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="Fail on regressions against the baseline")
+    parser.add_argument("--threshold", type=float, default=0.15)
+    parser.add_argument("--output", type=Path, help="Also write the results as JSON here")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in args.sizes:
+        inputs = prepare_inputs(args.workdir, size, args.layers)
+        for case in args.cases:
+            key = f"{size}/{case}"
+            res = run_case(case, inputs, repeat=args.repeat)
+            results[key] = res
+            print(f"{key:45s} {res['mpix_s']:9.1f} MPix/s  {res['seconds']:8.3f} s  "
+                  f"{res['peak_rss_mb']:8.0f} MB RSS  {res['output_bytes'] / 1e6:9.2f} MB out")
+
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f"[benchmark] baseline saved to {args.baseline}")
+    if args.compare:
+        if not args.baseline.exists():
+            print(f"[benchmark] no baseline at {args.baseline}")
+            return 1
+        problems = compare(results, json.loads(args.baseline.read_text()), args.threshold)
+        for msg in problems:
+            print(f"[benchmark] REGRESSION {msg}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,8 @@ import math
 from pathlib import Path
 from osgeo import gdal
 
+from instrumentation import stage
+
 def world2pixel(gt, x, y):
     """Convierte coordenada (x, y) en píxeles según el GeoTransform gt."""
     x0, dx, rx, y0, ry, dy = gt
@@ -60,54 +62,64 @@ def warp_to_tiff(input_tif, output_tif, extent):
             "BLOCKXSIZE=1024",   # Tamaño del bloque en X (1024 píxeles)
             "BLOCKYSIZE=1024",   # Tamaño del bloque en Y (1024 píxeles)
             "INTERLEAVE=PIXEL",  # Interleave en formato PIXEL
+            "SPARSE_OK=TRUE",    # No escribir bloques que son todo nodata
         ],
     )
     
     # Especifica el sistema de referencia espacial al llamar a gdal.Translate
-    gdal.Translate(str(output_tif), input_tif, options=translate_opts, dstSRS="EPSG:4326")
+    with stage("translate", inputs=[input_tif], outputs=[output_tif], pixels=xsize * ysize):
+        gdal.Translate(str(output_tif), input_tif, options=translate_opts, dstSRS="EPSG:4326")
 
 
-# 1) Leer el bounding box de 'elevation.tif'
-elev_path = "elevation.tif"
-ds_elev = gdal.Open(elev_path)
-if not ds_elev:
-    raise RuntimeError(f"No se pudo abrir {elev_path}")
+def main(elev_path="elevation.tif", pattern="bio/*.tif", out_dir="bio/tiff"):
+    """
+    Recorta cada TIFF de 'pattern' a la extensión de 'elev_path' y guarda los
+    resultados en 'out_dir'.
+    """
+    # 1) Leer el bounding box de 'elevation.tif'
+    ds_elev = gdal.Open(elev_path)
+    if not ds_elev:
+        raise RuntimeError(f"No se pudo abrir {elev_path}")
 
-# Obtener geotransform [x0, dx, 0, y0, 0, dy]
-gt = ds_elev.GetGeoTransform()
-x0, dx, _, y0, _, dy = gt
+    # Obtener geotransform [x0, dx, 0, y0, 0, dy]
+    gt = ds_elev.GetGeoTransform()
+    x0, dx, _, y0, _, dy = gt
 
-x_size = ds_elev.RasterXSize
-y_size = ds_elev.RasterYSize
+    x_size = ds_elev.RasterXSize
+    y_size = ds_elev.RasterYSize
 
-# Calcular x_max, y_max
-x_max = x0 + dx * x_size
-y_max = y0 + dy * y_size
+    # Calcular x_max, y_max
+    x_max = x0 + dx * x_size
+    y_max = y0 + dy * y_size
 
-# Para outputBounds en GDAL: [xmin, ymin, xmax, ymax]
-if dy < 0:
-    # y0 es top, y_max es bottom
-    extent = [x0, y_max, x_max, y0]
-else:
-    # y0 es bottom, y_max es top
-    extent = [x0, y0, x_max, y_max]
+    # Para outputBounds en GDAL: [xmin, ymin, xmax, ymax]
+    if dy < 0:
+        # y0 es top, y_max es bottom
+        extent = [x0, y_max, x_max, y0]
+    else:
+        # y0 es bottom, y_max es top
+        extent = [x0, y0, x_max, y_max]
 
-ds_elev = None  # Cerrar el dataset de elevation
+    ds_elev = None  # Cerrar el dataset de elevation
 
-# 2) Crear carpeta de salida
-out_dir = Path("bio/tiff")
-out_dir.mkdir(parents=True, exist_ok=True)
+    # 2) Crear carpeta de salida
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # 3) Iterar sobre cada TIFF en "bio/images"
+    for tif_path in glob.glob(pattern):
+        if tif_path.endswith("elevation.tif"):
+            # Saltamos el propio elevation.tif
+            continue
+
+        base_name = Path(tif_path).stem  # nombre sin extensión
+        out_path = out_dir / f"{base_name}.tif"
+
+        print(f"Procesando: {tif_path} -> {out_path}")
+        warp_to_tiff(tif_path, out_path, extent)
+
+    print(f"¡Listo! Se generaron los TIFF con bloques 1024x1024 y interleave PIXEL en la carpeta {out_dir}/.")
 
-# 3) Iterar sobre cada TIFF en "bio/images"
-for tif_path in glob.glob("bio/*.tif"):
-    if tif_path.endswith("elevation.tif"):
-        # Saltamos el propio elevation.tif
-        continue
-    
-    base_name = Path(tif_path).stem  # nombre sin extensión
-    out_path = out_dir / f"{base_name}.tif"
-    
-    print(f"Procesando: {tif_path} -> {out_path}")
-    warp_to_tiff(tif_path, out_path, extent)
 
-print("¡Listo! Se generaron los TIFF con bloques 1024x1024 y interleave PIXEL en la carpeta bio/tiff/.")
+if __name__ == "__main__":
+    main()
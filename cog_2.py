@@ -1,14 +1,21 @@
 import glob
 import os
 from pathlib import Path
+import numpy as np
 from osgeo import gdal
 
+from instrumentation import stage
+from try_try import common_data_type, select_bands, write_multiband
+from window_iter import iter_windows
+
 def warp_without_unscale(input_tif, tmp_tif, extent, x_res, y_res, proj):
     """
     1) Warp sin 'unscale':
        Recorta 'input_tif' a la extensión 'extent' (xmin, ymin, xmax, ymax),
        usando la misma resolución que 'elevation.tif' (x_res, y_res) y proyección 'proj'.
        Se utiliza 'nearest neighbor' sin aplicar factor de escala ni offset.
+       El nodata de la fuente se conserva y los bloques que quedan todo
+       nodata no se escriben (SPARSE_OK).
     """
     warp_options = gdal.WarpOptions(
         format="GTiff",
@@ -18,8 +25,10 @@ def warp_without_unscale(input_tif, tmp_tif, extent, x_res, y_res, proj):
         targetAlignedPixels=True,
         resampleAlg="near",
         dstSRS=proj,
+        warpOptions=["INIT_DEST=NO_DATA", "SKIP_NOSOURCE=YES"],
         creationOptions=[
             "COMPRESS=DEFLATE",
+            "SPARSE_OK=TRUE",
             "BIGTIFF=YES"
         ]
         # No usamos 'unscale=True' porque tu GDAL no lo soporta
@@ -31,21 +40,22 @@ def warp_without_unscale(input_tif, tmp_tif, extent, x_res, y_res, proj):
         options=warp_options
     )
 
-def apply_scale_offset(in_tif, out_tif):
+def apply_scale_offset(in_tif, out_tif, block_rows=1024):
     """
     2) Aplica manualmente la escala/offset (si existen) de la banda 1.
-       - Lee 'scale' y 'offset' de la banda 1 del in_tif.
+       - Lee 'scale', 'offset' y 'nodata' de la banda 1 del in_tif.
        - Crea un nuevo TIFF con los valores ya desescalados en float32.
+       - Los píxeles nodata se mantienen con el mismo valor nodata.
+       - Trabaja por franjas de 'block_rows' filas; las franjas que son todo
+         nodata no se leen ni se escriben (quedan vacías con SPARSE_OK).
     """
     ds = gdal.Open(str(in_tif), gdal.GA_ReadOnly)
     band = ds.GetRasterBand(1)
 
-    # Tomar los metadatos de escala/offset si existen
+    # Tomar los metadatos de escala/offset/nodata si existen
     scale = band.GetScale()   # Puede ser None si no existe
     offset = band.GetOffset() # Puede ser None si no existe
-
-    # Leemos el array como float para poder hacer la operación
-    arr = band.ReadAsArray().astype("float32")
+    nodata = band.GetNoDataValue()
 
     # Si no hay scale/offset definidos, usar scale=1, offset=0
     if scale is None:
@@ -53,9 +63,6 @@ def apply_scale_offset(in_tif, out_tif):
     if offset is None:
         offset = 0.0
 
-    # Aplicamos manualmente: valor_real = valor_bruto * scale + offset
-    arr = arr * scale + offset
-
     # Crear el TIFF de salida con float32
     driver = gdal.GetDriverByName('GTiff')
     out_ds = driver.Create(
@@ -64,14 +71,24 @@ def apply_scale_offset(in_tif, out_tif):
         ds.RasterYSize,
         1,
         gdal.GDT_Float32,
-        options=["COMPRESS=DEFLATE","BIGTIFF=YES"]
+        options=["COMPRESS=DEFLATE","SPARSE_OK=TRUE","BIGTIFF=YES"]
     )
     # Copiar info espacial
     out_ds.SetGeoTransform(ds.GetGeoTransform())
     out_ds.SetProjection(ds.GetProjection())
-
-    # Escribimos el array con valores ya desescalados
-    out_ds.GetRasterBand(1).WriteArray(arr)
+    out_band = out_ds.GetRasterBand(1)
+    if nodata is not None:
+        out_band.SetNoDataValue(nodata)
+
+    windows = iter_windows(in_tif, (ds.RasterXSize, block_rows), skip_nodata=True)
+    for (col, row, _, _), block in windows:
+        raw = block[0]
+        # Aplicamos manualmente: valor_real = valor_bruto * scale + offset
+        arr = raw.astype("float32") * scale + offset
+        if nodata is not None:
+            arr[np.isnan(raw) if np.isnan(nodata) else raw == nodata] = nodata
+        # Escribimos el bloque con valores ya desescalados
+        out_band.WriteArray(arr, col, row)
 
     # Cerrar
     out_ds = None
@@ -87,130 +104,115 @@ def warp_to_tiff(input_tif, output_tif, extent, x_res, y_res, proj):
     tmp_tif = str(output_tif) + ".tmpwarp.tif"
 
     # 1) Warp sin unscale
-    warp_without_unscale(input_tif, tmp_tif, extent, x_res, y_res, proj)
+    with stage("warp", inputs=[input_tif], outputs=[tmp_tif]):
+        warp_without_unscale(input_tif, tmp_tif, extent, x_res, y_res, proj)
 
     # 2) Aplica scale/offset manualmente
-    apply_scale_offset(tmp_tif, output_tif)
+    with stage("unscale", inputs=[tmp_tif], outputs=[output_tif]):
+        apply_scale_offset(tmp_tif, output_tif)
 
     # 3) Borramos el temporal
     if os.path.exists(tmp_tif):
         os.remove(tmp_tif)
 
-def merge_bands_to_tiff(input_tifs, output_tif):
+def merge_bands_to_tiff(input_tifs, output_tif, bands=None, output_type=None):
     """
     Fusiona múltiples TIFFs (ya con valores "reales") en un solo multibanda.
     - No hacemos unscale aquí: asumimos que ya está aplicado en warp_to_tiff.
+      Si una entrada conserva scale/offset, se copian como metadatos de su banda.
     - Cada banda se nombra según el nombre del archivo (sin extensión).
+    - 'bands': nombres de las bandas a incluir, en orden (por defecto todas).
+    - 'output_type': tipo GDAL de salida; por defecto el tipo común de todas
+      las entradas (no el de la primera, que podía truncar las demás).
+    - El archivo tiene un único nodata (el primero de las entradas que
+      quepa en el tipo); los píxeles nodata de cada banda se escriben con
+      ese valor, así las bandas con nodata distinto siguen enmascaradas.
     """
-    datasets = [gdal.Open(str(tif)) for tif in input_tifs]
-    if not datasets:
+    input_tifs = select_bands(input_tifs, bands)
+    if not input_tifs:
         raise RuntimeError("No hay datasets de entrada para fusionar.")
-    
-    # Info espacial del primero
-    x_size = datasets[0].RasterXSize
-    y_size = datasets[0].RasterYSize
-    geotrans = datasets[0].GetGeoTransform()
-    proj = datasets[0].GetProjection()
 
-    # Tipo de la primera banda
-    first_band = datasets[0].GetRasterBand(1)
-    band_type = first_band.DataType
+    # Tipo común a todas las bandas (p.e. Int16 + Byte -> Int16)
+    band_type = output_type if output_type is not None else common_data_type(input_tifs)
+
+    # Un GeoTIFF guarda un solo nodata: el nodata de cada banda se reescribe
+    # con el valor común del archivo (bloque a bloque, ver 'write_multiband')
+    write_multiband(str(output_tif), [str(t) for t in input_tifs], band_type, [
+        "COMPRESS=DEFLATE",
+        "BIGTIFF=YES",
+        "TILED=YES",
+        "BLOCKXSIZE=1024",
+        "BLOCKYSIZE=1024",
+        "INTERLEAVE=PIXEL",
+        "SPARSE_OK=TRUE"
+    ])
 
-    driver = gdal.GetDriverByName('GTiff')
-    out_ds = driver.Create(
-        str(output_tif),
-        x_size,
-        y_size,
-        len(datasets),
-        band_type,
-        options=[
-            "COMPRESS=DEFLATE",
-            "BIGTIFF=YES",
-            "TILED=YES",
-            "BLOCKXSIZE=1024",
-            "BLOCKYSIZE=1024",
-            "INTERLEAVE=PIXEL"
-        ]
-    )
-    out_ds.SetGeoTransform(geotrans)
-    out_ds.SetProjection(proj)
+# ----------------------------------------------------------------------
+#                  LÓGICA PRINCIPAL (sin unscale=True)
+# ----------------------------------------------------------------------
 
-    # Copiamos cada banda
-    for i, ds_in in enumerate(datasets):
-        arr = ds_in.GetRasterBand(1).ReadAsArray()
-        out_band = out_ds.GetRasterBand(i+1)
-        out_band.WriteArray(arr)
+if __name__ == "__main__":
+    # 1) Leer bounding box y resolución de 'elevation.tif'
+    elev_path = "elevation.tif"
+    ds_elev = gdal.Open(str(elev_path))
+    if not ds_elev:
+        raise RuntimeError(f"No se pudo abrir {elev_path}")
 
-        # Nombre de la banda = nombre del archivo de entrada
-        band_name = Path(input_tifs[i]).stem
-        out_band.SetDescription(band_name)
+    gt = ds_elev.GetGeoTransform()
+    x0, dx, _, y0, _, dy = gt
+    x_size = ds_elev.RasterXSize
+    y_size = ds_elev.RasterYSize
+    proj_elev = ds_elev.GetProjection()
 
-    # Cerrar
-    for ds_in in datasets:
-        ds_in = None
-    out_ds = None
+    x_max = x0 + dx * x_size
+    y_max = y0 + dy * y_size
 
-# ----------------------------------------------------------------------
-#                  LÓGICA PRINCIPAL (sin unscale=True)
-# ----------------------------------------------------------------------
+    if dy < 0:
+        extent = [x0, y_max, x_max, y0]
+    else:
+        extent = [x0, y0, x_max, y_max]
 
-# 1) Leer bounding box y resolución de 'elevation.tif'
-elev_path = "elevation.tif"
-ds_elev = gdal.Open(str(elev_path))
-if not ds_elev:
-    raise RuntimeError(f"No se pudo abrir {elev_path}")
-
-gt = ds_elev.GetGeoTransform()
-x0, dx, _, y0, _, dy = gt
-x_size = ds_elev.RasterXSize
-y_size = ds_elev.RasterYSize
-proj_elev = ds_elev.GetProjection()
-
-x_max = x0 + dx * x_size
-y_max = y0 + dy * y_size
-
-if dy < 0:
-    extent = [x0, y_max, x_max, y0]
-else:
-    extent = [x0, y0, x_max, y_max]
-
-x_res = abs(dx)
-y_res = abs(dy)
-ds_elev = None
-
-# 2) Crear carpeta de salida
-out_dir = Path("bio/tiff2/try/crops")
-out_dir.mkdir(parents=True, exist_ok=True)
-
-# 3) Recortar cada TIFF en "bio/tiff2/try", aplicando scale manual, excepto "elevation.tif"
-tif_files = glob.glob("bio/*.tif")
-recortados = []
-
-for tif_path in tif_files:
-    if Path(tif_path).name == "elevation.tif":
-        continue  # Omitir elevación si está
-
-    base_name = Path(tif_path).stem
-    out_path = out_dir / f"{base_name}.tif"
-    print(f"Recortando y desescalando: {tif_path} -> {out_path}")
-    warp_to_tiff(
-        input_tif=tif_path,
-        output_tif=out_path,
-        extent=extent,
-        x_res=x_res,
-        y_res=y_res,
-        proj=proj_elev
-    )
-    recortados.append(out_path)
+    x_res = abs(dx)
+    y_res = abs(dy)
+    ds_elev = None
+
+    # 2) Crear carpeta de salida
+    out_dir = Path("bio/tiff2/try/crops")
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # 3) Recortar cada TIFF en "bio/tiff2/try", aplicando scale manual, excepto "elevation.tif"
+    #    Solo se recortan de nuevo los TIFF que cambiaron desde la última ejecución
+    from incremental import build_crops, update_multiband
+
+    tif_files = sorted(t for t in glob.glob("bio/*.tif") if Path(t).name != "elevation.tif")
+
+    def recortar(tif_path, out_path):
+        print(f"Recortando y desescalando: {tif_path} -> {out_path}")
+        warp_to_tiff(
+            input_tif=tif_path,
+            output_tif=out_path,
+            extent=extent,
+            x_res=x_res,
+            y_res=y_res,
+            proj=proj_elev
+        )
 
-# 4) Fusionar en un multibanda (ya no hay unscale)
-if recortados:
-    output_tif = out_dir / "merged_output.tif"
-    print(f"Creando multibanda: {output_tif}")
-    merge_bands_to_tiff(recortados, output_tif)
-    print(f"TIFF final multibanda guardado en: {output_tif}")
-else:
-    print("No se encontraron TIFFs para fusionar (aparte de 'elevation.tif').")
+    parametros = {"extent": extent, "x_res": x_res, "y_res": y_res, "proj": proj_elev}
+    recortados, _ = build_crops(tif_files, out_dir, recortar, parametros)
+
+    # 4) Fusionar en un multibanda (ya no hay unscale); solo las bandas que cambiaron
+    if recortados:
+        output_tif = out_dir / "merged_output.tif"
+        print(f"Creando multibanda: {output_tif}")
+
+        def fusionar(salida, entradas):
+            with stage("merge", inputs=entradas, outputs=[salida], bands=len(entradas)):
+                merge_bands_to_tiff(entradas, salida)
+
+        update_multiband(output_tif, recortados, fusionar)
+        print(f"TIFF final multibanda guardado en: {output_tif}")
+    else:
+        print("No se encontraron TIFFs para fusionar (aparte de 'elevation.tif').")
 
 
 
@@ -222,7 +224,12 @@ else:
 import glob
 import os
 from pathlib import Path
-from osgeo import gdal
+import numpy as np
+from osgeo import gdal, gdal_array
+
+from instrumentation import stage
+from try_try import multiband_nodata, remap_nodata
+from window_iter import iter_windows
 
 def partial_merge_bands_to_tiff(input_tifs, output_tif, block_size=1024):
     """
@@ -231,7 +238,7 @@ def partial_merge_bands_to_tiff(input_tifs, output_tif, block_size=1024):
 
     - Usa compresión DEFLATE + PREDICTOR=3 (adecuado para flotantes).
     - TILED=YES, BLOCKXSIZE=1024, BLOCKYSIZE=1024, INTERLEAVE=PIXEL.
-    - Emplea argumentos posicionales en ReadAsArray(col, row, cols_to_read, rows_to_read).
+    - Lee los bloques con 'iter_windows' (window_iter.py), que precarga los siguientes en segundo plano.
     """
 
     # Abrimos todos los TIFF de entrada en modo lectura
@@ -248,6 +255,10 @@ def partial_merge_bands_to_tiff(input_tifs, output_tif, block_size=1024):
     # Tipo de dato de la primera banda
     first_band = datasets[0].GetRasterBand(1)
     band_type = first_band.DataType  # p.e. gdal.GDT_Float32
+    np_type = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(band_type))
+
+    # Un GeoTIFF guarda un solo nodata para todas las bandas
+    nodata = multiband_nodata(input_tifs, band_type)
 
     # Creamos el archivo de salida con tantas bandas como TIFFs
     driver = gdal.GetDriverByName("GTiff")
@@ -265,6 +276,7 @@ def partial_merge_bands_to_tiff(input_tifs, output_tif, block_size=1024):
             "BLOCKYSIZE=1024",
             "INTERLEAVE=PIXEL",
             # "ZLEVEL=9",    # Si quieres compresión Deflate máxima, descoméntalo
+            "SPARSE_OK=TRUE",  # Bloques todo nodata no se escriben
             "BIGTIFF=YES"
         ],
     )
@@ -273,23 +285,24 @@ def partial_merge_bands_to_tiff(input_tifs, output_tif, block_size=1024):
 
     # Para cada TIFF de entrada, copiamos su banda 1 como banda i+1 del multibanda
     for i, ds_in in enumerate(datasets):
-        in_band = ds_in.GetRasterBand(1)
         out_band = out_ds.GetRasterBand(i + 1)
 
         # Nombre de la banda = nombre del archivo sin extensión
         band_name = Path(input_tifs[i]).stem
         out_band.SetDescription(band_name)
 
-        # Leer/escribir en bloques (posicionales en vez de xoff=,yoff=,...)
-        for row in range(0, y_size, block_size):
-            rows_to_read = min(block_size, y_size - row)
-            for col in range(0, x_size, block_size):
-                cols_to_read = min(block_size, x_size - col)
+        # Nodata común del archivo; el de la entrada se reescribe con él
+        if nodata is not None:
+            out_band.SetNoDataValue(nodata)
+        in_nodata = ds_in.GetRasterBand(1).GetNoDataValue()
 
-                # Leer un bloque del TIFF de entrada (posicional)
-                data_block = in_band.ReadAsArray(col, row, cols_to_read, rows_to_read)
-                # Escribir el bloque
-                out_band.WriteArray(data_block, col, row)
+        # Leer/escribir en bloques; la lectura del siguiente bloque se hace
+        # en segundo plano mientras se escribe el actual. Los bloques todo
+        # nodata se saltan y quedan vacíos en la salida (se leen como 'nodata').
+        for (col, row, _, _), data_block in iter_windows(input_tifs[i], block_size,
+                                                         skip_nodata=True):
+            out_band.WriteArray(remap_nodata(data_block[0], in_nodata, nodata, np_type),
+                                col, row)
 
     # Cerrar todo
     out_ds = None
@@ -298,20 +311,22 @@ def partial_merge_bands_to_tiff(input_tifs, output_tif, block_size=1024):
 
 
 # ------------------- LÓGICA PRINCIPAL -------------------
-# 1) Carpeta donde ya tienes todos los TIFF recortados:
-crops_dir = Path("/home/contreras/Documents/GitHub/download_20m/bio/tiff2/try/crops")
-
-# 2) Buscamos los .tif en esa carpeta
-tif_files = sorted(glob.glob(str(crops_dir / "*.tif")))
-
-# 3) Evitar mezclar un TIFF de salida anterior si existe
-input_tifs = [t for t in tif_files if not t.endswith("merged_output3.tif")]
-
-# 4) Ejecutar la fusión
-if not input_tifs:
-    print("No se encontraron TIFFs de entrada para fusionar.")
-else:
-    output_tif = crops_dir / "merged_output2.tif"
-    print(f"Creando multibanda: {output_tif}")
-    partial_merge_bands_to_tiff(input_tifs, output_tif, block_size=1024)
-    print(f"¡Listo! Multibanda guardado en: {output_tif}")
+if __name__ == "__main__":
+    # 1) Carpeta donde ya tienes todos los TIFF recortados:
+    crops_dir = Path("/home/contreras/Documents/GitHub/download_20m/bio/tiff2/try/crops")
+
+    # 2) Buscamos los .tif en esa carpeta
+    tif_files = sorted(glob.glob(str(crops_dir / "*.tif")))
+
+    # 3) Evitar mezclar un TIFF de salida anterior si existe
+    input_tifs = [t for t in tif_files if not t.endswith("merged_output3.tif")]
+
+    # 4) Ejecutar la fusión
+    if not input_tifs:
+        print("No se encontraron TIFFs de entrada para fusionar.")
+    else:
+        output_tif = crops_dir / "merged_output2.tif"
+        print(f"Creando multibanda: {output_tif}")
+        with stage("merge", inputs=input_tifs, outputs=[output_tif], bands=len(input_tifs)):
+            partial_merge_bands_to_tiff(input_tifs, output_tif, block_size=1024)
+        print(f"¡Listo! Multibanda guardado en: {output_tif}")
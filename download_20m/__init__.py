@@ -0,0 +1,12 @@
+"""
+Command-line entry point for the CHELSA download / crop / merge scripts.
+
+    python -m download_20m --help
+    python -m download_20m download --list
+    python -m download_20m crop --ref elevation.tif --out crops bio/
+    python -m download_20m merge crops/multiband.tif crops/ --types auto
+
+Heavy dependencies (osgeo.gdal, numpy, ee, pandas, cubexpress) are only
+imported by the subcommand that needs them, so '--help' and planning
+commands start without loading GDAL or Earth Engine.
+"""
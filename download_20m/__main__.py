@@ -0,0 +1,3 @@
+from download_20m.cli import main
+
+raise SystemExit(main())
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+One CLI for the pipeline scripts, with lazy imports.
+
+Each subcommand imports its modules inside its handler: building the
+parser and '--help' only need the standard library. Check with::
+
+    python -X importtime -m download_20m --help 2>&1 | sort -t'|' -k2 -n | tail
+"""
+
+import argparse
+import os
+import re
+import sys
+from pathlib import Path
+
+# The pipeline modules live flat in the repository root, next to this package
+_ROOT = str(Path(__file__).resolve().parent.parent)
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+
+def _expand_tifs(paths: list[str]) -> list[str]:
+    """Files as given; directories expand to their *.tif files, sorted."""
+    tifs = []
+    for path in paths:
+        if os.path.isdir(path):
+            tifs += sorted(str(p) for p in Path(path).glob("*.tif"))
+        else:
+            tifs.append(path)
+    return tifs
+
+
+def cmd_download(args) -> int:
+    import download_tif
+
+    urls = download_tif.images
+    if args.urls:
+        urls = [line.strip() for line in open(args.urls) if line.strip()]
+    if args.list:
+        # Planning only: no GDAL, no network
+        for url in urls:
+            target = download_tif.target_path(url, args.out)
+            print(f"{'ok     ' if os.path.exists(target) else 'missing'} {target}")
+        return 0
+    failed = download_tif.download_all(urls, args.out, args.checksums)
+    return 1 if failed else 0
+
+
+def cmd_crop(args) -> int:
+    from incremental import build_crops
+    from try_try import get_raster_info
+
+    ref_info = get_raster_info(args.ref)
+    inputs = [t for t in _expand_tifs(args.inputs) if Path(t).name != Path(args.ref).name]
+
+    if args.mode == "unscale":
+        from cog_2 import warp_to_tiff
+
+        xmin, ymin, xmax, ymax = ref_info["bbox"]
+
+        def crop(src, dst):
+            warp_to_tiff(src, dst, [xmin, ymin, xmax, ymax], abs(ref_info["xres"]),
+                         abs(ref_info["yres"]), ref_info["projection"])
+    elif args.workers > 1:
+        from tiled_warp import warp_exact_grid_tiled
+
+        def crop(src, dst):
+            warp_exact_grid_tiled(src, dst, ref_info, workers=args.workers)
+    else:
+        from grid_align import crop_to_grid
+
+        def crop(src, dst):
+            crop_to_grid(src, dst, ref_info)
+
+    Path(args.out).mkdir(parents=True, exist_ok=True)
+    build_crops(inputs, args.out, crop, {"ref": ref_info, "mode": args.mode},
+                hash_contents=args.hash)
+    return 0
+
+
+# Files written by 'merge --types auto': <stem>_<GDAL type>[_nodata<value>].tif
+_TYPED_OUTPUT = r"_(Byte|Int8|U?Int(16|32|64)|Float(32|64)|CInt(16|32)|CFloat(32|64))" \
+                r"(_nodata[^/]*)?\.tif"
+
+
+def _is_merge_output(tif: str, output: str) -> bool:
+    """True for 'output' itself and the typed files derived from it, so reruns skip them."""
+    tif, output = Path(tif).resolve(), Path(output).resolve()
+    if tif == output:
+        return True
+    return tif.parent == output.parent and \
+        re.fullmatch(re.escape(output.stem) + _TYPED_OUTPUT, tif.name) is not None
+
+
+def cmd_merge(args) -> int:
+    inputs = [t for t in _expand_tifs(args.inputs) if not _is_merge_output(t, args.output)]
+    bands = args.bands.split(",") if args.bands else None
+
+    if args.types == "auto":
+        from band_types import create_typed_multibands
+
+        create_typed_multibands(str(Path(args.output).with_suffix("")), inputs, bands, "auto")
+    elif args.passthrough:
+        from tile_merge import merge_bands_passthrough
+        from try_try import select_bands
+
+        merge_bands_passthrough(select_bands(inputs, bands), args.output)
+    else:
+        from try_try import create_multiband
+
+        create_multiband(args.output, inputs, bands)
+    return 0
+
+
+def cmd_inspect(args) -> int:
+    from inspect_geotiff import inspect_tiff
+
+    status = 0
+    for tif in args.tifs:
+        inspect_tiff(tif)
+        if args.verify or args.full:
+            from verify import verify_tiff
+
+            result = verify_tiff(tif, full=args.full)
+            print(f"  → Verificación: {'OK' if result['ok'] else result['errors'][:3]} "
+                  f"({result['blocks_checked']} bloques)")
+            status = status or (0 if result["ok"] else 1)
+    return status
+
+
+def cmd_s2_fetch(args) -> int:
+    from main import fetch_s2
+
+    fetch_s2(args.table, args.output, args.project, args.stop_id, args.workers)
+    return 0
+
+
+def cmd_pipeline(args) -> int:
+    import pipeline
+
+    return pipeline.main(args.pipeline_args)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="download_20m",
+                                     description="CHELSA download / crop / merge pipeline")
+    parser.add_argument("--profile", metavar="REPORT",
+                        help="Record stage timings to REPORT (.csv or .json)")
+    parser.add_argument("--trace", metavar="TRACE", help="Write a Chrome trace to TRACE")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("download", help="Download the CHELSA layers (with verification)")
+    p.add_argument("--out", default="bio", help="Download directory")
+    p.add_argument("--urls", help="Text file with one URL per line (default: built-in list)")
+    p.add_argument("--list", action="store_true", help="Only list targets and whether they exist")
+    p.add_argument("--checksums", help="sha256sum-style list of known checksums "
+                                       "(CHELSA publishes none; default: size check only)")
+    p.set_defaults(func=cmd_download)
+
+    p = sub.add_parser("crop", help="Crop layers to a reference grid (incremental)")
+    p.add_argument("inputs", nargs="+", help="Input .tif files or directories")
+    p.add_argument("--ref", required=True, help="Reference grid, e.g. elevation.tif")
+    p.add_argument("--out", required=True, help="Output directory")
+    p.add_argument("--mode", choices=("exact", "unscale"), default="exact",
+                   help="exact: nearest-neighbour crop keeping raw values; "
+                        "unscale: warp and apply scale/offset")
+    p.add_argument("--workers", type=int, default=1,
+                   help="Cores per layer for the exact crop (tiled warp)")
+    p.add_argument("--hash", action="store_true", help="Fingerprint inputs by SHA-256 too")
+    p.set_defaults(func=cmd_crop)
+
+    p = sub.add_parser("merge", help="Merge single-band crops into a multiband GeoTIFF")
+    p.add_argument("output", help="Multiband output")
+    p.add_argument("inputs", nargs="+", help="Input .tif files or directories")
+    p.add_argument("--bands", help="Comma-separated band names to include, in order")
+    p.add_argument("--types", choices=("keep", "auto"), default="keep",
+                   help="auto: smallest type per band, one file per type")
+    p.add_argument("--passthrough", action="store_true",
+                   help="Copy compressed tiles when the inputs allow it")
+    p.set_defaults(func=cmd_merge)
+
+    p = sub.add_parser("inspect", help="Print GeoTIFF metadata, optionally verify it")
+    p.add_argument("tifs", nargs="+")
+    p.add_argument("--verify", action="store_true", help="Structural check + sample decode")
+    p.add_argument("--full", action="store_true", help="Decode every block")
+    p.set_defaults(func=cmd_inspect)
+
+    p = sub.add_parser("s2-fetch", help="Fetch Sentinel-2 cubes listed in a table (Earth Engine)")
+    p.add_argument("--table", default="tables/methane_experiment.csv")
+    p.add_argument("--output", default="/media/contreras/LaCie/cesar_s2_toa")
+    p.add_argument("--project", default="ee-julius013199")
+    p.add_argument("--stop-id", default="9bc4842b-6f78-4c2e-8db1-204b866fac1d",
+                   help="Stop at this id_loc_image")
+    p.add_argument("--workers", type=int, default=4)
+    p.set_defaults(func=cmd_s2_fetch)
+
+    p = sub.add_parser("pipeline", help="Streaming download -> crop -> merge (see pipeline.py)")
+    p.add_argument("pipeline_args", nargs=argparse.REMAINDER)
+    p.set_defaults(func=cmd_pipeline)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.profile or args.trace:
+        import instrumentation
+
+        instrumentation.enable(args.profile, args.trace)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,24 +1,24 @@
 import os
-import requests
 
 years = range(1981, 2019)
 
 base_url = "https://os.zhdk.cloud.switch.ch/chelsav2/GLOBAL/annual/swb/CHELSA_swb_{}_V.2.1.tif"
 
-def download_file(url, filename):
+def download_file(url, filename, sha256=None):
     # Verificar si el archivo ya existe
     if os.path.exists(filename):
         print(f"{filename} ya existe. Se omite la descarga.")
         return
 
-    # Descargar el archivo si no existe
-    response = requests.get(url)
-    if response.status_code == 200:
-        with open(filename, 'wb') as file:
-            file.write(response.content)
-        print(f"{filename} descargado con éxito.")
-    else:
-        print(f"Error al descargar {filename}.")
+    # Descargar el archivo si no existe (por streaming a '.part', validando
+    # Content-Length y el SHA-256 si se conoce; solo se renombra si está completo)
+    from verify import DownloadError, download_verified
+
+    try:
+        info = download_verified(url, filename, sha256)
+        print(f"{filename} descargado con éxito ({info['bytes']} bytes, sha256 {info['sha256'][:12]}).")
+    except DownloadError as e:
+        print(f"Error al descargar {filename}: {e}")
 
 # Crear directorio si no existe
 # os.makedirs("images", exist_ok=True)
@@ -94,8 +94,39 @@ for x in [1,2,3,4,5,6,7,10,11,12,13,14,15,16,17]:
     images.append(var)
 
 
-# Descargar los archivos
-for image in images:
-    filename = "bio/" + image.split("bio/")[-1]
-    download_file(image, filename)
-    print(filename)
\ No newline at end of file
+def target_path(url, out_dir="bio"):
+    """Ruta local de la descarga de 'url' dentro de 'out_dir'."""
+    return os.path.join(out_dir, url.split("bio/")[-1].rsplit("/", 1)[-1])
+
+
+def download_all(urls=images, out_dir="bio", checksums_file=None):
+    """
+    Descarga los archivos; la verificación (estructura TIFF + decodificación de
+    una muestra de bloques) corre en segundo plano. Los archivos dañados se
+    mueven a cuarentena y se vuelven a descargar.
+
+    CHELSA no publica sumas de verificación: 'checksums_file' es una lista en
+    formato 'sha256sum' (p. ej. guardada de una descarga de confianza). Sin
+    ella solo se comprueban Content-Length y la estructura TIFF.
+    """
+    from verify import VerificationQueue, load_checksums
+
+    os.makedirs(out_dir, exist_ok=True)
+    checksums = load_checksums(checksums_file)
+    verificacion = VerificationQueue(os.path.join(out_dir, "cuarentena"))
+    for image in urls:
+        filename = target_path(image, out_dir)
+        sha256 = checksums.get(os.path.basename(filename))
+        download_file(image, filename, sha256)
+        verificacion.submit(filename,
+                            retry=lambda u=image, f=filename, h=sha256: download_file(u, f, h))
+        print(filename)
+
+    fallidos = verificacion.join()
+    if fallidos:
+        print(f"Archivos que siguen dañados tras reintentar: {fallidos}")
+    return fallidos
+
+
+if __name__ == "__main__":
+    download_all()
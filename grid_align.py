@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Exact-grid fast path for cropping a layer to the reference grid.
+
+'try_try.warp_exact_grid' always runs gdal.Warp. When the source and the
+reference share CRS and pixel size and differ only by a whole number of
+pixels (the case 'try.py' handles by hand), no resampling is needed:
+
+- "identical": same grid, same size
+- "offset": same CRS and resolution, integer pixel offset
+- "scaled": same CRS but different resolution or a sub-pixel shift
+- "reprojected": different CRS
+
+For "identical"/"offset" the crop is a plain window copy. When the window
+starts on a source tile boundary and the source tiles match the output
+tiles (size, codec, predictor, dtype), the compressed tiles are copied
+as-is without decoding. Otherwise the window is decoded and re-encoded
+block by block. The remaining cases fall back to 'warp_exact_grid'.
+"""
+
+import numpy as np
+from osgeo import gdal, osr
+
+from instrumentation import stage
+from tiff_layout import (
+    COMPRESSION_DEFLATE,
+    TiffLayoutError,
+    block_index,
+    read_layout,
+    read_raw_block,
+    write_raw_blocks,
+)
+from tiled_warp import BLOCK_SIZE, CREATION_OPTIONS, is_all_nodata, chunk_windows
+from try_try import get_raster_info, warp_exact_grid
+
+# Sub-pixel offsets smaller than this (in pixels) are treated as aligned
+PIXEL_TOLERANCE = 1e-3
+
+
+def same_crs(wkt_a: str, wkt_b: str) -> bool:
+    """True if both WKT strings describe the same spatial reference."""
+    if wkt_a == wkt_b:
+        return True
+    if not wkt_a or not wkt_b:
+        return False
+    srs_a = osr.SpatialReference()
+    srs_b = osr.SpatialReference()
+    srs_a.ImportFromWkt(wkt_a)
+    srs_b.ImportFromWkt(wkt_b)
+    return bool(srs_a.IsSame(srs_b))
+
+
+def classify_alignment(src_info: dict, ref_info: dict,
+                       tolerance: float = PIXEL_TOLERANCE) -> tuple[str, int, int]:
+    """
+    Classify how the reference grid relates to the source grid.
+
+    :param src_info: Source raster info from 'get_raster_info'
+    :param ref_info: Reference raster info from 'get_raster_info'
+    :param tolerance: Maximum deviation from a whole pixel, in pixels
+    :return: (kind, xoff, yoff) where kind is "identical", "offset", "scaled"
+             or "reprojected", and (xoff, yoff) is the position of the
+             reference's top-left pixel in the source grid (0, 0 unless
+             kind is "identical" or "offset")
+    """
+    if not same_crs(src_info["projection"], ref_info["projection"]):
+        return "reprojected", 0, 0
+
+    for key in ("xres", "yres"):
+        # Resolutions must match to within 'tolerance' pixels over the whole reference
+        extent = ref_info["width"] if key == "xres" else ref_info["height"]
+        if abs(src_info[key] - ref_info[key]) * extent > tolerance * abs(src_info[key]):
+            return "scaled", 0, 0
+
+    src_xmin, _, _, src_ymax = src_info["bbox"]
+    ref_xmin, _, _, ref_ymax = ref_info["bbox"]
+    xoff = (ref_xmin - src_xmin) / src_info["xres"]
+    yoff = (ref_ymax - src_ymax) / src_info["yres"]
+    if abs(xoff - round(xoff)) > tolerance or abs(yoff - round(yoff)) > tolerance:
+        return "scaled", 0, 0
+
+    xoff, yoff = int(round(xoff)), int(round(yoff))
+    if (xoff, yoff) == (0, 0) and (src_info["width"], src_info["height"]) == \
+            (ref_info["width"], ref_info["height"]):
+        return "identical", 0, 0
+    return "offset", xoff, yoff
+
+
+def _can_copy_raw(layout: dict, src_info: dict, ref_info: dict, xoff: int, yoff: int) -> bool:
+    """
+    True if every output tile is exactly one compressed source tile. The
+    source must be little-endian like the GDAL output, or the copied tiles
+    would decode byte-swapped.
+    """
+    return (
+        layout["tiled"]
+        and layout["endian"] == "<"
+        and layout["block_width"] == BLOCK_SIZE
+        and layout["block_height"] == BLOCK_SIZE
+        and layout["samples_per_pixel"] == 1
+        and layout["compression"] in COMPRESSION_DEFLATE
+        and layout["predictor"] == 1
+        and xoff % BLOCK_SIZE == 0
+        and yoff % BLOCK_SIZE == 0
+        and xoff >= 0
+        and yoff >= 0
+        and xoff + ref_info["width"] <= src_info["width"]
+        and yoff + ref_info["height"] <= src_info["height"]
+    )
+
+
+def _create_output(output_tif: str, ref_info: dict, src_band):
+    """Create the sparse tiled output on the reference grid, copying band metadata from the source."""
+    driver = gdal.GetDriverByName("GTiff")
+    out_ds = driver.Create(output_tif, ref_info["width"], ref_info["height"], 1,
+                           src_band.DataType, options=CREATION_OPTIONS)
+    xmin, _, _, ymax = ref_info["bbox"]
+    out_ds.SetGeoTransform((xmin, ref_info["xres"], 0.0, ymax, 0.0, ref_info["yres"]))
+    out_ds.SetProjection(ref_info["projection"])
+    out_band = out_ds.GetRasterBand(1)
+    nodata = src_band.GetNoDataValue()
+    if nodata is not None:
+        out_band.SetNoDataValue(nodata)
+    if src_band.GetScale() is not None:
+        out_band.SetScale(src_band.GetScale())
+    if src_band.GetOffset() is not None:
+        out_band.SetOffset(src_band.GetOffset())
+    return out_ds
+
+
+def copy_raw_tiles(input_tif: str, output_tif: str, ref_info: dict, xoff: int, yoff: int,
+                   layout: dict) -> None:
+    """
+    Crop by copying compressed tiles: tile (i, j) of the output is tile
+    (xoff/1024 + i, yoff/1024 + j) of the source, byte for byte.
+    """
+    src_ds = gdal.Open(input_tif)
+    out_ds = _create_output(output_tif, ref_info, src_ds.GetRasterBand(1))
+    out_ds = None
+    src_ds = None
+
+    tx0 = xoff // BLOCK_SIZE
+    ty0 = yoff // BLOCK_SIZE
+    out_across = -(-ref_info["width"] // BLOCK_SIZE)
+    out_down = -(-ref_info["height"] // BLOCK_SIZE)
+
+    def blocks():
+        # Streamed: only one compressed tile is held in memory at a time
+        with open(input_tif, "rb") as fh:
+            for ty in range(out_down):
+                for tx in range(out_across):
+                    src_index = block_index(layout, 0, tx0 + tx, ty0 + ty)
+                    yield ty * out_across + tx, read_raw_block(fh, layout, src_index)
+
+    write_raw_blocks(output_tif, blocks())
+
+
+def copy_window(input_tif: str, output_tif: str, ref_info: dict, xoff: int, yoff: int) -> None:
+    """
+    Crop by decoding the source window block by block. Parts of the
+    reference grid outside the source are left as nodata (sparse tiles).
+    """
+    src_ds = gdal.Open(input_tif)
+    src_band = src_ds.GetRasterBand(1)
+    out_ds = _create_output(output_tif, ref_info, src_band)
+    out_band = out_ds.GetRasterBand(1)
+    nodata = src_band.GetNoDataValue()
+    fill = nodata if nodata is not None else 0
+    src_w, src_h = src_ds.RasterXSize, src_ds.RasterYSize
+
+    for col, row, cols, rows in chunk_windows(ref_info["width"], ref_info["height"], BLOCK_SIZE):
+        # Intersection of this output block with the source, in source pixels
+        sx0 = max(xoff + col, 0)
+        sy0 = max(yoff + row, 0)
+        sx1 = min(xoff + col + cols, src_w)
+        sy1 = min(yoff + row + rows, src_h)
+        if sx0 >= sx1 or sy0 >= sy1:
+            continue  # entirely outside the source: keep the block sparse
+        data = src_band.ReadAsArray(sx0, sy0, sx1 - sx0, sy1 - sy0)
+        if nodata is not None and is_all_nodata(data, nodata):
+            continue  # all-nodata block: keep it sparse
+        if (sx1 - sx0, sy1 - sy0) != (cols, rows):
+            block = np.full((rows, cols), fill, dtype=data.dtype)
+            block[sy0 - yoff - row:sy1 - yoff - row, sx0 - xoff - col:sx1 - xoff - col] = data
+            data = block
+        out_band.WriteArray(data, col, row)
+
+    out_ds = None
+    src_ds = None
+
+
+def crop_to_grid(input_tif: str, output_tif: str, ref_info: dict) -> str:
+    """
+    Crop 'input_tif' onto the reference grid, taking the cheapest exact path.
+
+    Drop-in replacement for 'warp_exact_grid': same output grid, tiling and
+    compression, and the same pixel values as a nearest-neighbour warp.
+
+    :param input_tif: Path to the input TIFF file
+    :param output_tif: Path to the output TIFF file
+    :param ref_info: Reference raster info from 'get_raster_info'
+    :return: The path taken: "raw_tiles", "window" or "warp"
+    """
+    src_info = get_raster_info(input_tif)
+    kind, xoff, yoff = classify_alignment(src_info, ref_info)
+    if kind in ("scaled", "reprojected"):
+        warp_exact_grid(input_tif, output_tif, ref_info)
+        return "warp"
+
+    try:
+        layout = read_layout(input_tif)
+    except (OSError, TiffLayoutError):
+        layout = None
+
+    pixels = ref_info["width"] * ref_info["height"]
+    if layout is not None and _can_copy_raw(layout, src_info, ref_info, xoff, yoff):
+        with stage("copy_raw_tiles", inputs=[input_tif], outputs=[output_tif], pixels=pixels):
+            copy_raw_tiles(input_tif, output_tif, ref_info, xoff, yoff, layout)
+        path = "raw_tiles"
+    else:
+        with stage("copy_window", inputs=[input_tif], outputs=[output_tif], pixels=pixels):
+            copy_window(input_tif, output_tif, ref_info, xoff, yoff)
+        path = "window"
+    print(f"[crop_to_grid] {input_tif} -> {output_tif} ({kind}, {path})")
+    return path
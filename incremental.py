@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Incremental rebuild of the crops and the multiband output.
+
+A JSON manifest next to the outputs records, for every crop, the
+fingerprint of its input (size + mtime, optionally SHA-256), the build
+parameters (reference grid from 'get_raster_info', warp/creation options)
+and the fingerprint of the output that was written. On a rerun only the
+crops whose input, parameters or output changed are regenerated.
+
+The multiband output records the fingerprints of its band files. When
+only some bands changed and the band list, grid, CRS and data types are
+unchanged, those bands are rewritten in place (GA_Update); otherwise the
+multiband file is rebuilt with the given merge function. Pixel-interleaved
+outputs are always rebuilt: every tile holds all bands, so rewriting one
+band appends whole tiles again. A no-op rerun only stats files.
+
+Example::
+
+    crops, changed = build_crops(inputs, "crops", crop, {"ref": ref_info})
+    update_multiband("crops/multiband.tif", crops, create_multiband)
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from osgeo import gdal
+
+from grid_align import same_crs
+from instrumentation import stage
+from tiled_warp import BLOCK_SIZE, chunk_windows
+
+MANIFEST_NAME = ".build_manifest.json"
+MANIFEST_VERSION = 1
+
+_HASH_CHUNK = 8 * 1024 * 1024
+
+
+def _normalize(obj):
+    """JSON round trip, so tuples and lists compare equal to the stored manifest."""
+    return json.loads(json.dumps(obj, sort_keys=True, default=str))
+
+
+def file_fingerprint(path, previous: dict | None = None, hash_contents: bool = False) -> dict:
+    """
+    Fingerprint a file by size and mtime, and optionally by SHA-256.
+
+    :param path: File to fingerprint
+    :param previous: Earlier fingerprint of the same file; its hash is reused
+                     when size and mtime are unchanged
+    :param hash_contents: Also compute the SHA-256 of the contents
+    :return: Dict with "size", "mtime_ns" and, if hashed, "sha256"
+    :raises FileNotFoundError: If the file does not exist
+    """
+    st = os.stat(path)
+    fp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if hash_contents:
+        if previous and previous.get("sha256") and \
+                (previous.get("size"), previous.get("mtime_ns")) == (fp["size"], fp["mtime_ns"]):
+            fp["sha256"] = previous["sha256"]
+        else:
+            digest = hashlib.sha256()
+            with open(path, "rb") as fh:
+                for chunk in iter(lambda: fh.read(_HASH_CHUNK), b""):
+                    digest.update(chunk)
+            fp["sha256"] = digest.hexdigest()
+    return fp
+
+
+def same_contents(old: dict | None, new: dict) -> bool:
+    """
+    Compare two fingerprints: by hash when both have one (a re-download of
+    identical bytes is not a change), by size and mtime otherwise.
+    """
+    if not old:
+        return False
+    if "sha256" in old and "sha256" in new:
+        return old["sha256"] == new["sha256"] and old["size"] == new["size"]
+    return (old.get("size"), old.get("mtime_ns")) == (new["size"], new["mtime_ns"])
+
+
+def load_manifest(manifest_path) -> dict:
+    """Load the build manifest, or an empty one if missing, unreadable or outdated."""
+    try:
+        with open(manifest_path) as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        manifest = {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        manifest = {"version": MANIFEST_VERSION, "crops": {}, "multibands": {}}
+    return manifest
+
+
+def save_manifest(manifest_path, manifest: dict) -> None:
+    """Write the manifest atomically, so an interrupted run never leaves it half written."""
+    tmp_path = str(manifest_path) + ".tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def _output_is_current(entry: dict, output_tif: str) -> bool:
+    if not os.path.exists(output_tif):
+        return False
+    return same_contents(entry.get("output"), file_fingerprint(output_tif))
+
+
+def build_crops(input_tifs, out_dir, crop, params: dict, manifest_path=None,
+                hash_contents: bool = False) -> tuple[list[str], list[str]]:
+    """
+    Run 'crop' for every input whose crop is missing or out of date.
+
+    :param input_tifs: Input rasters
+    :param out_dir: Directory of the crops (one <input name> per input)
+    :param crop: Callable crop(input_tif, output_tif)
+    :param params: Everything else the crop depends on (reference grid,
+                   warp/creation options...); must be JSON serializable
+    :param manifest_path: Manifest file (default: out_dir/.build_manifest.json)
+    :param hash_contents: Fingerprint inputs by SHA-256 as well as size/mtime
+    :return: (all crop paths in input order, crop paths that were rebuilt)
+    """
+    out_dir = Path(out_dir)
+    manifest_path = manifest_path or out_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+    params = _normalize(params)
+
+    outputs, changed = [], []
+    for input_tif in input_tifs:
+        input_tif = str(input_tif)
+        output_tif = str(out_dir / Path(input_tif).name)
+        outputs.append(output_tif)
+
+        entry = manifest["crops"].get(output_tif, {})
+        input_fp = file_fingerprint(input_tif, entry.get("input_fp"), hash_contents)
+        if entry.get("input") == input_tif and entry.get("params") == params \
+                and same_contents(entry.get("input_fp"), input_fp) \
+                and _output_is_current(entry, output_tif):
+            continue
+
+        crop(input_tif, output_tif)
+        manifest["crops"][output_tif] = {
+            "input": input_tif,
+            "input_fp": input_fp,
+            "params": params,
+            "output": file_fingerprint(output_tif),
+        }
+        # Save after every crop so an interrupted run keeps its progress
+        save_manifest(manifest_path, manifest)
+        changed.append(output_tif)
+
+    print(f"[build_crops] {len(changed)} of {len(outputs)} crops rebuilt")
+    return outputs, changed
+
+
+def _can_update_in_place(out_ds, band_tifs: list[str]) -> bool:
+    """
+    True if the multiband file is band-separate and every band file still
+    matches its grid, CRS and band count, with a data type its band holds.
+    """
+    if out_ds is None or out_ds.RasterCount != len(band_tifs):
+        return False
+    if out_ds.RasterCount > 1 and \
+            out_ds.GetMetadataItem("INTERLEAVE", "IMAGE_STRUCTURE") == "PIXEL":
+        return False
+    for i, tif in enumerate(band_tifs):
+        ds = gdal.Open(tif)
+        if ds is None or (ds.RasterXSize, ds.RasterYSize) != (out_ds.RasterXSize, out_ds.RasterYSize) \
+                or ds.GetGeoTransform() != out_ds.GetGeoTransform() \
+                or not same_crs(ds.GetProjection(), out_ds.GetProjection()):
+            return False
+        out_type = out_ds.GetRasterBand(i + 1).DataType
+        if gdal.DataTypeUnion(out_type, ds.GetRasterBand(1).DataType) != out_type:
+            return False  # the new values would be truncated
+    return True
+
+
+def rewrite_bands(multiband_tif: str, updates: dict) -> None:
+    """
+    Overwrite bands of an existing multiband GeoTIFF block by block.
+
+    :param multiband_tif: Multiband file, opened in update mode
+    :param updates: {1-based band number: single-band TIFF with the new values}
+    """
+    out_ds = gdal.Open(multiband_tif, gdal.GA_Update)
+    for band_number, tif in updates.items():
+        src_ds = gdal.Open(tif)
+        src_band = src_ds.GetRasterBand(1)
+        out_band = out_ds.GetRasterBand(band_number)
+        for col, row, cols, rows in chunk_windows(src_ds.RasterXSize, src_ds.RasterYSize,
+                                                  BLOCK_SIZE):
+            out_band.WriteArray(src_band.ReadAsArray(col, row, cols, rows), col, row)
+        nodata = src_band.GetNoDataValue()
+        if nodata is not None:
+            out_band.SetNoDataValue(nodata)
+        if src_band.GetScale() is not None:
+            out_band.SetScale(src_band.GetScale())
+        if src_band.GetOffset() is not None:
+            out_band.SetOffset(src_band.GetOffset())
+        out_band.SetDescription(Path(tif).stem)
+        src_ds = None
+    out_ds = None
+
+
+def update_multiband(multiband_tif, band_tifs, merge, manifest_path=None) -> str:
+    """
+    Bring the multiband output up to date with its band files.
+
+    Compressed GTiff blocks rewritten in place are appended to the file, so
+    it grows by the changed bands on every partial update until the next
+    full rebuild. Pixel-interleaved files (the default of 'create_multiband'
+    and 'merge_bands_to_tiff') would grow by every band per changed band,
+    so they are rebuilt instead.
+
+    :param multiband_tif: Multiband output
+    :param band_tifs: Single-band files, in band order
+    :param merge: Callable merge(multiband_tif, band_tifs) used for full rebuilds,
+                  e.g. 'try_try.create_multiband'
+    :param manifest_path: Manifest file (default: next to the multiband output)
+    :return: "up_to_date", "in_place" or "rebuilt"
+    """
+    multiband_tif = str(multiband_tif)
+    band_tifs = [str(t) for t in band_tifs]
+    manifest_path = manifest_path or Path(multiband_tif).parent / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+    entry = manifest["multibands"].get(multiband_tif, {})
+
+    band_fps = [file_fingerprint(tif) for tif in band_tifs]
+    old_fps = entry.get("band_fps", [])
+    stale = [i for i, fp in enumerate(band_fps)
+             if i >= len(old_fps) or not same_contents(old_fps[i], fp)]
+
+    if entry.get("bands") == band_tifs and _output_is_current(entry, multiband_tif):
+        if not stale:
+            print(f"[update_multiband] Up to date: {multiband_tif}")
+            return "up_to_date"
+        out_ds = gdal.Open(multiband_tif)
+        in_place = _can_update_in_place(out_ds, band_tifs)
+        out_ds = None
+    else:
+        in_place = False
+
+    if in_place:
+        updates = {i + 1: band_tifs[i] for i in stale}
+        with stage("merge_update", inputs=list(updates.values()), outputs=[multiband_tif],
+                   bands=len(updates)):
+            rewrite_bands(multiband_tif, updates)
+        mode = "in_place"
+    else:
+        merge(multiband_tif, band_tifs)
+        mode = "rebuilt"
+
+    # Reload: build_crops may have written the manifest since we read it
+    manifest = load_manifest(manifest_path)
+    manifest["multibands"][multiband_tif] = {
+        "bands": band_tifs,
+        "band_fps": band_fps,
+        "output": file_fingerprint(multiband_tif),
+    }
+    save_manifest(manifest_path, manifest)
+    print(f"[update_multiband] {multiband_tif}: {mode} ({len(stale)} bands changed)")
+    return mode
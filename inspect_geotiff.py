@@ -4,6 +4,8 @@ import os
 import sys
 from osgeo import gdal
 
+from tiff_layout import TiffLayoutError, read_layout
+
 def inspect_tiff(tif_path):
     """
     Imprime metadatos clave de un GeoTIFF:
@@ -52,6 +54,14 @@ def inspect_tiff(tif_path):
     md_img = ds.GetMetadata("IMAGE_STRUCTURE")
     print(f"  → IMAGE_STRUCTURE: {md_img}")
 
+    # Bloques vacíos (SPARSE_OK): todo nodata, no ocupan disco
+    try:
+        layout = read_layout(tif_path)
+        vacios = sum(1 for count in layout["byte_counts"] if count == 0)
+        print(f"  → Bloques vacíos: {vacios} de {len(layout['byte_counts'])}")
+    except (OSError, TiffLayoutError):
+        pass
+
     # Revisar cada banda
     for i in range(1, ds.RasterCount + 1):
         band = ds.GetRasterBand(i)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Lightweight per-stage instrumentation for the crop/merge scripts.
+
+Wrap each pipeline stage (warp, unscale, merge, translate, ...) in a
+``stage`` context manager to record:
+
+- wall-clock time and CPU time of the calling thread
+- CPU time of the whole process, which includes GDAL's own worker
+  threads (NUM_THREADS compression, multithreaded warps) but also any
+  concurrent stages in other threads
+- bytes read/written by the whole process (from /proc/self/io when
+  available); with stages running concurrently in threads these counters
+  include the other threads' I/O
+- size on disk of the declared input and output files
+- GDAL block cache usage before/after the stage
+- peak RSS of the process
+
+Recording is disabled by default and ``stage`` then returns a shared no-op
+context manager, so instrumented code pays a single function call per stage.
+Enable it from code with ``enable()`` or from the environment:
+
+- PIPELINE_PROFILE=run_report.json (or .csv) writes a run report at exit
+- PIPELINE_TRACE=run_trace.json writes a Chrome trace (chrome://tracing,
+  https://ui.perfetto.dev) at exit
+"""
+
+import atexit
+import csv
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from pathlib import Path
+
+_enabled = False
+_records = []
+_lock = threading.Lock()
+_t0 = time.perf_counter()
+
+REPORT_FIELDS = [
+    "name",
+    "start_s",
+    "wall_s",
+    "cpu_s",
+    "process_cpu_s",
+    "thread",
+    "tid",
+    "bytes_in",
+    "bytes_out",
+    "process_io_read_bytes",
+    "process_io_write_bytes",
+    "gdal_cache_before",
+    "gdal_cache_after",
+    "peak_rss_bytes",
+    "extra",
+]
+
+
+class _NullStage:
+    """No-op context manager returned by ``stage`` while disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def add(self, **extra) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def _read_proc_io() -> dict:
+    """
+    Return the I/O counters of the current process, or an empty dict when
+    /proc/self/io is not available (non-Linux systems, restricted sandboxes).
+    """
+    try:
+        with open("/proc/self/io") as fh:
+            counters = {}
+            for line in fh:
+                key, _, value = line.partition(":")
+                counters[key.strip()] = int(value)
+            return counters
+    except (OSError, ValueError):
+        return {}
+
+
+def _peak_rss_bytes() -> int:
+    """Peak resident set size of the process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _gdal_cache_used():
+    """Bytes currently held by the GDAL block cache, if GDAL is loaded."""
+    gdal = sys.modules.get("osgeo.gdal")
+    if gdal is None:
+        return None
+    return gdal.GetCacheUsed()
+
+
+def _total_size(paths) -> int:
+    """Sum the on-disk size of the given paths, ignoring missing files."""
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+class _Stage:
+    """Context manager that records one timed stage."""
+
+    def __init__(self, name: str, inputs, outputs, extra: dict):
+        self.name = name
+        self.inputs = [str(p) for p in (inputs or [])]
+        self.outputs = [str(p) for p in (outputs or [])]
+        self.extra = dict(extra)
+
+    def add(self, **extra) -> None:
+        """Attach extra key/value pairs (pixels, band count, ...) to the record."""
+        self.extra.update(extra)
+
+    def __enter__(self):
+        self._io = _read_proc_io()
+        self._cache = _gdal_cache_used()
+        self._cpu = time.thread_time()  # per thread: stages may run concurrently
+        self._process_cpu = time.process_time()  # includes GDAL worker threads
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        cpu = time.thread_time() - self._cpu
+        process_cpu = time.process_time() - self._process_cpu
+        io = _read_proc_io()
+        record = {
+            "name": self.name,
+            "start_s": self._start - _t0,
+            "wall_s": end - self._start,
+            "cpu_s": cpu,
+            # Process-wide, like the I/O counters below
+            "process_cpu_s": process_cpu,
+            "thread": threading.current_thread().name,
+            "tid": threading.get_native_id(),
+            "bytes_in": _total_size(self.inputs),
+            "bytes_out": _total_size(self.outputs),
+            # Process-wide counters: they include concurrent stages in other threads
+            "process_io_read_bytes":
+                io.get("read_bytes", 0) - self._io.get("read_bytes", 0) if io else None,
+            "process_io_write_bytes":
+                io.get("write_bytes", 0) - self._io.get("write_bytes", 0) if io else None,
+            "gdal_cache_before": self._cache,
+            "gdal_cache_after": _gdal_cache_used(),
+            "peak_rss_bytes": _peak_rss_bytes(),
+            "extra": self.extra,
+        }
+        if exc_type is not None:
+            record["extra"]["error"] = repr(exc)
+        with _lock:
+            _records.append(record)
+        return False
+
+
+def stage(name: str, inputs=None, outputs=None, **extra):
+    """
+    Time a pipeline stage.
+
+    Usage::
+
+        with stage("warp", inputs=[src], outputs=[dst]) as st:
+            gdal.Warp(...)
+            st.add(pixels=width * height)
+
+    :param name: Stage name used to group records in the report
+    :param inputs: Paths read by the stage (their sizes become bytes_in)
+    :param outputs: Paths written by the stage (their sizes become bytes_out)
+    :param extra: Arbitrary JSON-serialisable values stored with the record
+    :return: A context manager (a no-op one when instrumentation is disabled)
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, inputs, outputs, extra)
+
+
+def enable(report_path=None, trace_path=None) -> None:
+    """
+    Start recording stages.
+
+    :param report_path: If given, write a JSON or CSV report there at exit
+    :param trace_path: If given, write a Chrome trace there at exit
+    """
+    global _enabled
+    _enabled = True
+    if report_path:
+        atexit.register(write_report, report_path)
+    if trace_path:
+        atexit.register(write_chrome_trace, trace_path)
+
+
+def disable() -> None:
+    """Stop recording stages (already recorded stages are kept)."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """Drop every recorded stage."""
+    with _lock:
+        _records.clear()
+
+
+def records() -> list[dict]:
+    """Return a copy of the recorded stages."""
+    with _lock:
+        return [dict(r) for r in _records]
+
+
+def summary() -> dict:
+    """
+    Aggregate the recorded stages by name.
+
+    :return: {name: {"count", "wall_s", "cpu_s", "process_cpu_s", "bytes_in",
+             "bytes_out"}}
+    """
+    totals = {}
+    for rec in records():
+        agg = totals.setdefault(
+            rec["name"],
+            {"count": 0, "wall_s": 0.0, "cpu_s": 0.0, "process_cpu_s": 0.0,
+             "bytes_in": 0, "bytes_out": 0},
+        )
+        agg["count"] += 1
+        agg["wall_s"] += rec["wall_s"]
+        agg["cpu_s"] += rec["cpu_s"]
+        agg["process_cpu_s"] += rec["process_cpu_s"]
+        agg["bytes_in"] += rec["bytes_in"]
+        agg["bytes_out"] += rec["bytes_out"]
+    return totals
+
+
+def write_report(path) -> None:
+    """
+    Write the recorded stages to 'path'. The format is chosen from the
+    suffix: ``.csv`` writes one row per stage, anything else writes JSON
+    with the individual stages, a per-name summary and the peak RSS.
+    """
+    path = Path(path)
+    recs = records()
+    if path.suffix.lower() == ".csv":
+        with open(path, "w", newline="") as fh:
+            writer = csv.DictWriter(fh, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            for rec in recs:
+                writer.writerow({**rec, "extra": json.dumps(rec["extra"])})
+    else:
+        report = {
+            "stages": recs,
+            "summary": summary(),
+            "peak_rss_bytes": _peak_rss_bytes(),
+        }
+        with open(path, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+
+def write_chrome_trace(path) -> None:
+    """
+    Write the recorded stages as Chrome trace "complete" events, plus one
+    "thread_name" metadata event per thread so the viewer labels its rows.
+    """
+    pid = os.getpid()
+    events = []
+    thread_names = {}
+    for rec in records():
+        thread_names[rec["tid"]] = rec["thread"]
+        events.append({
+            "name": rec["name"],
+            "cat": "pipeline",
+            "ph": "X",
+            "ts": rec["start_s"] * 1e6,
+            "dur": rec["wall_s"] * 1e6,
+            "pid": pid,
+            "tid": rec["tid"],
+            "args": {
+                k: rec[k]
+                for k in REPORT_FIELDS
+                if k not in ("name", "start_s", "wall_s", "thread", "tid")
+            },
+        })
+    for tid, name in thread_names.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                       "args": {"name": name}})
+    with open(path, "w") as fh:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fh)
+
+
+if os.environ.get("PIPELINE_PROFILE") or os.environ.get("PIPELINE_TRACE"):
+    enable(
+        report_path=os.environ.get("PIPELINE_PROFILE"),
+        trace_path=os.environ.get("PIPELINE_TRACE"),
+    )
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Zero-copy patch reader for uncompressed GeoTIFF outputs.
+
+The tile/strip index is parsed once with 'tiff_layout' and the file is
+memory-mapped. Windows are then NumPy views over the mapping: no GDAL
+call, no decode and no copy per read. The page cache does the I/O.
+
+- Striped files whose strips are contiguous (what GDAL writes for
+  uncompressed, non-tiled output) expose each band as a single 2-D view,
+  so every window is a view.
+- Tiled files expose each tile as a view. A window inside one tile is a
+  view; a window spanning several tiles is assembled into a new array.
+"""
+
+import mmap
+
+import numpy as np
+
+from tiff_layout import COMPRESSION_NONE, block_index, read_layout
+
+# TIFF SampleFormat -> NumPy dtype kind
+_SAMPLE_FORMATS = {1: "u", 2: "i", 3: "f"}
+
+
+class MappedRaster:
+    """
+    Memory-mapped view of an uncompressed (Big)TIFF.
+
+    Usage::
+
+        with MappedRaster("CHELSA_multibanda_NOcompress.tif") as raster:
+            patch = raster.read_window(col, row, 256, 256)
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        layout = read_layout(self.path)
+        if layout["compression"] != COMPRESSION_NONE:
+            raise ValueError(f"{self.path} is compressed, MappedRaster needs COMPRESS=NONE")
+        kind = _SAMPLE_FORMATS.get(layout["sample_format"])
+        if kind is None or layout["bits_per_sample"] % 8:
+            raise ValueError(f"{self.path}: unsupported sample format")
+        self.layout = layout
+        self.dtype = np.dtype(f"{layout['endian']}{kind}{layout['bits_per_sample'] // 8}")
+        self.width = layout["width"]
+        self.height = layout["height"]
+        self.band_count = layout["samples_per_pixel"]
+        nodata = layout["nodata"]
+        self.nodata = float(nodata) if nodata not in (None, "") else None
+
+        self._fh = open(self.path, "rb")
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = np.frombuffer(self._mm, dtype=np.uint8)
+        self._bands = self._contiguous_bands()
+
+    # -- context manager ----------------------------------------------------
+
+    def close(self) -> None:
+        self._bands = None
+        self._buffer = None
+        # The mapping stays alive while views returned to callers exist
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # -- layout helpers -----------------------------------------------------
+
+    def _pixel_interleaved(self) -> bool:
+        return self.layout["planar_config"] == 1
+
+    def _block_shape(self, block_y: int = 0) -> tuple:
+        bh = self.layout["block_height"]
+        if not self.layout["tiled"]:
+            # The last strip only holds the remaining rows
+            bh = min(bh, self.height - block_y * bh)
+        shape = (bh, self.layout["block_width"])
+        if self._pixel_interleaved():
+            shape += (self.band_count,)
+        return shape
+
+    def _view(self, offset: int, shape: tuple) -> np.ndarray:
+        count = int(np.prod(shape))
+        return np.frombuffer(self._buffer, dtype=self.dtype, count=count,
+                             offset=offset).reshape(shape)
+
+    def _contiguous_bands(self):
+        """
+        For striped files whose strips follow each other in the file,
+        return one (height, width[, bands]) view per plane; otherwise None.
+        """
+        lay = self.layout
+        if lay["tiled"]:
+            return None
+        planes = self.band_count if not self._pixel_interleaved() else 1
+        per_plane = lay["blocks_down"]
+        views = []
+        for plane in range(planes):
+            offsets = lay["offsets"][plane * per_plane:(plane + 1) * per_plane]
+            counts = lay["byte_counts"][plane * per_plane:(plane + 1) * per_plane]
+            if any(offsets[i] + counts[i] != offsets[i + 1] for i in range(len(offsets) - 1)):
+                return None
+            shape = (self.height, self.width)
+            if self._pixel_interleaved():
+                shape += (self.band_count,)
+            if sum(counts) < int(np.prod(shape)) * self.dtype.itemsize or offsets[0] == 0:
+                return None
+            views.append(self._view(offsets[0], shape))
+        return views
+
+    def tile(self, band: int, block_x: int, block_y: int) -> np.ndarray | None:
+        """
+        Zero-copy view of one block. For pixel-interleaved files the view has
+        a trailing band axis and 'band' is ignored. Sparse blocks return None.
+
+        :param band: 0-based band index
+        """
+        index = block_index(self.layout, band, block_x, block_y)
+        offset = self.layout["offsets"][index]
+        if self.layout["byte_counts"][index] == 0:
+            return None
+        return self._view(offset, self._block_shape(block_y))
+
+    # -- reads --------------------------------------------------------------
+
+    def read_window(self, xoff: int, yoff: int, xsize: int, ysize: int,
+                    band: int | None = None) -> np.ndarray:
+        """
+        Read a window, with the argument order of GDAL's ReadAsArray.
+
+        :param band: 1-based band number, or None for all bands
+        :return: (ysize, xsize) for one band, (bands, ysize, xsize) otherwise
+                 (2-D for single-band files, as ReadAsArray). A view of the
+                 file when the window lies in one strip run or one tile.
+        """
+        if xoff < 0 or yoff < 0 or xoff + xsize > self.width or yoff + ysize > self.height:
+            raise ValueError("Window outside the raster")
+        bands = [band - 1] if band is not None else list(range(self.band_count))
+        squeeze = len(bands) == 1
+        rows = slice(yoff, yoff + ysize)
+        cols = slice(xoff, xoff + xsize)
+
+        if self._bands is not None:
+            if self._pixel_interleaved():
+                win = np.moveaxis(self._bands[0][rows, cols, :], 2, 0)
+                return win[bands[0]] if squeeze else win
+            if squeeze:
+                return self._bands[bands[0]][rows, cols]
+            # Band-separate planes live apart in the file: stacking them copies
+            return np.stack([self._bands[b][rows, cols] for b in bands])
+
+        return self._read_blocks(xoff, yoff, xsize, ysize, bands, squeeze)
+
+    def _read_blocks(self, xoff, yoff, xsize, ysize, bands, squeeze):
+        bw = self.layout["block_width"]
+        bh = self.layout["block_height"]
+        bx0, bx1 = xoff // bw, (xoff + xsize - 1) // bw
+        by0, by1 = yoff // bh, (yoff + ysize - 1) // bh
+
+        if bx0 == bx1 and by0 == by1 and self._pixel_interleaved():
+            # Window inside one block: return a view
+            blk = self.tile(0, bx0, by0)
+            if blk is not None:
+                win = np.moveaxis(blk[yoff - by0 * bh:yoff - by0 * bh + ysize,
+                                      xoff - bx0 * bw:xoff - bx0 * bw + xsize], 2, 0)
+                return win[bands[0]] if squeeze else win
+        elif bx0 == bx1 and by0 == by1:
+            views = []
+            for b in bands:
+                blk = self.tile(b, bx0, by0)
+                if blk is None:
+                    break
+                views.append(blk[yoff - by0 * bh:yoff - by0 * bh + ysize,
+                                 xoff - bx0 * bw:xoff - bx0 * bw + xsize])
+            else:
+                # Band-separate tiles live apart in the file: stacking copies
+                return views[0] if squeeze else np.stack(views)
+
+        fill = self.nodata if self.nodata is not None else 0
+        out = np.full((len(bands), ysize, xsize), fill, dtype=self.dtype.newbyteorder("="))
+        for by in range(by0, by1 + 1):
+            for bx in range(bx0, bx1 + 1):
+                r0 = max(yoff, by * bh)
+                r1 = min(yoff + ysize, (by + 1) * bh)
+                c0 = max(xoff, bx * bw)
+                c1 = min(xoff + xsize, (bx + 1) * bw)
+                for i, b in enumerate(bands):
+                    blk = self.tile(b, bx, by)
+                    if blk is None:
+                        continue
+                    if self._pixel_interleaved():
+                        blk = blk[:, :, b]
+                    out[i, r0 - yoff:r1 - yoff, c0 - xoff:c1 - xoff] = \
+                        blk[r0 - by * bh:r1 - by * bh, c0 - bx * bw:c1 - bx * bw]
+        return out[0] if squeeze else out
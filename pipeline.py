@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Streaming pipeline: download -> crop (and unscale) -> merge, overlapped.
+
+Instead of running 'download_tif.py', then 'try_try.py'/'cog_2.py' for
+every file, then the merge, each layer flows through the stages on its
+own: it is cropped as soon as its download lands, and written into the
+multiband output as soon as its crop exists.
+
+Stages are connected by bounded queues and run their own worker threads
+(GDAL and the HTTP client release the GIL). A full queue blocks the
+stage in front of it, so a fast download stage cannot pile up more than
+'queue_size' finished files ahead of the crops. End-to-end time tends
+towards that of the slowest stage instead of the sum of all of them.
+
+The multiband output is created on the first crop with every band
+empty (SPARSE_OK) and each band is written once its crop arrives, so the
+merge does not wait for the last download.
+"""
+
+import argparse
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+from instrumentation import stage
+
+_DONE = object()
+
+# Creation options of the multiband output (band-separate, so bands are written independently)
+_MULTIBAND_OPTIONS = ["COMPRESS=DEFLATE", "TILED=YES", "BLOCKXSIZE=1024", "BLOCKYSIZE=1024",
+                      "INTERLEAVE=BAND", "SPARSE_OK=TRUE", "BIGTIFF=YES"]
+
+
+def run_stages(items, stages, queue_size: int = 4) -> dict:
+    """
+    Run 'items' through a chain of stages with bounded queues between them.
+
+    :param items: Iterable of work items (typically dicts)
+    :param stages: List of (name, func, workers); func(item) returns the item
+                   for the next stage, or None to drop it
+    :param queue_size: Capacity of each inter-stage queue (backpressure)
+    :return: Dict with "results" (items that left the last stage), "errors"
+             ({item name: message}), "stages" ({name: {"items", "busy_seconds"}})
+             and "seconds" (wall time)
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    results, errors = [], {}
+    stats = {name: {"items": 0, "busy_seconds": 0.0} for name, _, _ in stages}
+    remaining = [workers for _, _, workers in stages]
+    lock = threading.Lock()
+
+    def feed():
+        for item in items:
+            queues[0].put(item)
+        for _ in range(stages[0][2]):
+            queues[0].put(_DONE)
+
+    def work(i):
+        name, func, _ = stages[i]
+        last = i == len(stages) - 1
+        while True:
+            item = queues[i].get()
+            if item is _DONE:
+                break
+            start = time.perf_counter()
+            try:
+                out = func(item)
+            except Exception as exc:  # one bad layer must not stop the others
+                key = item.get("name", repr(item)) if isinstance(item, dict) else repr(item)
+                with lock:
+                    errors[key] = f"{name}: {type(exc).__name__}: {exc}"
+                print(f"[pipeline] {key} failed in {name}: {exc}")
+                continue
+            finally:
+                with lock:
+                    stats[name]["items"] += 1
+                    stats[name]["busy_seconds"] += time.perf_counter() - start
+            if out is None:
+                continue
+            if last:
+                with lock:
+                    results.append(out)
+            else:
+                queues[i + 1].put(out)  # blocks while the next stage is saturated
+
+        with lock:
+            remaining[i] -= 1
+            finished = remaining[i] == 0
+        if finished and not last:
+            for _ in range(stages[i + 1][2]):
+                queues[i + 1].put(_DONE)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for i, (_, _, workers) in enumerate(stages):
+        threads += [threading.Thread(target=work, args=(i,), daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {"results": results, "errors": errors, "stages": stats,
+            "seconds": time.perf_counter() - start}
+
+
+class MultibandWriter:
+    """
+    Band-separate multiband output filled band by band as crops arrive.
+
+    The output has one data type and one nodata value for all of its bands
+    (a GeoTIFF stores a single nodata tag). Without 'data_type' the first
+    crop's type is used; a later crop that does not fit it widens the file
+    to the common type (gdal.DataTypeUnion) before being written, so no
+    band is truncated. Without 'nodata' the file takes the nodata of the
+    first crop that has one. Crop nodata pixels are written as the file's
+    nodata; scale/offset stay per band.
+
+    :param output_tif: Multiband output path
+    :param band_names: Band names in output order (crop file stems)
+    :param data_type: GDAL data type of the output, e.g.
+                      'try_try.common_data_type' of every expected crop
+    :param nodata: Nodata value of the output, e.g.
+                   'try_try.multiband_nodata' of every expected crop
+    """
+
+    def __init__(self, output_tif, band_names: list[str], data_type: int | None = None,
+                 nodata: float | None = None):
+        self.output_tif = str(output_tif)
+        self.bands = {name: i + 1 for i, name in enumerate(band_names)}
+        self.data_type = data_type
+        self.nodata = nodata
+        self._created = False
+        self._lock = threading.Lock()
+
+    def _create(self, first_tif: str) -> None:
+        from osgeo import gdal
+
+        src_ds = gdal.Open(first_tif)
+        src_band = src_ds.GetRasterBand(1)
+        if self.data_type is None:
+            self.data_type = src_band.DataType
+        driver = gdal.GetDriverByName("GTiff")
+        out_ds = driver.Create(
+            self.output_tif, src_ds.RasterXSize, src_ds.RasterYSize, len(self.bands),
+            self.data_type, options=_MULTIBAND_OPTIONS,
+        )
+        out_ds.SetGeoTransform(src_ds.GetGeoTransform())
+        out_ds.SetProjection(src_ds.GetProjection())
+        for name, number in self.bands.items():
+            out_ds.GetRasterBand(number).SetDescription(name)
+        if self.nodata is not None:
+            self._set_nodata(out_ds)
+        out_ds = None
+        src_ds = None
+        self._created = True
+
+    def _set_nodata(self, out_ds) -> None:
+        """Tag every band with the file's nodata (GTiff keeps one value anyway)."""
+        for number in self.bands.values():
+            out_ds.GetRasterBand(number).SetNoDataValue(self.nodata)
+
+    def _widen(self, data_type: int) -> None:
+        """Rewrite the output with a wider data type, keeping the bands written so far."""
+        from osgeo import gdal
+
+        tmp_tif = self.output_tif + ".widen.tif"
+        gdal.Translate(tmp_tif, self.output_tif, outputType=data_type,
+                       creationOptions=_MULTIBAND_OPTIONS)
+        os.replace(tmp_tif, self.output_tif)
+        self.data_type = data_type
+
+    def add(self, crop_tif) -> None:
+        """Write 'crop_tif' into its band. Calls are serialised: one GTiff writer."""
+        import numpy as np
+        from osgeo import gdal, gdal_array
+
+        from tiled_warp import BLOCK_SIZE, chunk_windows
+        from try_try import multiband_nodata, remap_nodata
+
+        crop_tif = str(crop_tif)
+        with self._lock:
+            if not self._created:
+                self._create(crop_tif)
+            src_ds = gdal.Open(crop_tif)
+            src_band = src_ds.GetRasterBand(1)
+            data_type = gdal.DataTypeUnion(self.data_type, src_band.DataType)
+            if data_type != self.data_type:
+                self._widen(data_type)
+            np_type = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(self.data_type))
+            src_nodata = src_band.GetNoDataValue()
+
+            out_ds = gdal.Open(self.output_tif, gdal.GA_Update)
+            if self.nodata is None and src_nodata is not None:
+                # First crop with a nodata value: it becomes the file's
+                self.nodata = multiband_nodata([crop_tif], self.data_type)
+                if self.nodata is not None:
+                    self._set_nodata(out_ds)
+            out_band = out_ds.GetRasterBand(self.bands[Path(crop_tif).stem])
+            for col, row, cols, rows in chunk_windows(src_ds.RasterXSize, src_ds.RasterYSize,
+                                                      BLOCK_SIZE):
+                data = src_band.ReadAsArray(col, row, cols, rows)
+                out_band.WriteArray(remap_nodata(data, src_nodata, self.nodata, np_type),
+                                    col, row)
+            # Raw values are kept: scale/offset stay metadata of each band
+            if src_band.GetScale() is not None:
+                out_band.SetScale(src_band.GetScale())
+            if src_band.GetOffset() is not None:
+                out_band.SetOffset(src_band.GetOffset())
+            out_ds = None
+            src_ds = None
+
+
+def _expected_crop_type(sources, unscale: bool) -> int | None:
+    """
+    Data type holding every crop: Float32 when unscaling, else the common
+    type of the sources (crops keep the raw source type). None if some
+    sources are not downloaded yet: the writer then widens as crops arrive.
+    """
+    from osgeo import gdal
+
+    if unscale:
+        return gdal.GDT_Float32
+    if not sources or not all(os.path.exists(src) for src in sources):
+        return None
+    from try_try import common_data_type
+
+    return common_data_type(sources)
+
+
+def chelsa_stages(ref_tif: str, crop_dir, multiband_tif=None, band_names=None,
+                  unscale: bool = False, download_workers: int = 4,
+                  crop_workers: int = 2, checksums: dict | None = None,
+                  quarantine_dir=None, max_retries: int = 2, sources=None) -> list:
+    """
+    Stages for the CHELSA workflow. Items are dicts with "name", "source"
+    (local path) and optionally "url" (downloaded if the source is missing).
+
+    A downloaded source that is truncated or does not decode is moved to
+    quarantine and downloaded again, up to 'max_retries' times, without
+    stopping the other layers. Local sources without a URL are only checked.
+
+    :param ref_tif: Reference grid ('elevation.tif')
+    :param crop_dir: Directory of the crops
+    :param multiband_tif: Multiband output, or None to skip the merge stage
+    :param band_names: Band order of the multiband output
+    :param unscale: Apply scale/offset while cropping ('cog_2.warp_to_tiff')
+                    instead of the exact-grid crop ('grid_align.crop_to_grid')
+    :param checksums: {file name: SHA-256} of the downloads ('verify.load_checksums')
+    :param quarantine_dir: Where bad downloads are moved (default:
+                           'quarantine' next to each download)
+    :param max_retries: Re-downloads per layer before it fails
+    :param sources: Source paths of all layers, to fix the multiband data
+                    type (see '_expected_crop_type') and nodata up front
+    :return: List of (name, func, workers) for 'run_stages'
+    """
+    from try_try import get_raster_info
+
+    ref_info = get_raster_info(str(ref_tif))
+    crop_dir = Path(crop_dir)
+    crop_dir.mkdir(parents=True, exist_ok=True)
+    crop_type = _expected_crop_type(sources, unscale) if multiband_tif is not None else None
+    crop_nodata = None
+    if crop_type is not None and sources and all(os.path.exists(src) for src in sources):
+        from try_try import multiband_nodata
+
+        # Crops keep the source nodata, also when unscaling
+        crop_nodata = multiband_nodata(sources, crop_type)
+
+    def download(item):
+        from verify import DownloadError, download_verified, quarantine, verify_tiff
+
+        source = item["source"]
+        expected = (checksums or {}).get(Path(source).name)
+        for attempt in range(max_retries + 1):
+            if item.get("url") and not os.path.exists(source):
+                Path(source).parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    with stage("download", outputs=[source], attempt=attempt):
+                        download_verified(item["url"], source, expected)
+                except DownloadError as exc:
+                    # Nothing was written: the '.part' file is removed
+                    errors = [str(exc)]
+                    print(f"[pipeline] {item['name']}: {exc}, retrying")
+                    continue
+            result = verify_tiff(source)
+            if result["ok"]:
+                return item
+            errors = result["errors"][:3]
+            if not item.get("url"):
+                break  # a local file cannot be fetched again
+            moved = quarantine(source, quarantine_dir or Path(source).parent / "quarantine")
+            print(f"[pipeline] {item['name']}: corrupt, moved to {moved}")
+        raise RuntimeError(f"corrupt source after {attempt} retries: {errors}")
+
+    def crop(item):
+        item["crop"] = str(crop_dir / Path(item["source"]).name)
+        if unscale:
+            from cog_2 import warp_to_tiff
+
+            xmin, ymin, xmax, ymax = ref_info["bbox"]
+            warp_to_tiff(item["source"], item["crop"], [xmin, ymin, xmax, ymax],
+                         abs(ref_info["xres"]), abs(ref_info["yres"]), ref_info["projection"])
+        else:
+            from grid_align import crop_to_grid
+
+            crop_to_grid(item["source"], item["crop"], ref_info)
+        return item
+
+    stages = [("download", download, download_workers), ("crop", crop, crop_workers)]
+    if multiband_tif is not None:
+        writer = MultibandWriter(multiband_tif, band_names, crop_type, crop_nodata)
+
+        def merge(item):
+            with stage("merge_band", inputs=[item["crop"]], outputs=[writer.output_tif]):
+                writer.add(item["crop"])
+            return item
+
+        stages.append(("merge", merge, 1))
+    return stages
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sources", nargs="+",
+                        help="URLs and/or local .tif files (a .txt file lists one per line)")
+    parser.add_argument("--ref", required=True, help="Reference grid, e.g. elevation.tif")
+    parser.add_argument("--download-dir", default="bio", help="Where URLs are downloaded")
+    parser.add_argument("--crop-dir", required=True, help="Where the crops are written")
+    parser.add_argument("--multiband", help="Multiband output (default: no merge)")
+    parser.add_argument("--unscale", action="store_true", help="Apply scale/offset when cropping")
+    parser.add_argument("--checksums", help="sha256sum-style list of known download checksums")
+    parser.add_argument("--max-retries", type=int, default=2,
+                        help="Re-downloads of a corrupt layer before it fails")
+    parser.add_argument("--download-workers", type=int, default=4)
+    parser.add_argument("--crop-workers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    entries = []
+    for source in args.sources:
+        if source.endswith(".txt"):
+            entries += [line.strip() for line in open(source) if line.strip()]
+        else:
+            entries.append(source)
+    items = []
+    for entry in entries:
+        is_url = entry.startswith(("http://", "https://"))
+        local = str(Path(args.download_dir) / entry.rsplit("/", 1)[-1]) if is_url else entry
+        items.append({"name": Path(local).stem, "source": local, "url": entry if is_url else None})
+
+    from verify import load_checksums
+
+    stages = chelsa_stages(args.ref, args.crop_dir, args.multiband,
+                           [item["name"] for item in items], args.unscale,
+                           args.download_workers, args.crop_workers,
+                           load_checksums(args.checksums),
+                           Path(args.download_dir) / "quarantine", args.max_retries,
+                           [item["source"] for item in items])
+    report = run_stages(items, stages, args.queue_size)
+
+    for name, st in report["stages"].items():
+        print(f"[pipeline] {name}: {st['items']} items, {st['busy_seconds']:.1f} s busy")
+    print(f"[pipeline] {len(report['results'])} of {len(items)} layers done "
+          f"in {report['seconds']:.1f} s")
+    for name, message in report["errors"].items():
+        print(f"[pipeline] FAILED {name}: {message}")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
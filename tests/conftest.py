@@ -0,0 +1,60 @@
+"""
+Shared fixtures: tiny CHELSA-like rasters, so the tests run in seconds
+(the benchmark generates the full-size inputs).
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# The modules live flat in the repository root
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+SOURCE_SIZE = (1600, 1400)
+# Reference window (col, row, width, height): not a multiple of the 1024 tile,
+# so the tiled warp has partial chunks on the right and bottom edges
+REFERENCE_WINDOW = (150, 200, 1300, 1100)
+
+
+@pytest.fixture(scope="session")
+def tiny(tmp_path_factory) -> dict:
+    """
+    Two synthetic int16 layers with scale/offset and an ocean nodata mask,
+    plus a grid-aligned reference covering part of them.
+
+    :return: {"sources": [...], "reference": path, "ref_info": dict}
+    """
+    gdal = pytest.importorskip("osgeo.gdal")
+    from osgeo import osr
+
+    import benchmark
+    from try_try import get_raster_info
+
+    workdir = tmp_path_factory.mktemp("tiny")
+    width, height = SOURCE_SIZE
+    sources = []
+    for seed in range(2):
+        src = workdir / f"CHELSA_tiny{seed}_1981-2010_V.2.1.tif"
+        benchmark.make_chelsa_like(src, width, height, seed=seed)
+        sources.append(str(src))
+
+    # Same pixel size and alignment as the sources, offset into the grid
+    src_ds = gdal.Open(sources[0])
+    x0, dx, _, y0, _, dy = src_ds.GetGeoTransform()
+    col, row, ref_w, ref_h = REFERENCE_WINDOW
+    reference = workdir / "elevation.tif"
+    ds = gdal.GetDriverByName("GTiff").Create(str(reference), ref_w, ref_h, 1, gdal.GDT_Int16,
+                                              options=["COMPRESS=DEFLATE"])
+    ds.SetGeoTransform((x0 + col * dx, dx, 0.0, y0 + row * dy, 0.0, dy))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    ds.SetProjection(srs.ExportToWkt())
+    ds.GetRasterBand(1).Fill(1000)
+    ds = None
+    src_ds = None
+
+    return {"sources": sources, "reference": str(reference),
+            "ref_info": get_raster_info(str(reference))}
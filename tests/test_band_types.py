@@ -0,0 +1,69 @@
+"""Typed multibands: same values as the crops, in fewer bytes than Float32."""
+
+import os
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("osgeo.gdal")
+
+import band_types
+import benchmark
+import try_try
+
+
+@pytest.fixture(scope="module")
+def crops(tiny, tmp_path_factory) -> list[str]:
+    """The tiny sources warped onto the reference grid."""
+    workdir = tmp_path_factory.mktemp("crops")
+    crops = []
+    for src in tiny["sources"]:
+        crop = workdir / os.path.basename(src)
+        try_try.warp_exact_grid(src, str(crop), tiny["ref_info"])
+        crops.append(str(crop))
+    return crops
+
+
+def _int16_raster(path, values: np.ndarray, nodata: float) -> str:
+    ds = gdal.GetDriverByName("GTiff").Create(str(path), values.shape[1], values.shape[0], 1,
+                                              gdal.GDT_Int16)
+    ds.SetGeoTransform((0.0, 1.0, 0.0, 0.0, 0.0, -1.0))
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(nodata)
+    band.WriteArray(values)
+    ds = None
+    return str(path)
+
+
+def test_typed_multiband_smaller_than_float32(crops, tmp_path):
+    outputs = band_types.create_typed_multibands(str(tmp_path / "typed"), crops, band_types="auto")
+    assert len(outputs) == 1
+    typed = next(iter(outputs.values()))
+
+    float32 = tmp_path / "multiband_float32.tif"
+    try_try.create_multiband(str(float32), crops, output_type=gdal.GDT_Float32)
+
+    benchmark._verify_bands_match_crops(None, typed, crops)
+    assert os.path.getsize(typed) < os.path.getsize(float32)
+
+
+def test_explicit_type_fits_nodata(tmp_path):
+    values = np.array([[0, 100, -32768], [200, -32768, 254]], dtype=np.int16)
+    tif = _int16_raster(tmp_path / "band.tif", values, -32768)
+
+    plan = band_types.plan_band_types([tif], {"band": gdal.GDT_Byte})
+    assert plan[tif] == (gdal.GDT_Byte, 255.0)
+
+    out = tmp_path / "out.tif"
+    band_types.write_typed_multiband(str(out), [tif], gdal.GDT_Byte, {tif: 255.0})
+    band = gdal.Open(str(out)).GetRasterBand(1)
+    assert band.GetNoDataValue() == 255
+    assert np.array_equal(band.ReadAsArray(), np.where(values == -32768, 255, values))
+
+
+def test_explicit_type_nodata_does_not_fit(tmp_path):
+    values = np.array([[0, 255, -32768]], dtype=np.int16)
+    tif = _int16_raster(tmp_path / "band.tif", values, -32768)
+
+    with pytest.raises(ValueError, match="does not fit Byte"):
+        band_types.plan_band_types([tif], {"band": gdal.GDT_Byte})
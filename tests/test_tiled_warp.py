@@ -0,0 +1,23 @@
+"""The chunked warp must produce the same pixels as the single-call warp (no seams)."""
+
+import pytest
+
+pytest.importorskip("osgeo.gdal")
+
+import benchmark
+import tiled_warp
+import try_try
+
+
+@pytest.mark.parametrize("mode", ["threads", "processes"])
+def test_tiled_warp_matches_warp_exact_grid(tiny, tmp_path, mode):
+    ref_info = tiny["ref_info"]
+    assert ref_info["width"] % tiled_warp.BLOCK_SIZE and ref_info["height"] % tiled_warp.BLOCK_SIZE
+
+    expected = tmp_path / "single.tif"
+    try_try.warp_exact_grid(tiny["sources"][0], str(expected), ref_info)
+    out = tmp_path / f"tiled_{mode}.tif"
+    tiled_warp.warp_exact_grid_tiled(tiny["sources"][0], str(out), ref_info, workers=2,
+                                     chunk_size=tiled_warp.BLOCK_SIZE, mode=mode)
+
+    assert benchmark.rasters_equal(out, expected)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Minimal reader/patcher for the physical layout of (Big)TIFF files.
+
+GDAL hides where each compressed tile or strip lives in the file. For raw
+tile passthrough we need exactly that: the tile index (offsets and byte
+counts), the codec parameters, and the position of the offset tables in
+the file so they can be rewritten in place. Only the first IFD (the full
+resolution image) is parsed.
+"""
+
+import os
+import struct
+
+# TIFF tag numbers
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIG = 284
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+SAMPLE_FORMAT = 339
+GDAL_NODATA = 42113
+
+COMPRESSION_NONE = 1
+COMPRESSION_DEFLATE = (8, 32946)
+
+# TIFF compression code -> GDAL COMPRESS creation option
+GDAL_COMPRESS = {
+    1: "NONE",
+    5: "LZW",
+    8: "DEFLATE",
+    32946: "DEFLATE",
+    34925: "LZMA",
+    50000: "ZSTD",
+    50001: "WEBP",
+}
+
+# type code -> (struct format, size in bytes)
+_TYPES = {
+    1: ("B", 1),   # BYTE
+    2: ("c", 1),   # ASCII
+    3: ("H", 2),   # SHORT
+    4: ("I", 4),   # LONG
+    5: ("II", 8),  # RATIONAL
+    6: ("b", 1),   # SBYTE
+    7: ("B", 1),   # UNDEFINED
+    8: ("h", 2),   # SSHORT
+    9: ("i", 4),   # SLONG
+    10: ("ii", 8),  # SRATIONAL
+    11: ("f", 4),  # FLOAT
+    12: ("d", 8),  # DOUBLE
+    16: ("Q", 8),  # LONG8
+    17: ("q", 8),  # SLONG8
+    18: ("Q", 8),  # IFD8
+}
+
+
+class TiffLayoutError(ValueError):
+    """The file is not a TIFF this module can handle, or it is malformed."""
+
+
+def _read_values(fh, endian: str, type_code: int, count: int, pos: int) -> list:
+    fmt, size = _TYPES[type_code]
+    fh.seek(pos)
+    data = fh.read(size * count)
+    if len(data) != size * count:
+        raise TiffLayoutError(f"Tag values at offset {pos} run past end of file")
+    if type_code == 2:
+        return [data.rstrip(b"\0").decode("latin-1")]
+    return list(struct.unpack(f"{endian}{fmt * count}", data))
+
+
+def read_layout(path) -> dict:
+    """
+    Parse the first IFD of a (Big)TIFF file.
+
+    :param path: Path to the TIFF file
+    :return: Dictionary with:
+        - width, height, samples_per_pixel, bits_per_sample, sample_format
+        - compression, predictor, planar_config (1 = pixel, 2 = band)
+        - tiled (bool), block_width, block_height (tile size, or full width
+          and rows per strip for striped files)
+        - blocks_across, blocks_down: block grid size per band
+        - offsets, byte_counts: one entry per block (band-major when
+          planar_config == 2)
+        - nodata: GDAL_NODATA tag as a string, or None
+        - bigtiff, endian, file_size
+        - tables: {"offsets": (type, count, pos), "byte_counts": (...)} with
+          the position in the file of both tables, for in-place patching
+    :raises TiffLayoutError: If the file is not a valid TIFF
+    """
+    with open(path, "rb") as fh:
+        header = fh.read(16)
+        if header[:2] == b"II":
+            endian = "<"
+        elif header[:2] == b"MM":
+            endian = ">"
+        else:
+            raise TiffLayoutError(f"{path} is not a TIFF file")
+        magic = struct.unpack(f"{endian}H", header[2:4])[0]
+        if magic == 42:
+            bigtiff = False
+            ifd_pos = struct.unpack(f"{endian}I", header[4:8])[0]
+        elif magic == 43:
+            bigtiff = True
+            ifd_pos = struct.unpack(f"{endian}Q", header[8:16])[0]
+        else:
+            raise TiffLayoutError(f"{path} has an unknown TIFF version {magic}")
+
+        file_size = os.fstat(fh.fileno()).st_size
+        if not 8 <= ifd_pos < file_size:
+            raise TiffLayoutError(f"{path}: first IFD offset {ifd_pos} outside the file")
+
+        fh.seek(ifd_pos)
+        if bigtiff:
+            n_entries = struct.unpack(f"{endian}Q", fh.read(8))[0]
+            entry_fmt, entry_size, inline_size = f"{endian}HHQ", 20, 8
+        else:
+            n_entries = struct.unpack(f"{endian}H", fh.read(2))[0]
+            entry_fmt, entry_size, inline_size = f"{endian}HHI", 12, 4
+        entries_pos = fh.tell()
+        raw_entries = fh.read(n_entries * entry_size)
+        if len(raw_entries) != n_entries * entry_size:
+            raise TiffLayoutError(f"{path}: truncated IFD")
+
+        locations = {}
+        for i in range(n_entries):
+            base = i * entry_size
+            tag, type_code, count = struct.unpack(entry_fmt, raw_entries[base:base + entry_size - inline_size])
+            if type_code not in _TYPES:
+                continue
+            size = _TYPES[type_code][1] * count
+            if size <= inline_size:
+                pos = entries_pos + base + entry_size - inline_size
+            else:
+                value_fmt = "Q" if bigtiff else "I"
+                pos = struct.unpack(f"{endian}{value_fmt}", raw_entries[base + entry_size - inline_size:base + entry_size])[0]
+            locations[tag] = (type_code, count, pos)
+
+        def values(tag, default=None):
+            if tag not in locations:
+                return default
+            return _read_values(fh, endian, *locations[tag])
+
+        def scalar(tag, default=None):
+            vals = values(tag)
+            return vals[0] if vals else default
+
+        width = scalar(IMAGE_WIDTH)
+        height = scalar(IMAGE_LENGTH)
+        if width is None or height is None:
+            raise TiffLayoutError(f"{path}: missing image dimensions")
+
+        tiled = TILE_OFFSETS in locations
+        if tiled:
+            block_width = scalar(TILE_WIDTH)
+            block_height = scalar(TILE_LENGTH)
+            offsets_tag, counts_tag = TILE_OFFSETS, TILE_BYTE_COUNTS
+        else:
+            block_width = width
+            block_height = min(scalar(ROWS_PER_STRIP, height), height)
+            offsets_tag, counts_tag = STRIP_OFFSETS, STRIP_BYTE_COUNTS
+        if offsets_tag not in locations or counts_tag not in locations:
+            raise TiffLayoutError(f"{path}: missing tile/strip offset tables")
+
+        layout = {
+            "width": width,
+            "height": height,
+            "samples_per_pixel": scalar(SAMPLES_PER_PIXEL, 1),
+            "bits_per_sample": scalar(BITS_PER_SAMPLE, 1),
+            "sample_format": scalar(SAMPLE_FORMAT, 1),
+            "compression": scalar(COMPRESSION, COMPRESSION_NONE),
+            "predictor": scalar(PREDICTOR, 1),
+            "planar_config": scalar(PLANAR_CONFIG, 1),
+            "tiled": tiled,
+            "block_width": block_width,
+            "block_height": block_height,
+            "blocks_across": -(-width // block_width),
+            "blocks_down": -(-height // block_height),
+            "offsets": values(offsets_tag),
+            "byte_counts": values(counts_tag),
+            "nodata": scalar(GDAL_NODATA),
+            "bigtiff": bigtiff,
+            "endian": endian,
+            "file_size": file_size,
+            "tables": {
+                "offsets": locations[offsets_tag],
+                "byte_counts": locations[counts_tag],
+            },
+        }
+    return layout
+
+
+def block_index(layout: dict, band: int, block_x: int, block_y: int) -> int:
+    """
+    Index in the offset tables of block (block_x, block_y) of 'band' (0-based).
+    For pixel-interleaved files every band shares the same blocks.
+    """
+    per_band = layout["blocks_across"] * layout["blocks_down"]
+    band_base = band * per_band if layout["planar_config"] == 2 else 0
+    return band_base + block_y * layout["blocks_across"] + block_x
+
+
+def read_raw_block(fh, layout: dict, index: int) -> bytes:
+    """
+    Read the still-compressed bytes of one block. Sparse blocks (offset and
+    byte count 0) return b"".
+    """
+    offset = layout["offsets"][index]
+    count = layout["byte_counts"][index]
+    if count == 0:
+        return b""
+    fh.seek(offset)
+    return fh.read(count)
+
+
+def write_raw_blocks(path, blocks: dict) -> None:
+    """
+    Append already-compressed blocks to the end of an existing TIFF and point
+    its offset tables at them.
+
+    The target is expected to have been created (typically by GDAL with
+    SPARSE_OK=TRUE) with the exact block size, codec, predictor and data
+    type of the blocks, so only the offset/byte-count tables change.
+
+    :param path: TIFF file to patch in place
+    :param blocks: {block index: compressed bytes}, or an iterable of
+                   (index, bytes) pairs so blocks can be streamed from the
+                   inputs; empty bytes leave the block sparse
+    :raises TiffLayoutError: If the offsets do not fit the table entry type
+    """
+    layout = read_layout(path)
+    endian = layout["endian"]
+    offsets = list(layout["offsets"])
+    counts = list(layout["byte_counts"])
+    items = blocks.items() if isinstance(blocks, dict) else blocks
+
+    with open(path, "r+b") as fh:
+        fh.seek(0, os.SEEK_END)
+        for index, data in items:
+            if not data:
+                offsets[index] = 0
+                counts[index] = 0
+                continue
+            offsets[index] = fh.tell()
+            counts[index] = len(data)
+            fh.write(data)
+
+        for key, new_values in (("offsets", offsets), ("byte_counts", counts)):
+            type_code, count, pos = layout["tables"][key]
+            fmt, size = _TYPES[type_code]
+            limit = 1 << (8 * size)
+            if max(new_values, default=0) >= limit:
+                raise TiffLayoutError(
+                    f"{path}: value does not fit a {size}-byte {key} entry, create the file with BIGTIFF=YES"
+                )
+            fh.seek(pos)
+            fh.write(struct.pack(f"{endian}{fmt * count}", *new_values))
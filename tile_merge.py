@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Multiband merge that copies compressed tiles instead of re-encoding them.
+
+The crops written by 'cog_2.py'/'try_try.py' are already tiled 1024x1024
+and DEFLATE compressed. When every input shares grid, tile size, codec,
+predictor and data type, a band-separate (INTERLEAVE=BAND) multiband file
+can be assembled from the input tiles byte for byte: the output is
+created empty with GDAL (SPARSE_OK) and only its tile offset tables are
+rewritten. Merge time is then bounded by disk throughput, not zlib.
+
+When the inputs differ in any of those parameters (or in nodata) the
+merge falls back to decoding block by block, still writing
+INTERLEAVE=BAND, with every band's nodata remapped to one value.
+"""
+
+from pathlib import Path
+
+from osgeo import gdal
+
+from instrumentation import stage
+from tiff_layout import (
+    GDAL_COMPRESS,
+    TiffLayoutError,
+    block_index,
+    read_layout,
+    read_raw_block,
+    write_raw_blocks,
+)
+from try_try import common_data_type, get_raster_info, write_multiband
+
+# Layout parameters that must match across inputs for tile passthrough.
+# The output has a single GDAL_NODATA tag, so nodata must match too.
+_PASSTHROUGH_KEYS = (
+    "width", "height", "tiled", "block_width", "block_height", "compression",
+    "predictor", "bits_per_sample", "sample_format", "samples_per_pixel", "nodata", "endian",
+)
+
+
+def passthrough_layout(input_tifs: list[str]) -> dict | None:
+    """
+    Return the common tile layout of the inputs if tile passthrough is
+    possible, or None if the decode path is needed.
+    """
+    try:
+        layouts = [read_layout(tif) for tif in input_tifs]
+    except (OSError, TiffLayoutError):
+        return None
+    first = layouts[0]
+    # Raw tiles are copied into a little-endian GDAL file: big-endian ones would decode swapped
+    if not first["tiled"] or first["samples_per_pixel"] != 1 \
+            or first["compression"] not in GDAL_COMPRESS or first["endian"] != "<":
+        return None
+    if any(lay[key] != first[key] for lay in layouts[1:] for key in _PASSTHROUGH_KEYS):
+        return None
+
+    infos = [get_raster_info(tif) for tif in input_tifs]
+    if any(info != infos[0] for info in infos[1:]):
+        return None
+    return first
+
+
+def _set_band_metadata(out_band, in_band, description: str) -> None:
+    out_band.SetDescription(description)
+    nodata = in_band.GetNoDataValue()
+    if nodata is not None:
+        out_band.SetNoDataValue(nodata)
+    if in_band.GetScale() is not None:
+        out_band.SetScale(in_band.GetScale())
+    if in_band.GetOffset() is not None:
+        out_band.SetOffset(in_band.GetOffset())
+
+
+def merge_raw_tiles(input_tifs: list[str], output_tif: str, layout: dict) -> None:
+    """
+    Build a band-separate multiband GeoTIFF from the compressed tiles of
+    single-band inputs that share 'layout'.
+    """
+    datasets = [gdal.Open(str(tif)) for tif in input_tifs]
+    first = datasets[0]
+    creation_options = [
+        f"COMPRESS={GDAL_COMPRESS[layout['compression']]}",
+        f"PREDICTOR={layout['predictor']}",
+        "TILED=YES",
+        f"BLOCKXSIZE={layout['block_width']}",
+        f"BLOCKYSIZE={layout['block_height']}",
+        "INTERLEAVE=BAND",
+        "SPARSE_OK=TRUE",
+        "BIGTIFF=YES",
+    ]
+    if layout["compression"] == 1:
+        creation_options = [o for o in creation_options if not o.startswith("PREDICTOR=")]
+
+    driver = gdal.GetDriverByName("GTiff")
+    out_ds = driver.Create(str(output_tif), first.RasterXSize, first.RasterYSize,
+                           len(datasets), first.GetRasterBand(1).DataType,
+                           options=creation_options)
+    out_ds.SetGeoTransform(first.GetGeoTransform())
+    out_ds.SetProjection(first.GetProjection())
+    for i, ds_in in enumerate(datasets):
+        _set_band_metadata(out_ds.GetRasterBand(i + 1), ds_in.GetRasterBand(1),
+                           Path(input_tifs[i]).stem)
+    out_ds = None
+    datasets = None
+
+    out_layout = read_layout(output_tif)
+    per_band = layout["blocks_across"] * layout["blocks_down"]
+
+    def blocks():
+        # Stream tiles band by band so only one tile is held in memory
+        for band, tif in enumerate(input_tifs):
+            in_layout = read_layout(tif)
+            with open(tif, "rb") as fh:
+                for index in range(per_band):
+                    out_index = block_index(out_layout, band, index % layout["blocks_across"],
+                                            index // layout["blocks_across"])
+                    yield out_index, read_raw_block(fh, in_layout, index)
+
+    write_raw_blocks(output_tif, blocks())
+
+
+def merge_decoded(input_tifs: list[str], output_tif: str) -> None:
+    """
+    Fallback merge: decode every input and re-encode, band-separate, in the
+    common type of the inputs. Inputs may differ in nodata: the file keeps
+    one nodata tag, so each band's nodata pixels are remapped to it (see
+    'try_try.write_multiband'). Band names and scale/offset are kept as in
+    the passthrough path.
+    """
+    write_multiband(str(output_tif), [str(t) for t in input_tifs],
+                    common_data_type(input_tifs), [
+                        "TILED=YES",
+                        "BLOCKXSIZE=1024",
+                        "BLOCKYSIZE=1024",
+                        "INTERLEAVE=BAND",
+                        "COMPRESS=DEFLATE",
+                        "SPARSE_OK=TRUE",
+                        "BIGTIFF=YES",
+                    ])
+
+
+def merge_bands_passthrough(input_tifs: list[str], output_tif: str) -> str:
+    """
+    Merge single-band GeoTIFFs into one band-separate multiband GeoTIFF,
+    copying compressed tiles when the inputs allow it.
+
+    :param input_tifs: Paths to single-band TIFF files on the same grid
+    :param output_tif: Path to the multiband output
+    :return: The path taken: "raw_tiles" or "decode"
+    :raises RuntimeError: If there are no inputs
+    """
+    if not input_tifs:
+        raise RuntimeError("No input TIFFs to merge.")
+    layout = passthrough_layout([str(t) for t in input_tifs])
+    mode = "raw_tiles" if layout is not None else "decode"
+    with stage("merge", inputs=input_tifs, outputs=[output_tif],
+               bands=len(input_tifs), mode=mode):
+        if layout is not None:
+            merge_raw_tiles([str(t) for t in input_tifs], output_tif, layout)
+        else:
+            merge_decoded(input_tifs, output_tif)
+    print(f"[merge_bands_passthrough] Created multiband ({mode}): {output_tif}")
+    return mode
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Intra-layer parallel version of 'try_try.warp_exact_grid'.
+
+The destination grid (the reference raster) is split into chunks aligned
+with the 1024x1024 output tiles. Each chunk is warped independently into
+an in-memory dataset, either in a thread pool (GDAL releases the GIL
+during the warp) or in a process pool, and a single writer assembles the
+chunks into one tiled GeoTIFF. Every chunk uses the exact pixel grid of
+the reference, so the assembled result has no gaps or seams and matches a
+single-call warp pixel for pixel.
+
+Mode "gdal" keeps a single gdal.Warp call and lets GDAL parallelise it
+with its own multithreaded warper instead.
+"""
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+from osgeo import gdal
+
+from instrumentation import stage
+
+BLOCK_SIZE = 1024
+
+CREATION_OPTIONS = [
+    "COMPRESS=DEFLATE",
+    "TILED=YES",
+    f"BLOCKXSIZE={BLOCK_SIZE}",
+    f"BLOCKYSIZE={BLOCK_SIZE}",
+    "SPARSE_OK=TRUE",
+    "BIGTIFF=YES",
+]
+
+
+def chunk_windows(width: int, height: int, chunk_size: int) -> list[tuple[int, int, int, int]]:
+    """
+    Split a width x height grid into (xoff, yoff, xsize, ysize) windows of
+    at most chunk_size x chunk_size pixels, in row-major order.
+
+    :param width: Grid width in pixels
+    :param height: Grid height in pixels
+    :param chunk_size: Chunk edge, a multiple of the output block size
+    :return: List of windows covering the grid exactly once
+    """
+    return [
+        (xoff, yoff, min(chunk_size, width - xoff), min(chunk_size, height - yoff))
+        for yoff in range(0, height, chunk_size)
+        for xoff in range(0, width, chunk_size)
+    ]
+
+
+def _chunk_bounds(ref_info: dict, window: tuple[int, int, int, int]) -> list[float]:
+    """Georeferenced bounds [xmin, ymin, xmax, ymax] of a pixel window of the reference grid."""
+    xoff, yoff, xsize, ysize = window
+    xmin_ref, _, _, ymax_ref = ref_info["bbox"]
+    xres = ref_info["xres"]
+    yres = ref_info["yres"]  # negative for north-up grids
+    xmin = xmin_ref + xoff * xres
+    ymax = ymax_ref + yoff * yres
+    return [xmin, ymax + ysize * yres, xmin + xsize * xres, ymax]
+
+
+# Same warp options as 'warp_exact_grid', so every path yields the same pixels
+WARP_OPTIONS = ["INIT_DEST=NO_DATA", "SKIP_NOSOURCE=YES"]
+
+
+def warp_chunk(input_tif: str, ref_info: dict, window: tuple, data_type: int,
+               nodata: float | None = None):
+    """
+    Warp one window of the reference grid from 'input_tif' into memory.
+
+    Runs in worker threads or processes, so it opens its own datasets.
+    Uses the source nodata and the warp options of 'warp_exact_grid', so
+    chunks at the source edge match the untiled output.
+
+    :return: (window, array) with the warped pixels of the window
+    """
+    xoff, yoff, xsize, ysize = window
+    warp_opts = gdal.WarpOptions(
+        format="MEM",
+        outputBounds=_chunk_bounds(ref_info, window),
+        width=xsize,
+        height=ysize,
+        dstSRS=ref_info["projection"],
+        resampleAlg="near",
+        outputType=data_type,
+        srcNodata=nodata,
+        dstNodata=nodata,
+        warpOptions=WARP_OPTIONS,
+    )
+    ds = gdal.Warp(destNameOrDestDS="", srcDSOrSrcDSTab=input_tif, options=warp_opts)
+    arr = ds.GetRasterBand(1).ReadAsArray()
+    ds = None
+    return window, arr
+
+
+def is_all_nodata(arr, nodata: float) -> bool:
+    """True if every pixel of arr is nodata (NaN-aware)."""
+    return bool(np.isnan(arr).all() if np.isnan(nodata) else (arr == nodata).all())
+
+
+def _bounded_completion(executor, fn, items, max_in_flight: int):
+    """
+    Submit fn(*item) for every item keeping at most 'max_in_flight' tasks
+    pending, and yield results as they complete. This bounds the memory held
+    by finished chunks waiting for the writer.
+    """
+    items = iter(items)
+    pending = set()
+    for item in items:
+        pending.add(executor.submit(fn, *item))
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield fut.result()
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            yield fut.result()
+
+
+def warp_exact_grid_tiled(input_tif: str, output_tif: str, ref_info: dict,
+                          workers: int | None = None, chunk_size: int = 2 * BLOCK_SIZE,
+                          mode: str = "threads") -> None:
+    """
+    Warp 'input_tif' onto the reference grid like 'warp_exact_grid', using
+    several cores for a single layer.
+
+    :param input_tif: Path to the input TIFF file
+    :param output_tif: Path to the output (warped) TIFF file
+    :param ref_info: Reference raster info from 'get_raster_info'
+    :param workers: Number of threads/processes (default: all CPUs)
+    :param chunk_size: Edge of each warped chunk, multiple of 1024 so chunks
+                       map onto whole output tiles
+    :param mode: "threads", "processes" or "gdal" (GDAL multithreaded warper)
+    :raises ValueError: If mode or chunk_size are invalid
+    :raises FileNotFoundError: If the input cannot be opened
+    """
+    if mode not in ("threads", "processes", "gdal"):
+        raise ValueError(f"Unknown mode {mode!r}")
+    if chunk_size % BLOCK_SIZE:
+        raise ValueError(f"chunk_size must be a multiple of {BLOCK_SIZE}")
+    workers = workers or os.cpu_count() or 1
+
+    src_ds = gdal.Open(input_tif)
+    if not src_ds:
+        raise FileNotFoundError(f"Could not open {input_tif}")
+    src_band = src_ds.GetRasterBand(1)
+    data_type = src_band.DataType
+    nodata = src_band.GetNoDataValue()
+    scale = src_band.GetScale()
+    offset = src_band.GetOffset()
+    src_ds = None
+
+    width = ref_info["width"]
+    height = ref_info["height"]
+    creation_options = CREATION_OPTIONS + [f"NUM_THREADS={workers}"]
+
+    with stage("warp_tiled", inputs=[input_tif], outputs=[output_tif],
+               pixels=width * height, mode=mode, workers=workers):
+        if mode == "gdal":
+            (xmin, ymin, xmax, ymax) = ref_info["bbox"]
+            warp_opts = gdal.WarpOptions(
+                format="GTiff",
+                outputBounds=[xmin, ymin, xmax, ymax],
+                width=width,
+                height=height,
+                dstSRS=ref_info["projection"],
+                resampleAlg="near",
+                outputType=data_type,
+                srcNodata=nodata,
+                dstNodata=nodata,
+                multithread=True,
+                warpOptions=[f"NUM_THREADS={workers}"] + WARP_OPTIONS,
+                creationOptions=creation_options,
+            )
+            ds = gdal.Warp(destNameOrDestDS=output_tif, srcDSOrSrcDSTab=input_tif,
+                           options=warp_opts)
+            ds = None
+            print(f"[warp_exact_grid_tiled] {input_tif} -> {output_tif}")
+            return
+
+        driver = gdal.GetDriverByName("GTiff")
+        out_ds = driver.Create(output_tif, width, height, 1, data_type,
+                               options=creation_options)
+        xmin, _, _, ymax = ref_info["bbox"]
+        out_ds.SetGeoTransform((xmin, ref_info["xres"], 0.0, ymax, 0.0, ref_info["yres"]))
+        out_ds.SetProjection(ref_info["projection"])
+        out_band = out_ds.GetRasterBand(1)
+        if nodata is not None:
+            out_band.SetNoDataValue(nodata)
+        if scale is not None:
+            out_band.SetScale(scale)
+        if offset is not None:
+            out_band.SetOffset(offset)
+
+        windows = chunk_windows(width, height, chunk_size)
+        tasks = [(input_tif, ref_info, window, data_type, nodata) for window in windows]
+        pool_cls = ThreadPoolExecutor if mode == "threads" else ProcessPoolExecutor
+        with pool_cls(max_workers=workers) as pool:
+            # Single writer: GTiff datasets must not be written from several threads
+            for (xoff, yoff, _, _), arr in _bounded_completion(pool, warp_chunk, tasks,
+                                                                2 * workers):
+                if nodata is not None and is_all_nodata(arr, nodata):
+                    continue  # leave the tiles sparse
+                out_band.WriteArray(arr, xoff, yoff)
+        out_ds = None
+
+    print(f"[warp_exact_grid_tiled] {input_tif} -> {output_tif}")
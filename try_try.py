@@ -10,7 +10,11 @@ Date: 2025-03-13
 
 from pathlib import Path
 import os
-from osgeo import gdal
+import numpy as np
+from osgeo import gdal, gdal_array
+
+from instrumentation import stage
+from tiled_warp import BLOCK_SIZE, chunk_windows, is_all_nodata
 
 def get_raster_info(raster_path: str) -> dict:
     """
@@ -61,6 +65,8 @@ def warp_exact_grid(input_tif: str, output_tif: str, ref_info: dict) -> None:
       - It uses the same projection
       - It uses DEFLATE compression and tiling (BlockSize=1024)
       - It keeps the same data type as the source band
+      - It keeps the source nodata value; tiles left entirely nodata are
+        not written (SPARSE_OK)
     
     :param input_tif: Path to the input TIFF file
     :param output_tif: Path to the output (warped) TIFF file
@@ -78,6 +84,7 @@ def warp_exact_grid(input_tif: str, output_tif: str, ref_info: dict) -> None:
     # Obtain the data type from the first band
     band = dataset.GetRasterBand(1)
     data_type = band.DataType
+    nodata = band.GetNoDataValue()
 
     # Define warp options
     warp_opts = gdal.WarpOptions(
@@ -88,79 +95,199 @@ def warp_exact_grid(input_tif: str, output_tif: str, ref_info: dict) -> None:
         dstSRS=ref_proj,
         resampleAlg="near",
         outputType=data_type,
+        srcNodata=nodata,
+        dstNodata=nodata,
+        # Skip chunks without source pixels and start from nodata everywhere
+        warpOptions=["INIT_DEST=NO_DATA", "SKIP_NOSOURCE=YES"],
         creationOptions=[
             "COMPRESS=DEFLATE",
             "TILED=YES",
             "BLOCKXSIZE=1024",
             "BLOCKYSIZE=1024",
+            "SPARSE_OK=TRUE",
             "BIGTIFF=YES"
         ]
     )
 
     # Perform the warp operation
-    ds = gdal.Warp(
-        destNameOrDestDS=output_tif,
-        srcDSOrSrcDSTab=input_tif,
-        options=warp_opts
-    )
-    ds = None  # Release dataset
+    with stage("warp", inputs=[input_tif], outputs=[output_tif],
+               pixels=ref_width * ref_height):
+        ds = gdal.Warp(
+            destNameOrDestDS=output_tif,
+            srcDSOrSrcDSTab=input_tif,
+            options=warp_opts
+        )
+        ds = None  # Release dataset
     print(f"[warp_exact_grid] {input_tif} -> {output_tif}")
 
 
-def create_multiband(final_multiband_tif: str, list_of_tifs: list[str]) -> None:
+def select_bands(list_of_tifs: list[str], bands: list[str] | None = None) -> list[str]:
+    """
+    Pick the files of the requested bands, in the requested order.
+
+    :param list_of_tifs: List of paths to single-band TIFF files
+    :param bands: Band names (file base names without .tif), or None for all
+    :return: The selected paths
+    :raises ValueError: If a requested band has no file
+    """
+    if bands is None:
+        return list(list_of_tifs)
+    by_name = {os.path.splitext(os.path.basename(str(t)))[0]: str(t) for t in list_of_tifs}
+    missing = [b for b in bands if b not in by_name]
+    if missing:
+        raise ValueError(f"Unknown bands: {missing}")
+    return [by_name[b] for b in bands]
+
+
+def common_data_type(list_of_tifs: list[str]) -> int:
+    """
+    Smallest GDAL data type that holds the raw values of every input
+    (e.g. Int16 for Int16 + Byte layers), so no band is truncated or inflated.
+    """
+    data_type = None
+    for tif in list_of_tifs:
+        ds = gdal.Open(str(tif))
+        band_type = ds.GetRasterBand(1).DataType
+        data_type = band_type if data_type is None else gdal.DataTypeUnion(data_type, band_type)
+        ds = None
+    return data_type
+
+
+def multiband_nodata(list_of_tifs: list[str], data_type: int) -> float | None:
+    """
+    The single nodata value of a multiband GeoTIFF built from the inputs (a
+    GeoTIFF keeps one nodata tag for all of its bands): the first input
+    nodata value that 'data_type' can hold, or None if there is none.
+    """
+    np_type = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(data_type))
+    for tif in list_of_tifs:
+        ds = gdal.Open(str(tif))
+        nodata = ds.GetRasterBand(1).GetNoDataValue()
+        ds = None
+        if nodata is None:
+            continue
+        if np.issubdtype(np_type, np.integer):
+            info = np.iinfo(np_type)
+            if np.isnan(nodata) or nodata != int(nodata) or not info.min <= nodata <= info.max:
+                continue
+        return nodata
+    return None
+
+
+def remap_nodata(arr: np.ndarray, src_nodata: float | None, dst_nodata: float | None,
+                 np_type) -> np.ndarray:
+    """
+    Cast a block to 'np_type', writing its 'src_nodata' pixels as 'dst_nodata'.
+
+    :param arr: Block read from one input band
+    :param src_nodata: Nodata value of the input band, or None
+    :param dst_nodata: Nodata value of the output file, or None (no remap)
+    :param np_type: NumPy type of the output
+    :return: The block in 'np_type'
+    :raises ValueError: If a valid pixel equals 'dst_nodata' (it would read back as nodata)
+    """
+    out = arr.astype(np_type)
+    if dst_nodata is None:
+        return out
+    mask = None
+    if src_nodata is not None:
+        mask = np.isnan(arr) if np.isnan(src_nodata) else arr == src_nodata
+    valid = arr if mask is None else arr[~mask]
+    if (np.isnan(valid) if np.isnan(dst_nodata) else valid == dst_nodata).any():
+        raise ValueError(f"valid pixels equal the output nodata {dst_nodata}")
+    if mask is not None:
+        out[mask] = dst_nodata
+    return out
+
+
+def write_multiband(output_tif: str, list_of_tifs: list[str], data_type: int,
+                    creation_options: list[str]) -> None:
+    """
+    Write single-band rasters as the bands of one GeoTIFF, block by block.
+
+    Every band's nodata pixels are remapped to one file-wide value (see
+    'multiband_nodata'), and blocks left entirely nodata are not written
+    (SPARSE_OK), so they read back as that same value. Band names are the
+    file base names; scale/offset stay per band.
+
+    :param output_tif: Output path
+    :param list_of_tifs: Single-band rasters on the same grid
+    :param data_type: GDAL data type of the output
+    :param creation_options: GTiff creation options (interleave, compression...)
+    :raises ValueError: If a valid pixel equals the file-wide nodata
+    """
+    np_type = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(data_type))
+    nodata = multiband_nodata(list_of_tifs, data_type)
+    datasets = [gdal.Open(str(tif)) for tif in list_of_tifs]
+    first = datasets[0]
+    driver = gdal.GetDriverByName("GTiff")
+    out_ds = driver.Create(str(output_tif), first.RasterXSize, first.RasterYSize,
+                           len(datasets), data_type, options=creation_options)
+    out_ds.SetGeoTransform(first.GetGeoTransform())
+    out_ds.SetProjection(first.GetProjection())
+    for i, ds_in in enumerate(datasets):
+        in_band = ds_in.GetRasterBand(1)
+        out_band = out_ds.GetRasterBand(i + 1)
+        out_band.SetDescription(Path(list_of_tifs[i]).stem)
+        if nodata is not None:
+            out_band.SetNoDataValue(nodata)
+        if in_band.GetScale() is not None:
+            out_band.SetScale(in_band.GetScale())
+        if in_band.GetOffset() is not None:
+            out_band.SetOffset(in_band.GetOffset())
+
+    # Windows outside, bands inside: a pixel-interleaved tile is encoded once
+    for col, row, cols, rows in chunk_windows(first.RasterXSize, first.RasterYSize, BLOCK_SIZE):
+        for i, ds_in in enumerate(datasets):
+            in_band = ds_in.GetRasterBand(1)
+            block = remap_nodata(in_band.ReadAsArray(col, row, cols, rows),
+                                 in_band.GetNoDataValue(), nodata, np_type)
+            if nodata is not None and is_all_nodata(block, nodata):
+                continue  # left sparse: reads back as the file nodata
+            out_ds.GetRasterBand(i + 1).WriteArray(block, col, row)
+    out_ds = None
+    datasets = None
+
+
+def create_multiband(final_multiband_tif: str, list_of_tifs: list[str],
+                     bands: list[str] | None = None, output_type: int | None = None) -> None:
     """
     Combine multiple single-band GeoTIFF files (already matching in size
     and projection) into a single multi-band GeoTIFF. Each file will become
     a separate band in the output file. The band name is set to the file's
     base name (excluding .tif).
     
-    - Uses a temporary VRT to aggregate sources in separate bands
-    - Then translates the VRT to a single GeoTIFF with DEFLATE compression
+    - Reads the inputs block by block and writes one pixel-interleaved
+      GeoTIFF with DEFLATE compression ('write_multiband')
+    - Raw values are kept (no unscale); each band keeps its scale/offset
+      as metadata
+    - The file has a single nodata value: each band's nodata pixels are
+      written as that value, so bands with different nodata (e.g. 65535
+      and -32768) stay masked
     
     :param final_multiband_tif: Path to the final multi-band TIFF
     :param list_of_tifs: List of paths to single-band TIFF files
+    :param bands: Band names to include, in order (default: all files)
+    :param output_type: GDAL data type of the output (default: the common
+                        type of the inputs, see 'common_data_type'). This is
+                        a plain cast; use 'band_types' for per-band types
+    :raises ValueError: If a valid pixel equals the file-wide nodata
     """
-    vrt_temp = "temp_mosaic.vrt"
+    list_of_tifs = select_bands(list_of_tifs, bands)
+    if output_type is None:
+        output_type = common_data_type(list_of_tifs)
 
-    # Build a VRT with each input as a separate band
-    vrt_ds = gdal.BuildVRT(
-        destName=vrt_temp,
-        srcDSOrSrcDSTab=list_of_tifs,
-        separate=True
-    )
-    
-    if vrt_ds:
-        # Rename each band using the file name without extension
-        for i, tif_path in enumerate(list_of_tifs):
-            band_i = vrt_ds.GetRasterBand(i + 1)
-            base_name = os.path.splitext(os.path.basename(tif_path))[0]
-            band_i.SetDescription(base_name)
-        vrt_ds.FlushCache()
-        vrt_ds = None
-
-    # Translate the VRT into a single compressed GeoTIFF
-    translate_opts = gdal.TranslateOptions(
-        format="GTiff",
-        outputType=gdal.GDT_Float32,
-        creationOptions=[
+    with stage("merge", inputs=list_of_tifs, outputs=[final_multiband_tif],
+               bands=len(list_of_tifs)):
+        write_multiband(final_multiband_tif, list_of_tifs, output_type, [
             "TILED=YES",
             "BLOCKXSIZE=1024",
             "BLOCKYSIZE=1024",
             "INTERLEAVE=PIXEL",
             "COMPRESS=DEFLATE",
+            "SPARSE_OK=TRUE",  # all-nodata tiles are not written
             "BIGTIFF=YES"
-        ]
-    )
-    out_ds = gdal.Translate(
-        destName=final_multiband_tif,
-        srcDS=vrt_temp,
-        options=translate_opts
-    )
-    out_ds = None
-
-    # Clean up the temporary VRT
-    if os.path.exists(vrt_temp):
-        os.remove(vrt_temp)
+        ])
 
     print(f"[create_multiband] Created multiband: {final_multiband_tif}")
 
@@ -169,6 +296,11 @@ if __name__ == "__main__":
     """
     Main entry point. Adjust paths as needed.
     """
+    from grid_align import crop_to_grid
+    from incremental import build_crops, update_multiband
+    from tiled_warp import CREATION_OPTIONS
+    from verify import VerificationQueue, verify_tiff
+
     ref_tif = "/home/contreras/Documents/GitHub/download_20m/elevation.tif"
     ref_info = get_raster_info(ref_tif)
 
@@ -178,16 +310,31 @@ if __name__ == "__main__":
     dir_crop = Path("/home/contreras/Documents/GitHub/download_20m/crop3")
     dir_crop.mkdir(exist_ok=True)
 
-    final_tifs = []
+    # Each new crop is verified in the background while the next one is
+    # produced; bad crops are quarantined and produced again.
+    checks = VerificationQueue(dir_crop / "quarantine")
 
-    # Warp each input TIF to match the reference grid
-    for path_img in path_images:
-        out_name = dir_crop / path_img.name
-        warp_exact_grid(str(path_img), str(out_name), ref_info)
-        final_tifs.append(str(out_name))
+    def crop_and_verify(src, dst):
+        crop_to_grid(src, dst, ref_info)
+        checks.submit(dst, retry=lambda: crop_to_grid(src, dst, ref_info))
+
+    # Warp each input TIF to match the reference grid (window copy when aligned).
+    # Only inputs that changed since the last run are processed again.
+    final_tifs, _ = build_crops(
+        path_images,
+        dir_crop,
+        crop_and_verify,
+        {"ref": ref_info, "creation_options": CREATION_OPTIONS, "resample": "near"},
+    )
+    failed = checks.join()
+    if failed:
+        raise RuntimeError(f"Crops still corrupt after retrying: {failed}")
 
-    # Create a multi-band output
+    # Create (or update in place) the multi-band output, then check it
     final_multiband = dir_crop / "CHELSA_multibanda_NOcompress.tif"
-    create_multiband(str(final_multiband), final_tifs)
+    update_multiband(final_multiband, final_tifs, create_multiband)
+    result = verify_tiff(final_multiband)
+    if not result["ok"]:
+        raise RuntimeError(f"Corrupt multiband {final_multiband}: {result['errors'][:3]}")
 
     print("Process completed!")
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Integrity checks for downloaded and produced rasters.
+
+- 'download_verified' streams a download to '<file>.part', hashing it on
+  the fly, and only renames it into place when the byte count matches
+  Content-Length (and the SHA-256 matches, when one is known). CHELSA does
+  not publish checksums: known ones come from a 'sha256sum'-style list
+  read with 'load_checksums' (e.g. recorded from a trusted download).
+  Without one, only Content-Length and the TIFF structure are checked.
+- 'verify_tiff' checks a GeoTIFF structurally: the IFD parses, every
+  tile/strip lies inside the file, and a sample of blocks decodes. With
+  full=True every block is decoded, in parallel, for archive checks.
+- 'VerificationQueue' runs 'verify_tiff' in background threads while the
+  pipeline keeps downloading and processing. Bad files are moved to a
+  quarantine directory and handed back to a retry callback (re-download,
+  re-crop...) which is re-verified in turn.
+"""
+
+import hashlib
+import os
+import queue
+import random
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from osgeo import gdal
+
+from tiff_layout import TiffLayoutError, read_layout
+
+DOWNLOAD_CHUNK = 1024 * 1024
+
+
+class DownloadError(RuntimeError):
+    """The download failed, was truncated or did not match its checksum."""
+
+
+def load_checksums(path) -> dict:
+    """
+    Read a checksum list in 'sha256sum' format ("<hex digest>  <file>" per line).
+
+    :param path: Checksum file, or None
+    :return: {file name: SHA-256}; empty if 'path' is None
+    """
+    checksums = {}
+    if path is None:
+        return checksums
+    with open(path) as fh:
+        for line in fh:
+            parts = line.strip().split(maxsplit=1)
+            if len(parts) == 2 and not parts[0].startswith("#"):
+                checksums[Path(parts[1].lstrip("*")).name] = parts[0].lower()
+    return checksums
+
+
+def download_verified(url: str, filename, expected_sha256: str | None = None,
+                      session=None, timeout: float = 60) -> dict:
+    """
+    Download 'url' to 'filename', validating it while streaming.
+
+    :param url: URL to download
+    :param filename: Destination path; written only if the download is complete
+    :param expected_sha256: Known SHA-256 of the file (see 'load_checksums');
+                            if None only Content-Length is enforced
+    :param session: Optional requests.Session to reuse connections
+    :param timeout: Connect/read timeout in seconds
+    :return: Dict with "bytes" and "sha256" of the downloaded file
+    :raises DownloadError: On HTTP errors, short reads or checksum mismatch
+    """
+    import requests
+
+    http = session or requests
+    part = str(filename) + ".part"
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        with http.get(url, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                raise DownloadError(f"{url}: HTTP {response.status_code}")
+            expected_bytes = response.headers.get("Content-Length")
+            with open(part, "wb") as fh:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                    fh.write(chunk)
+                    digest.update(chunk)
+                    received += len(chunk)
+        if expected_bytes is not None and received != int(expected_bytes):
+            raise DownloadError(f"{url}: got {received} of {expected_bytes} bytes")
+        sha256 = digest.hexdigest()
+        if expected_sha256 and sha256 != expected_sha256.lower():
+            raise DownloadError(f"{url}: SHA-256 {sha256} does not match {expected_sha256}")
+    except (DownloadError, OSError, requests.RequestException) as exc:
+        if os.path.exists(part):
+            os.remove(part)
+        if isinstance(exc, DownloadError):
+            raise
+        raise DownloadError(f"{url}: {exc}") from exc
+
+    os.replace(part, filename)
+    return {"bytes": received, "sha256": sha256}
+
+
+def _block_window(layout: dict, index: int) -> tuple[int | None, tuple[int, int, int, int]]:
+    """(1-based band or None for all bands, pixel window) of block 'index'."""
+    per_band = layout["blocks_across"] * layout["blocks_down"]
+    band = index // per_band + 1 if layout["planar_config"] == 2 else None
+    rest = index % per_band
+    bw, bh = layout["block_width"], layout["block_height"]
+    x0 = (rest % layout["blocks_across"]) * bw
+    y0 = (rest // layout["blocks_across"]) * bh
+    return band, (x0, y0, min(bw, layout["width"] - x0), min(bh, layout["height"] - y0))
+
+
+def _decode_blocks(path: str, layout: dict, indices: list[int], workers: int) -> list[str]:
+    """Decode the given blocks through GDAL; return one error message per failing block."""
+    local = threading.local()
+
+    def decode(index):
+        ds = getattr(local, "ds", None)
+        if ds is None:
+            ds = local.ds = gdal.Open(path)
+        band, (x0, y0, xsize, ysize) = _block_window(layout, index)
+        try:
+            if band is None:
+                arr = ds.ReadAsArray(x0, y0, xsize, ysize)
+            else:
+                arr = ds.GetRasterBand(band).ReadAsArray(x0, y0, xsize, ysize)
+        except RuntimeError as exc:
+            return f"block {index}: {exc}"
+        return f"block {index}: decode failed" if arr is None else None
+
+    if workers <= 1:
+        results = map(decode, indices)
+        return [msg for msg in results if msg]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [msg for msg in pool.map(decode, indices) if msg]
+
+
+def verify_tiff(path, full: bool = False, sample: int = 16, workers: int | None = None) -> dict:
+    """
+    Check that a GeoTIFF is complete and decodable.
+
+    :param path: TIFF to check
+    :param full: Decode every block instead of a sample
+    :param sample: Number of non-empty blocks decoded when full is False
+                   (the first and last blocks are always included)
+    :param workers: Decoder threads (default: all CPUs when full, else 1)
+    :return: Dict with "path", "ok", "errors" (list of messages) and
+             "blocks_checked"
+    """
+    path = str(path)
+    errors = []
+    result = {"path": path, "ok": False, "errors": errors, "blocks_checked": 0}
+    try:
+        layout = read_layout(path)
+    except (OSError, TiffLayoutError) as exc:
+        errors.append(f"layout: {exc}")
+        return result
+
+    # Every written block must lie inside the file (catches truncation)
+    present = []
+    for index, (offset, count) in enumerate(zip(layout["offsets"], layout["byte_counts"])):
+        if count == 0:
+            continue  # sparse block
+        if offset == 0 or offset + count > layout["file_size"]:
+            errors.append(f"block {index}: bytes {offset}+{count} outside file "
+                          f"of {layout['file_size']} bytes")
+        else:
+            present.append(index)
+    if errors:
+        return result
+
+    if gdal.Open(path) is None:
+        errors.append("GDAL cannot open the file")
+        return result
+
+    if full:
+        indices = present
+        workers = workers or os.cpu_count() or 1
+    else:
+        indices = sorted(set(present[:1] + present[-1:] +
+                             random.sample(present, min(sample, len(present)))))
+        workers = workers or 1
+    errors.extend(_decode_blocks(path, layout, indices, workers))
+    result["blocks_checked"] = len(indices)
+    result["ok"] = not errors
+    return result
+
+
+def quarantine(path, quarantine_dir) -> str:
+    """
+    Move a bad file into 'quarantine_dir' without overwriting earlier ones.
+
+    :return: New path of the file
+    """
+    quarantine_dir = Path(quarantine_dir)
+    quarantine_dir.mkdir(parents=True, exist_ok=True)
+    target = quarantine_dir / Path(path).name
+    n = 1
+    while target.exists():
+        target = quarantine_dir / f"{Path(path).name}.{n}"
+        n += 1
+    shutil.move(str(path), target)
+    return str(target)
+
+
+class VerificationQueue:
+    """
+    Background verification with quarantine and automatic retry.
+
+    Usage::
+
+        checks = VerificationQueue("quarantine")
+        for url, filename in downloads:
+            download_file(url, filename)
+            checks.submit(filename, retry=lambda u=url, f=filename: download_file(u, f))
+        failed = checks.join()
+
+    :param quarantine_dir: Where bad files are moved
+    :param workers: Verifier threads
+    :param full: Decode every block instead of a sample
+    :param max_retries: Retries per file before giving up
+    """
+
+    def __init__(self, quarantine_dir, workers: int = 2, full: bool = False,
+                 max_retries: int = 2):
+        self.quarantine_dir = Path(quarantine_dir)
+        self.full = full
+        self.max_retries = max_retries
+        self.results = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._worker, daemon=True)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, path, retry=None, attempt: int = 0) -> None:
+        """
+        Queue 'path' for verification; returns immediately.
+
+        :param retry: Callable that regenerates the file (re-download, re-crop)
+        :param attempt: Retries already spent on this file
+        """
+        self._queue.put((str(path), retry, attempt))
+
+    def _worker(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            path, retry, attempt = item
+            try:
+                result = verify_tiff(path, full=self.full) if os.path.exists(path) else \
+                    {"path": path, "ok": False, "errors": ["missing"], "blocks_checked": 0}
+                if not result["ok"] and os.path.exists(path):
+                    result["quarantined"] = quarantine(path, self.quarantine_dir)
+                with self._lock:
+                    self.results[path] = result
+                if not result["ok"]:
+                    print(f"[verify] {path} failed: {result['errors'][:3]}")
+                    if retry is not None and attempt < self.max_retries:
+                        retry()
+                        self.submit(path, retry, attempt + 1)
+            except Exception as exc:  # keep the worker alive for the other files
+                with self._lock:
+                    self.results[path] = {"path": path, "ok": False,
+                                          "errors": [f"{type(exc).__name__}: {exc}"],
+                                          "blocks_checked": 0}
+            finally:
+                self._queue.task_done()
+
+    def join(self) -> list[str]:
+        """
+        Wait until every queued file (and its retries) is verified, then stop
+        the workers.
+
+        :return: Paths that are still bad after all retries
+        """
+        self._queue.join()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        return sorted(path for path, result in self.results.items() if not result["ok"])
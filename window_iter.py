@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Parallel, prefetched sliding-window iterator over large rasters.
+
+Walks any pipeline output window by window, like the block loop in
+'partial_merge_bands_to_tiff' or 'plot_multiple_subwindows' in
+'partialread.r', but reads the next windows in a background thread pool
+while the caller works on the current one.
+
+Windows are yielded in block-aligned order (block row by block row), so
+consecutive reads hit the same compressed tiles and the GDAL block cache.
+With skip_nodata=True, windows that are entirely nodata are dropped.
+When every selected band has a nodata value, windows whose tiles are all
+sparse are skipped without reading. Without a nodata value a sparse tile
+reads as raw 0, which is data, so nothing is skipped.
+
+Example (visual tiling with 50% overlap)::
+
+    for (col, row, cols, rows), arr in iter_windows("crop.tif", 1024, overlap=512):
+        plot(arr[0])
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal
+
+from tiff_layout import TiffLayoutError, block_index, read_layout
+
+
+def _starts(length: int, size: int, step: int) -> list[int]:
+    """Window origins along one axis; stops once a window reaches the edge."""
+    starts = [0]
+    while starts[-1] + size < length:
+        starts.append(starts[-1] + step)
+    return starts
+
+
+def plan_windows(width: int, height: int, window_size, stride=None, overlap: int = 0,
+                 block_size=(1, 1)) -> list[tuple[int, int, int, int]]:
+    """
+    List the (xoff, yoff, xsize, ysize) windows covering a raster.
+
+    :param width: Raster width in pixels
+    :param height: Raster height in pixels
+    :param window_size: Window edge, int or (xsize, ysize)
+    :param stride: Step between windows, int or (x, y). Defaults to
+                   window_size - overlap
+    :param overlap: Overlap between neighbouring windows when stride is not given
+    :param block_size: (block_x, block_y) of the raster, used to sort the
+                       windows in block-aligned order
+    :return: Windows clipped to the raster, in block-aligned order
+    """
+    wx, wy = (window_size, window_size) if isinstance(window_size, int) else window_size
+    if stride is None:
+        sx, sy = wx - overlap, wy - overlap
+    else:
+        sx, sy = (stride, stride) if isinstance(stride, int) else stride
+    if sx <= 0 or sy <= 0:
+        raise ValueError("stride must be positive (overlap smaller than the window)")
+
+    bx, by = block_size
+    windows = [
+        (xoff, yoff, min(wx, width - xoff), min(wy, height - yoff))
+        for yoff in _starts(height, wy, sy)
+        for xoff in _starts(width, wx, sx)
+    ]
+    windows.sort(key=lambda w: (w[1] // by, w[0] // bx, w[1], w[0]))
+    return windows
+
+
+def _window_is_sparse(layout: dict, bands: list[int], window) -> bool:
+    """True if every tile under the window is sparse (not written) in every band."""
+    xoff, yoff, xsize, ysize = window
+    bw, bh = layout["block_width"], layout["block_height"]
+    for band in bands:
+        for by in range(yoff // bh, (yoff + ysize - 1) // bh + 1):
+            for bx in range(xoff // bw, (xoff + xsize - 1) // bw + 1):
+                if layout["byte_counts"][block_index(layout, band - 1, bx, by)]:
+                    return False
+    return True
+
+
+def iter_windows(path, window_size, stride=None, overlap: int = 0, bands=None,
+                 prefetch: int = 4, workers: int = 4, skip_nodata: bool = False):
+    """
+    Iterate over the windows of a raster with background prefetching.
+
+    :param path: Raster to read
+    :param window_size: Window edge, int or (xsize, ysize)
+    :param stride: Step between windows (default: window_size - overlap)
+    :param overlap: Overlap between neighbouring windows
+    :param bands: 1-based band numbers to read (default: all bands)
+    :param prefetch: Number of windows read ahead of the consumer
+    :param workers: Reader threads
+    :param skip_nodata: Skip windows that are entirely nodata (only bands
+                        with a nodata value can be skipped)
+    :return: Generator of ((xoff, yoff, xsize, ysize), array) with arrays
+             shaped (bands, ysize, xsize)
+    :raises FileNotFoundError: If the raster cannot be opened
+    """
+    path = str(path)
+    ds = gdal.Open(path)
+    if not ds:
+        raise FileNotFoundError(f"Could not open {path}")
+    width, height = ds.RasterXSize, ds.RasterYSize
+    bands = list(bands) if bands is not None else list(range(1, ds.RasterCount + 1))
+    block_size = ds.GetRasterBand(bands[0]).GetBlockSize()
+    nodata = [ds.GetRasterBand(b).GetNoDataValue() for b in bands]
+    ds = None
+
+    layout = None
+    # A sparse tile means "all nodata" only if the band has a nodata value
+    if skip_nodata and all(nd is not None for nd in nodata):
+        try:
+            layout = read_layout(path)
+        except (OSError, TiffLayoutError):
+            layout = None
+
+    windows = plan_windows(width, height, window_size, stride, overlap, block_size)
+    if layout is not None:
+        windows = [w for w in windows if not _window_is_sparse(layout, bands, w)]
+
+    # GDAL datasets are not thread-safe: one handle per reader thread
+    local = threading.local()
+
+    def read(window):
+        handle = getattr(local, "ds", None)
+        if handle is None:
+            handle = local.ds = gdal.Open(path)
+        xoff, yoff, xsize, ysize = window
+        return np.stack([
+            handle.GetRasterBand(b).ReadAsArray(xoff, yoff, xsize, ysize) for b in bands
+        ])
+
+    def all_nodata(arr) -> bool:
+        for i, nd in enumerate(nodata):
+            if nd is None:
+                return False
+            band = arr[i]
+            empty = np.isnan(band) if np.isnan(nd) else band == nd
+            if not empty.all():
+                return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        it = iter(windows)
+        for window in it:
+            pending.append((window, pool.submit(read, window)))
+            if len(pending) >= prefetch:
+                break
+        while pending:
+            window, fut = pending.popleft()
+            nxt = next(it, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(read, nxt)))
+            arr = fut.result()
+            if skip_nodata and all_nodata(arr):
+                continue
+            yield window, arr
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Chunked Zarr cube writer for the aligned CHELSA stack.
+
+The multiband GeoTIFFs from 'try_try.create_multiband' and
+'cog_2.merge_bands_to_tiff' store 70 bands pixel-interleaved in 1024x1024
+tiles, so a random (all bands, 256x256) training patch decodes up to four
+70-band tiles. This module writes the same stack as a Zarr store with a
+configurable (band, y, x) chunking, so a patch read touches only the
+chunks it overlaps and concurrent readers do not share any decode work.
+
+Store layout (readable with xarray.open_zarr):
+
+- data: (band, y, x) array with the raw values of each crop, in the
+  smallest type that holds every input type (e.g. Int16 for Int16 + Byte)
+- band: band names (file stems of the crops), variable-length strings
+- y, x: pixel-centre coordinates from the reference geotransform
+- root attributes: crs_wkt, geotransform, and per-band scale, offset and
+  nodata lists
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import zarr
+from osgeo import gdal, gdal_array
+
+from instrumentation import stage
+from try_try import common_data_type
+
+DEFAULT_CHUNKS = (8, 256, 256)
+
+
+def _create_array(group, name: str, data_or_shape, chunks, dtype, dims, fill_value=None,
+                  compression: str = "zstd", clevel: int = 3):
+    """
+    Create an array in 'group' working with both the zarr 2 and zarr 3 APIs.
+    Blosc with bit-shuffle is used as compressor.
+
+    :param data_or_shape: Shape tuple, or a NumPy array to store directly
+    """
+    shape = data_or_shape if isinstance(data_or_shape, tuple) else data_or_shape.shape
+    if hasattr(group, "create_array"):
+        # zarr >= 3
+        from zarr.codecs import BloscCodec
+
+        arr = group.create_array(
+            name, shape=shape, chunks=chunks, dtype=dtype, fill_value=fill_value,
+            compressors=[BloscCodec(cname=compression, clevel=clevel, shuffle="bitshuffle")],
+            dimension_names=dims,
+        )
+    else:
+        import numcodecs
+
+        arr = group.create_dataset(
+            name, shape=shape, chunks=chunks, dtype=dtype, fill_value=fill_value,
+            compressor=numcodecs.Blosc(cname=compression, clevel=clevel,
+                                       shuffle=numcodecs.Blosc.BITSHUFFLE),
+        )
+        arr.attrs["_ARRAY_DIMENSIONS"] = list(dims)
+    if not isinstance(data_or_shape, tuple):
+        arr[...] = data_or_shape
+    return arr
+
+
+def _zarr_format(group) -> int:
+    """Format version of 'group': 3 for zarr 3 defaults, always 2 with the zarr 2 library."""
+    metadata = getattr(group, "metadata", None)
+    return getattr(metadata, "zarr_format", 2)
+
+
+def _chunk_tasks(shape: tuple, chunks: tuple) -> list[tuple[int, int, int, int, int, int]]:
+    """(b0, b1, y0, y1, x0, x1) for every chunk of a (band, y, x) array."""
+    nb, ny, nx = shape
+    cb, cy, cx = chunks
+    return [
+        (b0, min(b0 + cb, nb), y0, min(y0 + cy, ny), x0, min(x0 + cx, nx))
+        for b0 in range(0, nb, cb)
+        for y0 in range(0, ny, cy)
+        for x0 in range(0, nx, cx)
+    ]
+
+
+def write_zarr_cube(store, input_tifs: list[str], chunks: tuple = DEFAULT_CHUNKS,
+                    compression: str = "zstd", clevel: int = 3,
+                    workers: int | None = None) -> None:
+    """
+    Write single-band GeoTIFFs that share one grid as a chunked Zarr cube.
+
+    Chunks are written in parallel; each task reads its (band, y, x) window
+    from the inputs and writes exactly one Zarr chunk, so writers never
+    touch the same chunk.
+
+    :param store: Output path (directory store) or any zarr store
+    :param input_tifs: Paths to aligned single-band TIFFs, one per band
+    :param chunks: (band, y, x) chunk shape
+    :param compression: Blosc codec name (zstd, lz4, zlib, ...)
+    :param clevel: Compression level
+    :param workers: Number of writer threads (default: all CPUs)
+    :raises RuntimeError: If there are no inputs or they are not aligned
+    """
+    if not input_tifs:
+        raise RuntimeError("No input TIFFs for the cube.")
+    input_tifs = [str(t) for t in input_tifs]
+    workers = workers or os.cpu_count() or 1
+
+    first = gdal.Open(input_tifs[0])
+    if not first:
+        raise FileNotFoundError(f"Could not open {input_tifs[0]}")
+    width, height = first.RasterXSize, first.RasterYSize
+    geotransform = first.GetGeoTransform()
+    projection = first.GetProjection()
+    first = None
+
+    scales, offsets, nodatas = [], [], []
+    for tif in input_tifs:
+        ds = gdal.Open(tif)
+        if not ds:
+            raise FileNotFoundError(f"Could not open {tif}")
+        if (ds.RasterXSize, ds.RasterYSize) != (width, height) or \
+                ds.GetGeoTransform() != geotransform:
+            raise RuntimeError(f"{tif} is not on the same grid as {input_tifs[0]}")
+        band = ds.GetRasterBand(1)
+        scales.append(band.GetScale() if band.GetScale() is not None else 1.0)
+        offsets.append(band.GetOffset() if band.GetOffset() is not None else 0.0)
+        nodatas.append(band.GetNoDataValue())
+        ds = None
+
+    # Mixed input types are promoted, never truncated
+    data_type = common_data_type(input_tifs)
+    np_dtype = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(data_type))
+    band_names = np.array([Path(t).stem for t in input_tifs], dtype=object)
+    shape = (len(input_tifs), height, width)
+    chunks = tuple(min(c, s) for c, s in zip(chunks, shape))
+    fill_value = nodatas[0] if len(set(nodatas)) == 1 and nodatas[0] is not None else None
+
+    group = zarr.open_group(store, mode="w")
+    group.attrs.update({
+        "crs_wkt": projection,
+        "geotransform": list(geotransform),
+        "scale": scales,
+        "offset": offsets,
+        "nodata": nodatas,
+    })
+    data = _create_array(group, "data", shape, chunks, np_dtype, ("band", "y", "x"),
+                         fill_value=fill_value, compression=compression, clevel=clevel)
+    x0, dx, _, y0, _, dy = geotransform
+    # dtype=str: variable-length strings (VLenUTF8 in zarr 2, "string" in zarr 3)
+    _create_array(group, "band", band_names, (len(band_names),), str, ("band",))
+    _create_array(group, "y", y0 + (np.arange(height) + 0.5) * dy, (height,), "f8", ("y",))
+    _create_array(group, "x", x0 + (np.arange(width) + 0.5) * dx, (width,), "f8", ("x",))
+
+    # GDAL datasets are not thread-safe: one handle per input and thread
+    local = threading.local()
+
+    def open_band(index):
+        handles = getattr(local, "handles", None)
+        if handles is None:
+            handles = local.handles = {}
+        if index not in handles:
+            handles[index] = gdal.Open(input_tifs[index])
+        return handles[index].GetRasterBand(1)
+
+    def write_chunk(task):
+        b0, b1, y0_, y1, x0_, x1 = task
+        block = np.empty((b1 - b0, y1 - y0_, x1 - x0_), dtype=np_dtype)
+        for i in range(b0, b1):
+            block[i - b0] = open_band(i).ReadAsArray(x0_, y0_, x1 - x0_, y1 - y0_)
+        data[b0:b1, y0_:y1, x0_:x1] = block
+
+    with stage("zarr_cube", inputs=input_tifs, bands=len(input_tifs), chunks=list(chunks)):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # list() re-raises the first worker exception, if any
+            list(pool.map(write_chunk, _chunk_tasks(shape, chunks)))
+        # Consolidated metadata is a v2 feature: zarr 3 warns about it for v3 stores
+        if _zarr_format(group) == 2:
+            zarr.consolidate_metadata(store)
+    print(f"[write_zarr_cube] Created cube {shape} chunks={chunks}: {store}")
+
+
+def read_patch(store, row: int, col: int, size: int, bands=None) -> np.ndarray:
+    """
+    Read a (bands, size, size) patch from a cube written by 'write_zarr_cube'.
+    Only the chunks overlapping the patch are fetched and decoded.
+
+    :param store: Cube path or zarr store
+    :param row: Top row of the patch
+    :param col: Left column of the patch
+    :param size: Patch edge in pixels
+    :param bands: Optional list of band indices (default: all bands)
+    :return: NumPy array with the raw (still scaled) values
+    """
+    data = zarr.open_group(store, mode="r")["data"]
+    if bands is None:
+        return data[:, row:row + size, col:col + size]
+    return data.get_orthogonal_selection((list(bands), slice(row, row + size),
+                                          slice(col, col + size)))